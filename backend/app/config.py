@@ -6,7 +6,154 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = ""
     GEMINI_API_KEY: str = ""
     GEMINI_MODEL: str = "gemini-1.5-flash"
+    OPENAI_MODEL: str = "gpt-3.5-turbo"
     LLM_PROVIDER: str = "openai"
+    # Provider to fail over to when LLM_PROVIDER is unavailable (empty disables failover)
+    LLM_FALLBACK_PROVIDER: str = ""
+
+    # Provider HTTP connection pools (kept alive for the life of the process)
+    LLM_MAX_CONNECTIONS: int = 20
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    LLM_KEEPALIVE_EXPIRY: float = 30.0
+
+    # Resilience
+    LLM_REQUEST_TIMEOUT: float = 60.0
+    LLM_MAX_RETRIES: int = 3
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 30.0
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    LLM_CIRCUIT_RECOVERY_SECONDS: float = 30.0
+
+    # Ingestion
+    INGEST_BATCH_SIZE: int = 1000
+    # Directory mailbox files may be imported from (defaults to the data/ directory)
+    MAILBOX_IMPORT_DIR: str = ""
+
+    # Processing pipeline
+    PROCESSING_CONCURRENCY: int = 8
+    PROCESSING_QUEUE_SIZE: int = 32
+    # How long an email claimed by a processing run is kept from other runs
+    PROCESSING_CLAIM_SECONDS: int = 600
+    # Ask for category, action items and summary in a single structured request
+    LLM_COMBINED_ANALYSIS: bool = True
+    # Categorize short emails several at a time before per-email analysis
+    LLM_BATCH_CATEGORIZATION: bool = True
+    PROCESSING_BATCH_SIZE: int = 20
+    LLM_BATCH_TOKEN_BUDGET: int = 3000
+    LLM_BATCH_MAX_EMAIL_CHARS: int = 2000
+    # Batch-categorized emails in these categories skip the per-email analysis call
+    SKIP_ANALYSIS_CATEGORIES: str = "Newsletter,Spam"
+
+    # Per-provider request and token limits per minute (0 disables); adapted from
+    # rate-limit headers and 429s at runtime
+    OPENAI_RPM: int = 500
+    OPENAI_TPM: int = 200000
+    GEMINI_RPM: int = 60
+    GEMINI_TPM: int = 1000000
+    # Completion size assumed when budgeting tokens before a call
+    LLM_ESTIMATED_OUTPUT_TOKENS: int = 256
+
+    # Background job queue
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_LEASE_SECONDS: int = 60
+    JOB_HEARTBEAT_SECONDS: int = 10
+    JOB_POLL_SECONDS: float = 1.0
+    JOB_RETRY_BACKOFF_SECONDS: int = 30
+    # Run a worker inside the API process, for single-process deployments
+    EMBEDDED_WORKER: bool = True
+    # Port standalone workers serve Prometheus metrics on (0 disables)
+    WORKER_METRICS_PORT: int = 0
+
+    # How long the active-prompt registry trusts its snapshot without an invalidation
+    PROMPT_CACHE_TTL_SECONDS: int = 60
+
+    # LLM response cache
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PERSISTENT: bool = False
+    LLM_CACHE_MAX_ENTRIES: int = 5000
+    LLM_CACHE_TTL_SECONDS: int = 86400
+
+    # Inbox search index (held in the API process, updated incrementally)
+    SEARCH_INDEX_ENABLED: bool = True
+    # Snapshot file reloaded on startup so only newer emails need indexing (empty disables)
+    SEARCH_INDEX_PATH: str = "search_index.snapshot"
+    SEARCH_SNAPSHOT_SECONDS: int = 300
+    # Polling interval for new emails when change streams are unavailable
+    SEARCH_REFRESH_SECONDS: float = 10.0
+    # Optional sentence-transformers model for semantic search, e.g. all-MiniLM-L6-v2 (empty disables)
+    SEARCH_EMBEDDING_MODEL: str = ""
+    SEARCH_EMBEDDING_BATCH_SIZE: int = 64
+    # Random-hyperplane LSH for approximate nearest neighbours
+    SEARCH_LSH_TABLES: int = 8
+    SEARCH_LSH_BITS: int = 12
+
+    # Mailbox retrieval for the chat agent
+    RETRIEVAL_ENABLED: bool = True
+    RETRIEVAL_CANDIDATES: int = 20
+    RETRIEVAL_TOKEN_BUDGET: int = 1500
+    RETRIEVAL_MAX_EMAIL_TOKENS: int = 300
+    RETRIEVAL_CACHE_MAX_CONVERSATIONS: int = 1000
+    RETRIEVAL_CACHE_TTL_SECONDS: int = 1800
+    # Client-supplied chat context beyond this is truncated
+    CHAT_CONTEXT_MAX_TOKENS: int = 500
+
+    # Chat sessions: older turns are rolled into a running summary past the threshold
+    CHAT_SUMMARY_THRESHOLD_TOKENS: int = 1500
+    CHAT_SUMMARY_MAX_TOKENS: int = 400
+    CHAT_KEEP_RECENT_TURNS: int = 4
+    CHAT_SESSION_TTL_DAYS: int = 30
+
+    # Near-duplicate detection: emails nearly identical to an analysed one reuse its metadata
+    NEAR_DUPLICATE_ENABLED: bool = True
+    # Max differing SimHash bits (of 64); up to 3 is searched exhaustively, more only partly
+    NEAR_DUPLICATE_MAX_DISTANCE: int = 3
+    # Shorter emails aren't fingerprinted, their hashes are too unstable
+    NEAR_DUPLICATE_MIN_TOKENS: int = 8
+
+    # Local pre-classifier: settles obvious categories before any LLM call
+    PRECLASSIFIER_ENABLED: bool = True
+    PRECLASSIFIER_CONFIDENCE: float = 0.9
+    # LLM labels the linear model needs before its predictions are used
+    PRECLASSIFIER_MIN_EXAMPLES: int = 200
+    PRECLASSIFIER_FEATURE_BITS: int = 17
+    PRECLASSIFIER_LEARNING_RATE: float = 0.5
+    # The categories it learns and predicts; other LLM answers are not learned from
+    PRECLASSIFIER_CATEGORIES: str = "Important,Newsletter,Spam,To-Do"
+    # How often the training process learns new labels and the others reload its model
+    PRECLASSIFIER_SYNC_SECONDS: float = 60.0
+    PRECLASSIFIER_MAX_SENDERS: int = 50000
+    PRECLASSIFIER_BOOTSTRAP_LIMIT: int = 20000
+
+    # Continuous processing of new emails from a change stream (or by polling the unprocessed-emails index)
+    CHANGE_FEED_ENABLED: bool = True
+    # How long to gather new emails into one categorization batch
+    CHANGE_FEED_BATCH_WINDOW_SECONDS: float = 1.0
+    CHANGE_FEED_POLL_SECONDS: float = 2.0
+    CHANGE_FEED_LEASE_SECONDS: int = 30
+    CHANGE_FEED_MAX_ATTEMPTS: int = 3
+
+    # Analysis results are buffered and written in bulk
+    RESULT_SINK_BATCH_SIZE: int = 100
+    RESULT_SINK_FLUSH_SECONDS: float = 0.5
+    RESULT_SINK_MAX_RETRIES: int = 3
+    # Queue a reprocess job for the affected stage when a processing prompt changes
+    REPROCESS_ON_PROMPT_CHANGE: bool = True
+
+    # Compression of list responses (br needs the brotli package)
+    RESPONSE_COMPRESSION_MIN_BYTES: int = 1024
+    RESPONSE_GZIP_LEVEL: int = 5
+    RESPONSE_BROTLI_QUALITY: int = 4
+
+    # Bulk reply drafting
+    BULK_DRAFT_CONCURRENCY: int = 8
+    BULK_DRAFT_MAX_EMAILS: int = 500
+    BULK_DRAFT_INSERT_BATCH: int = 50
+
+    # Materialized inbox statistics: how often deltas are written and counts are recomputed (0 disables)
+    INBOX_STATS_FLUSH_SECONDS: float = 1.0
+    INBOX_STATS_RECONCILE_SECONDS: int = 6 * 3600
+    # Longest a reconciliation may hold back every process's stats flushes
+    INBOX_STATS_RECONCILE_LEASE_SECONDS: int = 600
 
     class Config:
         env_file = ".env"
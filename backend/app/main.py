@@ -1,12 +1,53 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.utils.db import db
+from app.services.prompt_registry import prompt_registry
+from app.services.search_index import search_index
+from app.services.preclassifier import preclassifier
+from app.services.change_feed import change_feed
+from app.services.result_sink import result_sink
+from app.services.inbox_stats import inbox_stats
+from app.services.llm_errors import LLMError, LLMRateLimitError
+from app.services.llm_service import llm_service
+from app.utils.metrics import HTTP_REQUEST_SECONDS
+from app.config import settings
 from contextlib import asynccontextmanager
+import asyncio
+import time
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     db.connect()
+    await db.ensure_indexes()
+    await llm_service.startup()
+    prompt_registry.start()
+    search_index.start()
+    preclassifier.start()
+    inbox_stats.start()
+
+    background = []
+    if settings.EMBEDDED_WORKER:
+        from app.worker import Worker
+        background.append(asyncio.create_task(Worker().run()))
+        if settings.CHANGE_FEED_ENABLED:
+            background.append(asyncio.create_task(change_feed.run()))
+
     yield
+
+    change_feed.stop()
+    for task in background:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await result_sink.stop()
+    await inbox_stats.stop()
+    await preclassifier.stop()
+    await search_index.stop()
+    await prompt_registry.stop()
+    await llm_service.shutdown()
     db.close()
 
 app = FastAPI(title="Email Productivity Agent", lifespan=lifespan)
@@ -21,12 +62,40 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-from app.routes import emails, prompts, agent
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep cardinality bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=str(status)
+        ).observe(time.perf_counter() - start)
+
+@app.exception_handler(LLMError)
+async def llm_error_handler(request: Request, exc: LLMError):
+    headers = {}
+    if isinstance(exc, LLMRateLimitError) and exc.retry_after:
+        headers["Retry-After"] = str(int(exc.retry_after))
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=headers)
+
+from app.routes import emails, prompts, agent, jobs, metrics, stats
 app.include_router(emails.router)
 app.include_router(prompts.router)
 app.include_router(agent.router)
+app.include_router(jobs.router)
+app.include_router(metrics.router)
+app.include_router(stats.router)
 
 @app.get("/")
 async def root():
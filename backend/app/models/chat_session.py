@@ -0,0 +1,39 @@
+from pydantic import BaseModel, Field, ConfigDict
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from bson import ObjectId
+from app.models.email import PyObjectId
+
+class ChatTurn(BaseModel):
+    id: PyObjectId = Field(default_factory=PyObjectId)
+    role: str  # user, assistant
+    content: str
+    tokens: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    model_config = ConfigDict(
+        arbitrary_types_allowed=True,
+        json_encoders={ObjectId: str}
+    )
+
+class ChatSession(BaseModel):
+    id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
+    title: Optional[str] = None
+    # Snapshot of the email the session is about, if any
+    email: Optional[Dict[str, Any]] = None
+    # Rolled-up older turns; recent holds the turns not summarized yet
+    summary: str = ""
+    summary_version: int = 0
+    recent: List[ChatTurn] = []
+    recent_tokens: int = 0
+    turn_count: int = 0
+    # When the session's messages last had their expiry pushed back
+    messages_active_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+        json_encoders={ObjectId: str}
+    )
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from typing import List, Optional, Union
 from datetime import datetime
 from bson import ObjectId
 from app.models.email import PyObjectId
@@ -11,9 +11,22 @@ class Draft(BaseModel):
     body: str
     status: str = "generated"  # generated, edited, approved
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Version of the reply prompt that wrote it (see prompt_registry.prompt_version)
+    prompt_version: Optional[str] = None
 
     model_config = ConfigDict(
         populate_by_name=True,
         arbitrary_types_allowed=True,
         json_encoders={ObjectId: str}
     )
+
+class BulkDraftRequest(BaseModel):
+    """Emails to draft replies to: email_ids, or a filter of categories, sender and is_read."""
+    email_ids: Optional[List[str]] = None
+    # A list, or a comma-separated string
+    categories: Optional[Union[List[str], str]] = None
+    sender: Optional[str] = None
+    is_read: Optional[bool] = None
+    limit: Optional[int] = Field(default=None, ge=1)
+    instructions: str = ""
+    force: bool = False
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict, GetCoreSchemaHandler
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from bson import ObjectId
 from pydantic_core import core_schema
@@ -26,8 +26,15 @@ class ActionItem(BaseModel):
 
 class EmailMetadata(BaseModel):
     category: Optional[str] = None
+    # llm, or the pre-classifier stage that settled it (rules, sender, model)
+    category_source: Optional[str] = None
+    category_confidence: Optional[float] = None
+    # Root email of the near-duplicate cluster this analysis was copied from
+    duplicate_of: Optional[str] = None
     action_items: List[ActionItem] = []
     summary: Optional[str] = None
+    # Prompt version (see prompt_registry.prompt_version) behind each LLM-produced stage
+    prompt_versions: Dict[str, str] = {}
 
 class Email(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
@@ -44,3 +51,29 @@ class Email(BaseModel):
         arbitrary_types_allowed=True,
         json_encoders={ObjectId: str}
     )
+
+class EmailListItem(BaseModel):
+    """Lightweight inbox row: everything but the body, plus a short snippet."""
+    id: Optional[PyObjectId] = Field(default=None, alias="_id")
+    sender: str
+    subject: str
+    snippet: str = ""
+    timestamp: datetime
+    is_read: bool = False
+    processed: bool = False
+    metadata: EmailMetadata = Field(default_factory=EmailMetadata)
+
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+        json_encoders={ObjectId: str}
+    )
+
+class SearchHit(EmailListItem):
+    score: float
+
+class SearchResponse(BaseModel):
+    results: List[SearchHit]
+    total: int
+    mode: str
+    took_ms: float
@@ -0,0 +1,27 @@
+from pydantic import BaseModel, Field, ConfigDict
+from typing import Any, Dict, Optional
+from datetime import datetime
+from bson import ObjectId
+from app.models.email import PyObjectId
+
+class Job(BaseModel):
+    id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
+    type: str  # ingest, process
+    params: Dict[str, Any] = {}
+    status: str = "queued"  # queued, running, completed, failed
+    progress: Dict[str, Any] = {}
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    max_attempts: int = 3
+    worker_id: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    run_after: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    model_config = ConfigDict(
+        populate_by_name=True,
+        arbitrary_types_allowed=True,
+        json_encoders={ObjectId: str}
+    )
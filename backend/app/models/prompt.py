@@ -9,6 +9,8 @@ class Prompt(BaseModel):
     type: str  # categorization, extraction, reply, chat
     template: str
     is_active: bool = True
+    # Bumped whenever the template changes, so results can tell which text produced them
+    version: int = 1
 
     model_config = ConfigDict(
         populate_by_name=True,
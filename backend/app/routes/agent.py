@@ -1,94 +1,244 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Request
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Optional, Tuple
+from app.config import settings
 from app.services.llm_service import llm_service
+from app.services.retrieval import RetrievedContext, retrieve_context, truncate_to_tokens
+from app.services import chat_sessions
+from app.models.chat_session import ChatSession, ChatTurn
+from app.services.prompt_registry import prompt_registry
+from app.services.drafts import DEFAULT_REPLY_PROMPT, DRAFT_SYSTEM_PROMPT, draft_document, generate_drafts, render_draft_prompt
 from app.utils.db import db
-from app.models.draft import Draft
+from app.utils.serialization import json_response, model_projection
+from app.models.draft import BulkDraftRequest, Draft
 from bson import ObjectId
 from datetime import datetime
+import json
 
 router = APIRouter(prefix="/api/agent", tags=["Agent"])
 
-@router.post("/chat")
-async def chat_agent(payload: dict = Body(...)):
+async def load_session(payload: dict) -> Optional[dict]:
+    session_id = payload.get("session_id")
+    if not session_id:
+        return None
+    session = await chat_sessions.get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return session
+
+async def build_chat_prompt(payload: dict, session: Optional[dict] = None) -> Tuple[str, RetrievedContext]:
     message = payload.get("message")
     email = payload.get("email")
-    context = payload.get("context", "")
-    
+    # Cap pasted context; retrieval supplies the rest of the mailbox
+    context = truncate_to_tokens(payload.get("context") or "", settings.CHAT_CONTEXT_MAX_TOKENS)
+
     if not message:
         raise HTTPException(status_code=400, detail="Message is required")
-        
+
     email_content = ""
-    if email:
+    if email and not (session and session.get("email")):
         email_content = f"Subject: {email.get('subject', 'No Subject')}\nFrom: {email.get('sender', 'Unknown')}\nBody:\n{email.get('body', '')}\n"
-            
+
+    retrieved = RetrievedContext()
+    if settings.RETRIEVAL_ENABLED and payload.get("retrieve", True):
+        retrieved = await retrieve_context(
+            message,
+            conversation_id=payload.get("conversation_id") or (str(session["_id"]) if session else None),
+            exclude_ids=[str(email["_id"])] if email and email.get("_id") else []
+        )
+    mailbox_content = f"\nRelated emails from the mailbox:\n\n{retrieved.text}\n" if retrieved.text else ""
+
+    if session:
+        # The session prefix stays byte-identical between turns; only this tail changes
+        email_section = f"Here is the email the user is asking about:\n\n{email_content}" if email_content else ""
+        prompt = chat_sessions.session_prefix(session) + f"""{email_section}{mailbox_content}
+User message: {message}
+Context: {context}
+"""
+        return prompt, retrieved
+
     prompt = f"""
 You are an AI email assistant.
 
 Here is the email the user is asking about:
 
 {email_content}
-
+{mailbox_content}
 User message: {message}
 Context: {context}
 """
-    response = await llm_service.generate_text(prompt, system_prompt="You are a helpful email assistant.")
-    
-    return {"response": response}
+    return prompt, retrieved
 
-@router.post("/draft")
-async def generate_draft(payload: dict = Body(...)):
+async def build_draft_prompt(payload: dict) -> Tuple[str, str]:
+    """The draft prompt and the version of the reply prompt it uses."""
     email = payload.get("email")
     instructions = payload.get("instructions", "")
-    
+
     if not email:
         raise HTTPException(status_code=400, detail="Email object is required")
-        
-    # Fetch Reply Prompt
-    prompts_collection = db.get_db()["prompts"]
-    reply_prompt_doc = await prompts_collection.find_one({"type": "reply", "is_active": True})
-    reply_prompt_text = reply_prompt_doc["template"] if reply_prompt_doc else "Draft a polite reply to this email."
-    
-    prompt = f"""
-Original Email:
-Subject: {email.get('subject', 'No Subject')}
-From: {email.get('sender', 'Unknown')}
-Body: {email.get('body', '')}
 
-Instructions: {instructions}
+    reply_prompt_text, version = await prompt_registry.get_versioned("reply", DEFAULT_REPLY_PROMPT)
+    return render_draft_prompt(email, instructions, reply_prompt_text), version
 
-{reply_prompt_text}
-"""
-    
-    draft_content = await llm_service.generate_text(prompt, system_prompt="You are an email drafting assistant.")
-    
-    # Create Draft
-    # Note: We still need an email_id for the draft record. 
-    # If it's a mock email, we might not have a valid ObjectId.
-    # We will try to use the provided _id, or generate a new one if invalid.
-    email_id_str = email.get('_id')
-    try:
-        oid = ObjectId(email_id_str)
-    except:
-        oid = ObjectId() # Generate a new ID if invalid/mock
-    
-    draft = Draft(
-        email_id=oid,
-        subject=f"Re: {email.get('subject', 'No Subject')}",
-        body=draft_content,
-        status="generated"
+def draft_use_cache(payload: dict) -> bool:
+    """force asks for a new draft, so it must not be served the previous one from the LLM cache."""
+    return bool(payload.get("use_cache", True)) and not payload.get("force")
+
+async def save_draft(email: dict, draft_content: str, prompt_version: Optional[str] = None) -> str:
+    new_draft = await db.get_db()["drafts"].insert_one(draft_document(email, draft_content, prompt_version))
+    return str(new_draft.inserted_id)
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    
-    drafts_collection = db.get_db()["drafts"]
-    new_draft = await drafts_collection.insert_one(draft.model_dump(by_alias=True, exclude=["id"]))
-    
-    return {"draft_id": str(new_draft.inserted_id), "content": draft_content}
 
-from typing import List
+@router.post("/chat")
+async def chat_agent(payload: dict = Body(...)):
+    session = await load_session(payload)
+    prompt, retrieved = await build_chat_prompt(payload, session)
+    response = await llm_service.generate_text(prompt, system_prompt="You are a helpful email assistant.", use_cache=payload.get("use_cache", True), priority="interactive", operation="chat")
+
+    if session:
+        await chat_sessions.record_turn(session, payload["message"], response)
+    return {"response": response, "sources": retrieved.sources, "session_id": payload.get("session_id")}
+
+@router.post("/chat/stream")
+async def chat_agent_stream(payload: dict = Body(...)):
+    session = await load_session(payload)
+    prompt, retrieved = await build_chat_prompt(payload, session)
+
+    async def events():
+        yield sse_event({"sources": retrieved.sources}, event="sources")
+        parts = []
+        try:
+            async for token in llm_service.stream_text(prompt, system_prompt="You are a helpful email assistant.", use_cache=payload.get("use_cache", True), priority="interactive", operation="chat"):
+                parts.append(token)
+                yield sse_event({"token": token})
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, event="error")
+            return
+
+        if session:
+            await chat_sessions.record_turn(session, payload["message"], "".join(parts).strip())
+        yield sse_event({}, event="done")
+
+    return sse_response(events())
+
+@router.post("/sessions", status_code=201)
+async def create_chat_session(payload: dict = Body(default={})):
+    """Start a server-side chat session; pass its session_id to /chat to continue it."""
+    session = await chat_sessions.create_session(payload.get("email"), payload.get("title"))
+    return {"session_id": str(session["_id"])}
+
+@router.get("/sessions/{session_id}", response_model=ChatSession)
+async def get_chat_session(session_id: str):
+    session = await chat_sessions.get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return session
+
+@router.get("/sessions/{session_id}/messages", response_model=List[ChatTurn])
+async def get_chat_messages(session_id: str, limit: int = 200):
+    session = await chat_sessions.get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return await chat_sessions.get_messages(session["_id"], limit)
+
+@router.delete("/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    session = await chat_sessions.get_session(session_id)
+    if not session or not await chat_sessions.delete_session(session["_id"]):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return {"message": "Chat session deleted"}
+
+@router.post("/draft")
+async def generate_draft(payload: dict = Body(...)):
+    prompt, version = await build_draft_prompt(payload)
+    draft_content = await llm_service.generate_text(prompt, system_prompt=DRAFT_SYSTEM_PROMPT, use_cache=draft_use_cache(payload), priority="interactive", operation="draft")
+
+    draft_id = await save_draft(payload["email"], draft_content, version)
+    return {"draft_id": draft_id, "content": draft_content}
+
+@router.post("/draft/stream")
+async def generate_draft_stream(payload: dict = Body(...)):
+    prompt, version = await build_draft_prompt(payload)
+
+    async def events():
+        parts = []
+        try:
+            async for token in llm_service.stream_text(prompt, system_prompt=DRAFT_SYSTEM_PROMPT, use_cache=draft_use_cache(payload), priority="interactive", operation="draft"):
+                parts.append(token)
+                yield sse_event({"token": token})
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, event="error")
+            return
+
+        # Persist only once the full draft has arrived
+        draft_content = "".join(parts).strip()
+        draft_id = await save_draft(payload["email"], draft_content, version)
+        yield sse_event({"draft_id": draft_id, "content": draft_content}, event="done")
+
+    return sse_response(events())
+
+@router.post("/drafts/bulk")
+async def generate_drafts_bulk(request: Request, payload: BulkDraftRequest):
+    """Draft replies for many emails, streaming one result per email as NDJSON (or SSE with Accept: text/event-stream).
+
+    Select emails with email_ids, or with a filter of categories, is_read and sender
+    (newest first, up to limit). Emails that already have a draft from the current
+    reply prompt are skipped unless force is true.
+    """
+    limit = min(payload.limit or settings.BULK_DRAFT_MAX_EMAILS, settings.BULK_DRAFT_MAX_EMAILS)
+    query = {}
+    if payload.email_ids:
+        try:
+            query["_id"] = {"$in": [ObjectId(email_id) for email_id in payload.email_ids]}
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid email id")
+    else:
+        categories = payload.categories
+        if isinstance(categories, str):
+            categories = [c.strip() for c in categories.split(",") if c.strip()]
+        if categories:
+            query["metadata.category"] = {"$in": list(categories)}
+        if payload.sender:
+            query["sender"] = payload.sender
+        if not query:
+            raise HTTPException(status_code=400, detail="email_ids or a filter (categories, sender) is required")
+        if payload.is_read is not None:
+            query["is_read"] = payload.is_read
+
+    emails = await db.get_db()["emails"].find(query, {"sender": 1, "subject": 1, "body": 1}).sort(
+        [("timestamp", -1), ("_id", -1)]
+    ).to_list(limit)
+    results = generate_drafts(emails, payload.instructions, force=payload.force)
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def events():
+        counts = {"generated": 0, "skipped": 0, "failed": 0}
+        async for result in results:
+            counts[result["status"]] += 1
+            yield sse_event(result) if sse else json.dumps(result) + "\n"
+        summary = {"total": len(emails), **counts}
+        yield sse_event(summary, event="done") if sse else json.dumps({"done": True, **summary}) + "\n"
+
+    if sse:
+        return sse_response(events())
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @router.get("/drafts", response_model=List[Draft])
-async def get_drafts():
+async def get_drafts(request: Request):
     drafts_collection = db.get_db()["drafts"]
-    drafts = await drafts_collection.find().sort("created_at", -1).to_list(100)
-    return drafts
+    drafts = await drafts_collection.find({}, model_projection(Draft)).sort("created_at", -1).to_list(100)
+    return json_response(request, drafts)
 
 @router.put("/drafts/{draft_id}", response_model=Draft)
 async def update_draft(draft_id: str, payload: dict = Body(...)):
@@ -123,3 +273,22 @@ async def delete_draft(draft_id: str):
         raise HTTPException(status_code=404, detail="Draft not found")
         
     return {"message": "Draft deleted"}
+
+@router.get("/health")
+async def get_llm_health():
+    return llm_service.health()
+
+@router.get("/pools")
+async def get_pool_stats():
+    return llm_service.pool_stats()
+
+@router.get("/cache")
+async def get_cache_stats():
+    return llm_service.cache_stats()
+
+@router.delete("/cache")
+async def clear_cache():
+    if not llm_service.cache:
+        raise HTTPException(status_code=400, detail="LLM cache is disabled")
+    await llm_service.cache.clear()
+    return {"message": "LLM cache cleared"}
@@ -1,24 +1,223 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
-from app.models.email import Email
-from app.services.ingestion import ingest_mock_data
+from fastapi import APIRouter, Body, HTTPException, Query, Request
+import asyncio
+import time
+from typing import List, Optional, Union
+from bson import ObjectId
+from bson.errors import InvalidId
+from app.models.email import Email, EmailListItem, SearchResponse
+from app.services.ingestion import resolve_mailbox_path
+from app.services.mailbox_reader import SUPPORTED_FORMATS
+from app.services import job_queue
+from app.services.search_index import SEARCH_MODES, search_index
+from app.services.preclassifier import preclassifier
+from app.services.processing import STAGE_DEFAULT_PROMPTS
+from app.services.result_sink import result_sink
+from app.services.inbox_stats import inbox_stats
+from app.services.change_feed import STATE_ID, change_feed, state_collection
+from app.config import settings
 from app.utils.db import db
+from app.utils.pagination import encode_cursor, keyset_filter
+from app.utils.serialization import json_response, model_projection
 
 router = APIRouter(prefix="/api/emails", tags=["Emails"])
 
-@router.post("/ingest")
-async def ingest_emails():
+@router.post("/ingest", status_code=202)
+async def ingest_emails(source: str = "mock", path: Optional[str] = None, format: Optional[str] = None):
+    """Queue ingestion of the bundled mock inbox (source=mock) or a mailbox file (source=file).
+
+    Ingestion and processing run on a background worker; poll /api/jobs/{job_id} for progress.
+    """
+    if source not in ("mock", "file"):
+        raise HTTPException(status_code=400, detail="source must be 'mock' or 'file'")
+    if format and format not in SUPPORTED_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(SUPPORTED_FORMATS)}")
+
+    params = {"source": source}
+    if source == "file":
+        if not path:
+            raise HTTPException(status_code=400, detail="path is required for source=file")
+        try:
+            # Validate now so a bad path fails the request rather than the job
+            resolve_mailbox_path(path)
+        except (ValueError, FileNotFoundError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        params.update({"path": path, "format": format})
+
+    job_id = await job_queue.enqueue("ingest", params)
+    return {"message": "Ingestion queued", "job_id": job_id, "status": "queued"}
+
+@router.post("/process", status_code=202)
+async def process_emails():
+    job_id = await job_queue.enqueue("process")
+    return {"message": "Processing queued", "job_id": job_id, "status": "queued"}
+
+@router.post("/reprocess", status_code=202)
+async def reprocess_emails(stage: str):
+    """Re-run one analysis stage for emails analysed with an older version of its prompt."""
+    if stage not in STAGE_DEFAULT_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"stage must be one of {', '.join(STAGE_DEFAULT_PROMPTS)}")
+    job_id = await job_queue.enqueue("reprocess", {"stage": stage})
+    return {"message": "Reprocessing queued", "job_id": job_id, "status": "queued"}
+
+@router.get("/ingest/progress")
+async def get_ingest_progress():
+    """Progress of the most recent ingestion or processing job."""
+    job = await job_queue.jobs_collection().find_one(
+        {"type": {"$in": ["ingest", "process", "reprocess"]}},
+        sort=[("created_at", -1)]
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="No ingestion jobs found")
+    return {"job_id": str(job["_id"]), "status": job["status"], "progress": job.get("progress", {}), "error": job.get("error")}
+
+LIST_PROJECTION = {
+    "sender": 1,
+    "subject": 1,
+    "snippet": {"$substrCP": ["$body", 0, 200]},
+    "timestamp": 1,
+    "is_read": 1,
+    "processed": 1,
+    "metadata": 1,
+}
+
+FULL_PROJECTION = model_projection(Email)
+
+@router.get("/", response_model=Union[List[Email], List[EmailListItem]])
+async def get_emails(
+    request: Request,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    category: Optional[str] = None,
+    processed: Optional[bool] = None,
+    is_read: Optional[bool] = None,
+    sender: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|list)$"),
+):
+    """Newest-first page of emails. The next page's cursor is returned in the X-Next-Cursor header."""
+    query = {}
+    if category:
+        query["metadata.category"] = category
+    if processed is not None:
+        query["processed"] = processed
+    if is_read is not None:
+        query["is_read"] = is_read
+    if sender:
+        query["sender"] = sender
+    try:
+        query.update(keyset_filter(cursor))
+    except (ValueError, KeyError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    emails_collection = db.get_db()["emails"]
+    projection = LIST_PROJECTION if view == "list" else FULL_PROJECTION
+    emails = await emails_collection.find(query, projection).sort([("timestamp", -1), ("_id", -1)]).to_list(limit)
+
+    headers = {}
+    if len(emails) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(emails[-1])
+    return json_response(request, emails, headers=headers)
+
+@router.get("/search", response_model=SearchResponse)
+async def search_emails(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    category: Optional[str] = None,
+    mode: str = Query("keyword", pattern=f"^({'|'.join(SEARCH_MODES)})$"),
+):
+    """Ranked search over sender, subject and body (BM25), or by meaning when embeddings are enabled."""
+    if not search_index.active:
+        raise HTTPException(status_code=503, detail="Search index is disabled")
+
+    start = time.perf_counter()
     try:
-        result = await ingest_mock_data()
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        results, total = await search_index.search_documents(q, limit, category, mode, LIST_PROJECTION)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/", response_model=List[Email])
-async def get_emails():
+    return {"results": results, "total": total, "mode": mode, "took_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+@router.get("/search/status")
+async def get_search_status():
+    return search_index.stats()
+
+@router.get("/classifier/stats")
+async def get_classifier_stats():
+    """How often the local pre-classifier settled a category without the LLM."""
+    return preclassifier.stats()
+
+@router.get("/feed")
+async def get_feed_status():
+    """Continuous processing of new emails: which process leads it and how far it has got."""
+    state = await state_collection().find_one({"_id": STATE_ID}, {"resume_token": 0}) or {}
+    return {
+        "enabled": settings.CHANGE_FEED_ENABLED,
+        "leader": state.get("owner"),
+        "lease_expires_at": state.get("lease_expires_at"),
+        "token_saved_at": state.get("token_saved_at"),
+        "this_process": change_feed.stats(),
+        "result_sink": result_sink.stats(),
+    }
+
+@router.get("/duplicates")
+async def get_duplicate_clusters(limit: int = Query(20, ge=1, le=100), sample: int = Query(5, ge=0, le=50)):
+    """Near-duplicate clusters, largest first: the analysed original and the emails that reused its analysis."""
     emails_collection = db.get_db()["emails"]
-    emails = await emails_collection.find().sort("timestamp", -1).to_list(100)
-    return emails
+    clusters = await emails_collection.aggregate([
+        {"$match": {"metadata.duplicate_of": {"$type": "string"}}},
+        {"$sort": {"timestamp": -1}},
+        {"$group": {
+            "_id": "$metadata.duplicate_of",
+            "duplicates": {"$sum": 1},
+            "latest": {"$first": "$timestamp"},
+        }},
+        {"$sort": {"duplicates": -1}},
+        {"$limit": limit},
+    ]).to_list(limit)
+
+    # Sampled per cluster, newest first, so a huge cluster never has all its ids collected in one group
+    async def sample_ids(original_id: str) -> List[str]:
+        members = emails_collection.find({"metadata.duplicate_of": original_id}, {"_id": 1}).sort("timestamp", -1).limit(sample)
+        return [str(member["_id"]) async for member in members]
+
+    samples = await asyncio.gather(*(sample_ids(c["_id"]) for c in clusters)) if sample else [[] for _ in clusters]
+
+    originals = await emails_collection.find(
+        {"_id": {"$in": [ObjectId(c["_id"]) for c in clusters]}},
+        {"sender": 1, "subject": 1, "timestamp": 1, "metadata.category": 1}
+    ).to_list(len(clusters))
+    by_id = {str(email["_id"]): email for email in originals}
+
+    return [
+        {
+            "original_id": cluster["_id"],
+            "sender": by_id.get(cluster["_id"], {}).get("sender"),
+            "subject": by_id.get(cluster["_id"], {}).get("subject"),
+            "category": (by_id.get(cluster["_id"], {}).get("metadata") or {}).get("category"),
+            "duplicates": cluster["duplicates"],
+            "latest": cluster["latest"],
+            "sample_ids": ids,
+        }
+        for cluster, ids in zip(clusters, samples)
+    ]
+
+@router.get("/{email_id}/duplicates", response_model=List[EmailListItem])
+async def get_email_duplicates(email_id: str, limit: int = Query(100, ge=1, le=500)):
+    """Every email in the same near-duplicate cluster as this one, including the original."""
+    try:
+        oid = ObjectId(email_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid Email ID")
+
+    emails_collection = db.get_db()["emails"]
+    email = await emails_collection.find_one({"_id": oid}, {"metadata.duplicate_of": 1})
+    if not email:
+        raise HTTPException(status_code=404, detail="Email not found")
+
+    root = (email.get("metadata") or {}).get("duplicate_of") or email_id
+    return await emails_collection.find(
+        {"$or": [{"_id": ObjectId(root)}, {"metadata.duplicate_of": root}]},
+        LIST_PROJECTION
+    ).sort([("timestamp", -1)]).to_list(limit)
 
 @router.get("/{email_id}", response_model=Email)
 async def get_email(email_id: str):
@@ -37,3 +236,27 @@ async def get_email(email_id: str):
     if not email:
         raise HTTPException(status_code=404, detail="Email not found")
     return email
+
+@router.patch("/{email_id}/read")
+async def set_read(email_id: str, payload: dict = Body(...)):
+    """Mark an email read ({"is_read": true}) or unread ({"is_read": false})."""
+    try:
+        oid = ObjectId(email_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid Email ID")
+    if not isinstance(payload.get("is_read"), bool):
+        raise HTTPException(status_code=400, detail="is_read must be true or false")
+    is_read = payload["is_read"]
+
+    emails_collection = db.get_db()["emails"]
+    # Only an actual change is counted, so repeated requests can't skew the unread counts
+    before = await emails_collection.find_one_and_update(
+        {"_id": oid, "is_read": {"$ne": is_read}},
+        {"$set": {"is_read": is_read}},
+        projection={"sender": 1, "processed": 1, "metadata.category": 1}
+    )
+    if before:
+        inbox_stats.add_read_change(before, is_read)
+    elif not await emails_collection.count_documents({"_id": oid}, limit=1):
+        raise HTTPException(status_code=404, detail="Email not found")
+    return {"id": email_id, "is_read": is_read, "changed": before is not None}
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException
+from typing import List, Optional
+from app.models.job import Job
+from app.services import job_queue
+from bson import ObjectId
+
+router = APIRouter(prefix="/api/jobs", tags=["Jobs"])
+
+@router.get("/", response_model=List[Job])
+async def get_jobs(status: Optional[str] = None, type: Optional[str] = None, limit: int = 50):
+    query = {}
+    if status:
+        query["status"] = status
+    if type:
+        query["type"] = type
+    jobs = await job_queue.jobs_collection().find(query).sort("created_at", -1).to_list(min(limit, 500))
+    return jobs
+
+@router.get("/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    try:
+        oid = ObjectId(job_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid Job ID")
+
+    job = await job_queue.jobs_collection().find_one({"_id": oid})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/{job_id}/progress")
+async def get_job_progress(job_id: str):
+    job = await get_job(job_id)
+    return {"status": job["status"], "attempts": job["attempts"], "progress": job.get("progress", {}), "error": job.get("error")}
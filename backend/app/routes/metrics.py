@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from app.services.llm_service import llm_service
+from app.services import job_queue
+from app.utils.metrics import JOB_QUEUE_DEPTH, LLM_IN_FLIGHT, LLM_RATE_LIMIT_WAITING
+
+router = APIRouter(tags=["Metrics"])
+
+JOB_STATUSES = ("queued", "running", "completed", "failed")
+
+async def refresh_gauges():
+    """Gauges that are cheaper to read on scrape than to keep updated on every change."""
+    for name, stats in llm_service.pool_stats().items():
+        LLM_IN_FLIGHT.labels(provider=name).set(stats["in_flight"])
+    for key, limiter in llm_service.rate_limiters.items():
+        LLM_RATE_LIMIT_WAITING.labels(limiter=key).set(limiter.waiting)
+
+    counts = {status: 0 for status in JOB_STATUSES}
+    async for row in job_queue.jobs_collection().aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    for status, count in counts.items():
+        JOB_QUEUE_DEPTH.labels(status=status).set(count)
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    await refresh_gauges()
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,21 +1,30 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Request
 from typing import List
 from app.models.prompt import Prompt
 from app.utils.db import db
+from app.utils.serialization import json_response, model_projection
+from app.services.prompt_registry import prompt_registry
+from app.services.reprocessing import queue_reprocess
 from bson import ObjectId
 
 router = APIRouter(prefix="/api/prompts", tags=["Prompts"])
 
 @router.get("/", response_model=List[Prompt])
-async def get_prompts():
+async def get_prompts(request: Request):
     prompts_collection = db.get_db()["prompts"]
-    prompts = await prompts_collection.find().to_list(100)
-    return prompts
+    prompts = await prompts_collection.find({}, model_projection(Prompt)).to_list(100)
+    for prompt in prompts:
+        # Prompts stored before versioning
+        prompt.setdefault("version", 1)
+    return json_response(request, prompts)
 
 @router.post("/", response_model=Prompt)
 async def create_prompt(prompt: Prompt):
     prompts_collection = db.get_db()["prompts"]
-    new_prompt = await prompts_collection.insert_one(prompt.model_dump(by_alias=True, exclude=["id"]))
+    new_prompt = await prompts_collection.insert_one({**prompt.model_dump(by_alias=True, exclude=["id"]), "version": 1})
+    prompt_registry.invalidate()
+    if prompt.is_active:
+        await queue_reprocess(prompt.type)
     created_prompt = await prompts_collection.find_one({"_id": new_prompt.inserted_id})
     return created_prompt
 
@@ -27,13 +36,25 @@ async def update_prompt(prompt_id: str, prompt: Prompt):
     except:
         raise HTTPException(status_code=400, detail="Invalid Prompt ID")
         
-    update_result = await prompts_collection.update_one(
-        {"_id": oid},
-        {"$set": prompt.model_dump(by_alias=True, exclude=["id"])}
-    )
+    existing = await prompts_collection.find_one({"_id": oid})
+    if not existing:
+        raise HTTPException(status_code=404, detail="Prompt not found")
+
+    changes = prompt.model_dump(by_alias=True, exclude=["id", "version"])
+    update = {"$set": changes}
+    template_changed = changes["template"] != existing.get("template")
+    if template_changed:
+        update["$inc"] = {"version": 1}
+    update_result = await prompts_collection.update_one({"_id": oid}, update)
     
     if update_result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Prompt not found")
+    prompt_registry.invalidate()
+
+    # Results from the old text are stale; the job finds nothing to do if this prompt isn't the active one
+    if template_changed or changes["type"] != existing.get("type") or changes["is_active"] != existing.get("is_active", True):
+        for prompt_type in {existing.get("type"), changes["type"]}:
+            await queue_reprocess(prompt_type)
         
     updated_prompt = await prompts_collection.find_one({"_id": oid})
     return updated_prompt
@@ -46,10 +67,12 @@ async def delete_prompt(prompt_id: str):
     except:
         raise HTTPException(status_code=400, detail="Invalid Prompt ID")
         
-    delete_result = await prompts_collection.delete_one({"_id": oid})
+    deleted = await prompts_collection.find_one_and_delete({"_id": oid})
     
-    if delete_result.deleted_count == 0:
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Prompt not found")
+    prompt_registry.invalidate()
+    await queue_reprocess(deleted["type"])
         
     return {"message": "Prompt deleted"}
 
@@ -84,4 +107,5 @@ async def seed_prompts():
     ]
     
     result = await prompts_collection.insert_many(default_prompts)
+    prompt_registry.invalidate()
     return {"message": "Prompts seeded successfully", "count": len(result.inserted_ids)}
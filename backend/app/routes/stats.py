@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Query
+from app.services import job_queue
+from app.services.inbox_stats import inbox_stats
+
+router = APIRouter(prefix="/api/stats", tags=["Stats"])
+
+@router.get("/")
+async def get_stats(senders: int = Query(20, ge=0, le=500)):
+    """Counts by category, unread counts, action items by priority and the busiest senders.
+
+    Read from materialized summaries, so the cost doesn't grow with the mailbox.
+    """
+    return await inbox_stats.get(senders=senders)
+
+@router.post("/reconcile", status_code=202)
+async def reconcile_stats():
+    """Queue a recount of the summaries from the emails collection."""
+    job_id = await job_queue.enqueue("reconcile_stats")
+    return {"message": "Reconciliation queued", "job_id": job_id, "status": "queued"}
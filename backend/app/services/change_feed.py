@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+from app.config import settings
+from app.utils.db import db
+from app.services.processing import ProcessingProgress, _worker, categorize_batch, claim_emails, claimable_filter, release_claim
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = "email_change_feed"
+# Server errors meaning the stored resume token can no longer be used
+RESUME_TOKEN_ERRORS = {260, 280, 286}
+# Ids processed recently, so a change event racing the catch-up sweep isn't processed twice
+RECENT_LIMIT = 10000
+
+
+def state_collection():
+    return db.get_db()["service_state"]
+
+
+class ChangeFeedProcessor:
+    """Processes new emails as they arrive instead of waiting for a sweep.
+
+    Follows inserts on the emails collection through a change stream, resuming from
+    the token saved in service_state, and falls back to polling the indexed
+    unprocessed emails (newest first) where change streams are unavailable. A lease
+    in service_state makes one process the leader, so API replicas and workers can
+    all run it, and emails are claimed before they are queued so a process job
+    sweeping at the same time skips them.
+    """
+
+    def __init__(self, owner: str = None):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.progress = ProcessingProgress(concurrency=settings.PROCESSING_CONCURRENCY)
+        self.mode = "standby"
+        self.events = 0
+        self.is_leader = False
+        self.resume_token: Optional[dict] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._in_flight: Set[ObjectId] = set()
+        self._recent: "OrderedDict[ObjectId, None]" = OrderedDict()
+        # Failed emails: (attempts, monotonic time they may be retried)
+        self._failures: Dict[ObjectId, Tuple[int, float]] = {}
+        self._batch_slots = asyncio.Semaphore(max(1, settings.PROCESSING_CONCURRENCY // 2))
+        self._batch_tasks: Set[asyncio.Task] = set()
+        self._token_saved_at = 0.0
+        self._stopping = False
+
+    # Leadership
+
+    async def _acquire_lease(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            result = await state_collection().update_one(
+                {"_id": STATE_ID, "$or": [{"owner": self.owner}, {"owner": None}, {"lease_expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "lease_expires_at": now + timedelta(seconds=settings.CHANGE_FEED_LEASE_SECONDS)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Someone else holds a live lease
+            return False
+        return result.matched_count > 0 or result.upserted_id is not None
+
+    async def _renew_lease(self, follow_task: asyncio.Task):
+        while not follow_task.done():
+            await asyncio.sleep(settings.CHANGE_FEED_LEASE_SECONDS / 3)
+            try:
+                renewed = await self._acquire_lease()
+            except PyMongoError as e:
+                logger.warning(f"Change feed lease renewal failed: {e}")
+                continue
+            if not renewed:
+                logger.warning(f"Change feed {self.owner} lost leadership")
+                follow_task.cancel()
+                return
+
+    async def _release_lease(self):
+        try:
+            await state_collection().update_one({"_id": STATE_ID, "owner": self.owner}, {"$set": {"owner": None}})
+        except PyMongoError:
+            pass
+
+    # Dispatch
+
+    def _should_process(self, email: dict) -> bool:
+        email_id = email["_id"]
+        if email.get("processed") or email_id in self._in_flight or email_id in self._recent:
+            return False
+        failure = self._failures.get(email_id)
+        return failure is None or (failure[0] < settings.CHANGE_FEED_MAX_ATTEMPTS and failure[1] <= time.monotonic())
+
+    def _on_done(self, email: dict, error: Optional[Exception]):
+        email_id = email["_id"]
+        self._in_flight.discard(email_id)
+        if error is None:
+            self._failures.pop(email_id, None)
+            self._recent[email_id] = None
+            while len(self._recent) > RECENT_LIMIT:
+                self._recent.popitem(last=False)
+        else:
+            attempts = self._failures.get(email_id, (0, 0))[0] + 1
+            self._failures[email_id] = (attempts, time.monotonic() + settings.JOB_RETRY_BACKOFF_SECONDS * attempts)
+            # Retries re-claim it; meanwhile a process job may take it
+            release_claim(email_id, self.owner)
+
+    async def _categorize_and_enqueue(self, batch: List[dict]):
+        try:
+            categories = await categorize_batch(batch) if settings.LLM_BATCH_CATEGORIZATION else {}
+            for email in batch:
+                await self._queue.put((email, categories.get(str(email["_id"]))))
+        finally:
+            self._batch_slots.release()
+
+    async def _dispatch(self, emails: List[dict]) -> int:
+        """Hand new emails to the workers, batch-categorizing them first; returns how many were taken."""
+        batch = await claim_emails([email for email in emails if self._should_process(email)], self.owner)
+        if not batch:
+            return 0
+        self._in_flight.update(email["_id"] for email in batch)
+        self.progress.total += len(batch)
+        await self._batch_slots.acquire()
+        task = asyncio.create_task(self._categorize_and_enqueue(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+        return len(batch)
+
+    async def _poll(self, after: Optional[dict] = None) -> Tuple[int, Optional[dict]]:
+        """One page of the unprocessed-emails index, newest first (or older than after).
+
+        Returns how many emails were new and the page's last email, to continue from.
+        """
+        excluded = list(self._in_flight) + [
+            email_id for email_id, (attempts, retry_at) in self._failures.items()
+            if attempts >= settings.CHANGE_FEED_MAX_ATTEMPTS or retry_at > time.monotonic()
+        ]
+        # Emails a process job has claimed are left to it
+        query = {**claimable_filter(datetime.utcnow(), self.owner), "_id": {"$nin": excluded}}
+        if after is not None:
+            query = {"$and": [query, {"$or": [
+                {"timestamp": {"$lt": after["timestamp"]}},
+                {"timestamp": after["timestamp"], "_id": {"$lt": after["_id"]}},
+            ]}]}
+        cursor = db.get_db()["emails"].find(query).sort([("timestamp", -1), ("_id", -1)]).limit(settings.PROCESSING_BATCH_SIZE * 4)
+        emails = await cursor.to_list(settings.PROCESSING_BATCH_SIZE * 4)
+        taken = 0
+        for start in range(0, len(emails), settings.PROCESSING_BATCH_SIZE):
+            taken += await self._dispatch(emails[start:start + settings.PROCESSING_BATCH_SIZE])
+        return taken, emails[-1] if emails else None
+
+    async def _retry_failures(self) -> int:
+        """Dispatch failed emails whose backoff has run out; polling does this as part of _poll."""
+        now = time.monotonic()
+        due = [
+            email_id for email_id, (attempts, retry_at) in self._failures.items()
+            if attempts < settings.CHANGE_FEED_MAX_ATTEMPTS and retry_at <= now and email_id not in self._in_flight
+        ]
+        if not due:
+            return 0
+        emails = await db.get_db()["emails"].find({"_id": {"$in": due}, "processed": False}).to_list(len(due))
+        # Processed elsewhere in the meantime
+        for email_id in set(due) - {email["_id"] for email in emails}:
+            self._failures.pop(email_id, None)
+        taken = 0
+        for start in range(0, len(emails), settings.PROCESSING_BATCH_SIZE):
+            taken += await self._dispatch(emails[start:start + settings.PROCESSING_BATCH_SIZE])
+        return taken
+
+    async def _sweep(self):
+        """Catch up on emails that arrived while nobody was following the feed.
+
+        Pages with a keyset rather than stopping at the first page with nothing new,
+        which could be emails already taken whose results are not written yet.
+        """
+        _, last = await self._poll()
+        while last is not None:
+            _, last = await self._poll(after=last)
+
+    # Following
+
+    async def _save_token(self, token: Optional[dict]):
+        if token is None or token == self.resume_token or time.monotonic() - self._token_saved_at < 5:
+            return
+        self.resume_token = token
+        self._token_saved_at = time.monotonic()
+        await state_collection().update_one(
+            {"_id": STATE_ID, "owner": self.owner},
+            {"$set": {"resume_token": token, "token_saved_at": datetime.utcnow()}}
+        )
+
+    async def _follow_stream(self):
+        state = await state_collection().find_one({"_id": STATE_ID})
+        token = (state or {}).get("resume_token")
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        try:
+            async with db.get_db()["emails"].watch(pipeline, resume_after=token, max_await_time_ms=500) as stream:
+                self.mode = "change_stream"
+                # Opened before the sweep, so nothing inserted in between is missed
+                await self._sweep()
+                pending: List[dict] = []
+                window_started = retried_at = time.monotonic()
+                while stream.alive:
+                    change = await stream.try_next()
+                    if change is not None:
+                        self.events += 1
+                        if not pending:
+                            window_started = time.monotonic()
+                        pending.append(change["fullDocument"])
+                    window_closed = time.monotonic() - window_started >= settings.CHANGE_FEED_BATCH_WINDOW_SECONDS
+                    if pending and (len(pending) >= settings.PROCESSING_BATCH_SIZE or window_closed or change is None):
+                        await self._dispatch(pending)
+                        pending = []
+                    # Emails read but not yet processed are still unprocessed, so a restart's sweep covers them
+                    await self._save_token(stream.resume_token)
+                    # Inserts are the only events, so failed emails are retried on a timer
+                    if time.monotonic() - retried_at >= settings.CHANGE_FEED_POLL_SECONDS:
+                        retried_at = time.monotonic()
+                        await self._retry_failures()
+        except OperationFailure as e:
+            if token and e.code in RESUME_TOKEN_ERRORS:
+                logger.warning(f"Change feed resume token expired, starting from now: {e}")
+                await state_collection().update_one({"_id": STATE_ID}, {"$unset": {"resume_token": ""}})
+                self.resume_token = None
+                return await self._follow_stream()
+            raise
+
+    async def _follow_polling(self):
+        self.mode = "polling"
+        while True:
+            taken, _ = await self._poll()
+            if not taken:
+                await asyncio.sleep(settings.CHANGE_FEED_POLL_SECONDS)
+
+    async def _follow(self):
+        self._queue = asyncio.Queue(maxsize=max(settings.PROCESSING_QUEUE_SIZE, settings.PROCESSING_CONCURRENCY))
+        self.progress.running = True
+        self.progress.started_at = time.time()
+        workers = [
+            asyncio.create_task(_worker(self._queue, self.progress, on_done=self._on_done))
+            for _ in range(settings.PROCESSING_CONCURRENCY)
+        ]
+        try:
+            try:
+                await self._follow_stream()
+            except PyMongoError as e:
+                logger.warning(f"Email change stream unavailable, polling unprocessed emails instead: {e}")
+            await self._follow_polling()
+        finally:
+            for task in list(self._batch_tasks) + workers:
+                task.cancel()
+            self._in_flight.clear()
+            self.progress.running = False
+            self.progress.finished_at = time.time()
+
+    async def run(self):
+        logger.info(f"Change feed {self.owner} started")
+        while not self._stopping:
+            try:
+                self.is_leader = await self._acquire_lease()
+            except PyMongoError as e:
+                logger.warning(f"Change feed could not take the lease: {e}")
+                self.is_leader = False
+            if not self.is_leader:
+                self.mode = "standby"
+                await asyncio.sleep(settings.CHANGE_FEED_LEASE_SECONDS / 3)
+                continue
+
+            follow_task = asyncio.create_task(self._follow())
+            renew_task = asyncio.create_task(self._renew_lease(follow_task))
+            try:
+                await follow_task
+            except asyncio.CancelledError:
+                if not follow_task.cancelled():
+                    # run() itself is being cancelled
+                    follow_task.cancel()
+                    renew_task.cancel()
+                    await self._release_lease()
+                    raise
+            except Exception as e:
+                logger.exception(f"Change feed failed, restarting: {e}")
+                await asyncio.sleep(settings.CHANGE_FEED_POLL_SECONDS)
+            finally:
+                renew_task.cancel()
+            self.is_leader = False
+
+    def stop(self):
+        self._stopping = True
+
+    def stats(self) -> dict:
+        return {
+            "owner": self.owner,
+            "leader": self.is_leader,
+            "mode": self.mode,
+            "events": self.events,
+            "in_flight": len(self._in_flight),
+            "failed_emails": len(self._failures),
+            "progress": self.progress.snapshot(),
+        }
+
+
+change_feed = ChangeFeedProcessor()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from app.config import settings
+from app.models.chat_session import ChatSession, ChatTurn
+from app.utils.db import db
+from app.services.llm_service import estimate_tokens, llm_service
+from app.services.retrieval import context_cache, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and their email assistant.
+Keep names, dates, decisions, open questions and anything the user asked to remember. Stay under {words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{turns}
+
+Return only the updated summary."""
+
+EMAIL_FIELDS = ("_id", "sender", "subject", "body", "timestamp")
+# How often an active session's messages have their active_at (the TTL field) refreshed
+MESSAGE_REFRESH_INTERVAL = timedelta(days=1)
+
+# Sessions with a summary being written in this process, and the tasks writing them
+_summarizing: Set[ObjectId] = set()
+_background: Set[asyncio.Task] = set()
+
+
+def sessions_collection():
+    return db.get_db()["chat_sessions"]
+
+
+def messages_collection():
+    return db.get_db()["chat_messages"]
+
+
+async def create_session(email: Optional[dict] = None, title: Optional[str] = None) -> dict:
+    snapshot = {key: str(email[key]) for key in EMAIL_FIELDS if email and email.get(key) is not None} or None
+    session = ChatSession(title=title or (snapshot or {}).get("subject"), email=snapshot)
+    doc = session.model_dump(by_alias=True, exclude=["id"])
+    result = await sessions_collection().insert_one(doc)
+    doc["_id"] = result.inserted_id
+    return doc
+
+
+async def get_session(session_id: str) -> Optional[dict]:
+    try:
+        oid = ObjectId(session_id)
+    except (InvalidId, TypeError):
+        return None
+    return await sessions_collection().find_one({"_id": oid})
+
+
+async def get_messages(session_id: ObjectId, limit: int = 200) -> List[dict]:
+    return await messages_collection().find({"session_id": session_id}).sort("_id", 1).to_list(limit)
+
+
+async def delete_session(session_id: ObjectId) -> bool:
+    result = await sessions_collection().delete_one({"_id": session_id})
+    await messages_collection().delete_many({"session_id": session_id})
+    context_cache.discard(str(session_id))
+    return result.deleted_count > 0
+
+
+def render_turns(turns: List[dict]) -> str:
+    return "\n".join(f"{turn['role'].title()}: {turn['content']}" for turn in turns)
+
+
+def session_prefix(session: dict) -> str:
+    """The part of a session's prompt shared by consecutive turns.
+
+    It only grows by appended turns, and changes wholesale only when summarize()
+    rolls older turns into the summary, so providers' prompt-prefix caching keeps applying.
+    """
+    parts = ["You are an AI email assistant."]
+    email = session.get("email")
+    if email:
+        parts.append(
+            "This conversation is about the following email:\n"
+            f"Subject: {email.get('subject', 'No Subject')}\nFrom: {email.get('sender', 'Unknown')}\nBody:\n{email.get('body', '')}"
+        )
+    if session.get("summary"):
+        parts.append(f"Summary of the earlier conversation:\n{session['summary']}")
+    if session.get("recent"):
+        parts.append(f"Conversation so far:\n{render_turns(session['recent'])}")
+    return "\n\n".join(parts) + "\n\n"
+
+
+async def record_turn(session: dict, user_message: str, reply: str) -> Optional[dict]:
+    """Append a user/assistant exchange, rolling older turns into the summary once they pass the threshold."""
+    turns = [
+        ChatTurn(role="user", content=user_message, tokens=estimate_tokens(user_message)),
+        ChatTurn(role="assistant", content=reply, tokens=estimate_tokens(reply)),
+    ]
+    # Keep ObjectIds as ObjectIds so turns sort and compare in order
+    docs = [{**turn.model_dump(), "id": turn.id} for turn in turns]
+    now = datetime.utcnow()
+
+    # Messages expire by active_at, so a session still in use keeps its whole history
+    refresh = now - (session.get("messages_active_at") or datetime.min) >= MESSAGE_REFRESH_INTERVAL
+    updated = await sessions_collection().find_one_and_update(
+        {"_id": session["_id"]},
+        {
+            "$push": {"recent": {"$each": docs}},
+            "$inc": {"recent_tokens": sum(turn.tokens for turn in turns), "turn_count": len(turns)},
+            "$set": {"updated_at": now, **({"messages_active_at": now} if refresh else {})},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if refresh:
+        await messages_collection().update_many({"session_id": session["_id"]}, {"$set": {"active_at": now}})
+    await messages_collection().insert_many([{**doc, "session_id": session["_id"], "active_at": now} for doc in docs])
+
+    if updated and updated["recent_tokens"] > settings.CHAT_SUMMARY_THRESHOLD_TOKENS:
+        schedule_summary(updated)
+    return updated
+
+
+def schedule_summary(session: dict):
+    if session["_id"] in _summarizing:
+        return
+    _summarizing.add(session["_id"])
+    task = asyncio.create_task(summarize(session))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def summarize(session: dict):
+    """Fold all but the last few turns into the running summary."""
+    try:
+        recent = session["recent"]
+        keep = settings.CHAT_KEEP_RECENT_TURNS
+        older = recent[:-keep] if keep else recent
+        if not older:
+            return
+
+        prompt = SUMMARY_PROMPT.format(
+            words=settings.CHAT_SUMMARY_MAX_TOKENS * 3 // 4,
+            summary=session.get("summary") or "(none yet)",
+            turns=render_turns(older),
+        )
+        try:
+            summary = await llm_service.generate_text(
+                prompt,
+                system_prompt="You summarize conversations accurately and concisely.",
+                priority="background",
+                operation="summarize_history"
+            )
+        except Exception as e:
+            logger.warning(f"Could not summarize chat session {session['_id']}: {e}")
+            # Bound the history anyway; the dropped turns are still in chat_messages
+            if session["recent_tokens"] > settings.CHAT_SUMMARY_THRESHOLD_TOKENS * 2:
+                await sessions_collection().update_one(
+                    {"_id": session["_id"], "summary_version": session["summary_version"]},
+                    {
+                        "$inc": {"summary_version": 1, "recent_tokens": -sum(turn["tokens"] for turn in older)},
+                        "$pull": {"recent": {"id": {"$lte": older[-1]["id"]}}},
+                    }
+                )
+            return
+
+        # Only apply on top of the summary this was based on; turns added meanwhile are kept
+        await sessions_collection().update_one(
+            {"_id": session["_id"], "summary_version": session["summary_version"]},
+            {
+                "$set": {"summary": truncate_to_tokens(summary.strip(), settings.CHAT_SUMMARY_MAX_TOKENS)},
+                "$inc": {"summary_version": 1, "recent_tokens": -sum(turn["tokens"] for turn in older)},
+                "$pull": {"recent": {"id": {"$lte": older[-1]["id"]}}},
+            }
+        )
+    finally:
+        _summarizing.discard(session["_id"])
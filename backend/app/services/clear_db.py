@@ -6,6 +6,9 @@ async def clear_emails():
     emails_collection = db.get_db()["emails"]
     result = await emails_collection.delete_many({})
     print(f"Deleted {result.deleted_count} emails.")
+    # The inbox statistics describe the emails just deleted
+    await db.get_db()["inbox_stats"].delete_many({})
+    await db.get_db()["sender_stats"].delete_many({})
     db.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+import asyncio
+from typing import AsyncIterator, List, Optional
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+from app.config import settings
+from app.models.draft import Draft
+from app.utils.db import db
+from app.services.llm_service import llm_service
+from app.services.prompt_registry import prompt_registry
+
+DEFAULT_REPLY_PROMPT = "Draft a polite reply to this email."
+DRAFT_SYSTEM_PROMPT = "You are an email drafting assistant."
+
+
+def drafts_collection():
+    return db.get_db()["drafts"]
+
+
+def render_draft_prompt(email: dict, instructions: str, reply_prompt_text: str) -> str:
+    return f"""
+Original Email:
+Subject: {email.get('subject', 'No Subject')}
+From: {email.get('sender', 'Unknown')}
+Body: {email.get('body', '')}
+
+Instructions: {instructions}
+
+{reply_prompt_text}
+"""
+
+
+def draft_document(email: dict, content: str, prompt_version: Optional[str] = None) -> dict:
+    """A new draft, with its _id already assigned."""
+    try:
+        email_id = ObjectId(email.get("_id"))
+    except Exception:
+        # Mock emails from the frontend may not have a valid ObjectId
+        email_id = ObjectId()
+    draft = Draft(
+        email_id=email_id,
+        subject=f"Re: {email.get('subject', 'No Subject')}",
+        body=content,
+        status="generated",
+        prompt_version=prompt_version
+    )
+    doc = draft.model_dump(by_alias=True, exclude={"id"})
+    # model_dump serializes ObjectIds as strings; stored ids must stay ObjectIds for lookups to match
+    doc.update(_id=ObjectId(), email_id=email_id)
+    return doc
+
+
+async def generate_drafts(emails: List[dict], instructions: str = "", force: bool = False) -> AsyncIterator[dict]:
+    """Draft replies to many emails at once, yielding one result per email as it completes.
+
+    The reply prompt is read once for the whole run. Emails that already have a draft
+    from the current reply prompt are skipped unless force is set, in which case the
+    LLM cache is bypassed too. Drafts finishing together are written with one insert_many.
+    """
+    reply_prompt_text, version = await prompt_registry.get_versioned("reply", DEFAULT_REPLY_PROMPT)
+
+    current = set()
+    if not force:
+        current = set(await drafts_collection().distinct(
+            "email_id", {"email_id": {"$in": [email["_id"] for email in emails]}, "prompt_version": version}
+        ))
+    for email in emails:
+        if email["_id"] in current:
+            yield {"email_id": str(email["_id"]), "status": "skipped"}
+    pending = [email for email in emails if email["_id"] not in current]
+
+    # LLM rate limits still apply; this only bounds what one bulk request keeps in flight
+    slots = asyncio.Semaphore(settings.BULK_DRAFT_CONCURRENCY)
+    finished: asyncio.Queue = asyncio.Queue()
+
+    async def draft_one(email: dict):
+        async with slots:
+            try:
+                content = await llm_service.generate_text(
+                    render_draft_prompt(email, instructions, reply_prompt_text),
+                    system_prompt=DRAFT_SYSTEM_PROMPT,
+                    use_cache=not force,
+                    priority="background",
+                    operation="draft"
+                )
+                await finished.put((email, content.strip(), None))
+            except Exception as e:
+                await finished.put((email, None, str(e)))
+
+    tasks = [asyncio.create_task(draft_one(email)) for email in pending]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            batch = [await finished.get()]
+            while not finished.empty() and len(batch) < settings.BULK_DRAFT_INSERT_BATCH:
+                batch.append(finished.get_nowait())
+            remaining -= len(batch)
+
+            docs = [(email, draft_document(email, content, version)) for email, content, error in batch if error is None]
+            failed = {str(email["_id"]): error for email, _, error in batch if error is not None}
+            if docs:
+                try:
+                    await drafts_collection().insert_many([doc for _, doc in docs], ordered=False)
+                except BulkWriteError as e:
+                    for write_error in e.details.get("writeErrors", []):
+                        failed[str(docs[write_error["index"]][0]["_id"])] = write_error.get("errmsg", "Could not save draft")
+                except PyMongoError as e:
+                    failed.update({str(email["_id"]): f"Could not save draft: {e}" for email, _ in docs})
+
+            for email, doc in docs:
+                if str(email["_id"]) not in failed:
+                    yield {"email_id": str(email["_id"]), "status": "generated", "draft_id": str(doc["_id"]), "content": doc["body"]}
+            for email_id, error in failed.items():
+                yield {"email_id": email_id, "status": "failed", "detail": error}
+    finally:
+        # The client went away; stop spending on drafts nobody will receive
+        for task in tasks:
+            task.cancel()
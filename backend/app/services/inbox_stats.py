@@ -0,0 +1,355 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from urllib.parse import unquote
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+from app.config import settings
+from app.utils.db import db
+from app.services import job_queue
+
+logger = logging.getLogger(__name__)
+
+STATS_ID = "inbox"
+# How long reconcile() waits after taking its lease for flushes already under way
+RECONCILE_SETTLE_SECONDS = 2.0
+# Processed emails the LLM left without a category
+UNCATEGORIZED = "Uncategorized"
+
+
+def stats_collection():
+    return db.get_db()["inbox_stats"]
+
+
+def sender_collection():
+    return db.get_db()["sender_stats"]
+
+
+def field_key(name: str) -> str:
+    """Category and priority names are LLM output; escape what MongoDB field names can't hold."""
+    return name.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def decode_keys(counts: Optional[dict]) -> dict:
+    return {unquote(key): value for key, value in (counts or {}).items()}
+
+
+def metadata_delta(metadata: Optional[dict], is_read: bool, sign: int = 1) -> Counter:
+    """What one processed email contributes to the category and action item counts."""
+    metadata = metadata or {}
+    category = field_key(metadata.get("category") or UNCATEGORIZED)
+    delta = Counter({f"categories.{category}.total": sign})
+    if not is_read:
+        delta[f"categories.{category}.unread"] += sign
+    for item in metadata.get("action_items") or []:
+        delta[f"action_items.{field_key(item.get('priority') or 'Medium')}"] += sign
+    return delta
+
+
+class InboxStats:
+    """Dashboard counts kept in one summary document plus one document per sender.
+
+    Ingestion, processing and read/unread changes add deltas here; they are written
+    as $inc updates at most every INBOX_STATS_FLUSH_SECONDS, so reads cost one
+    document however big the mailbox is. reconcile() recomputes everything from the
+    emails collection to correct drift from lost or repeated updates.
+
+    Pending deltas are bucketed by the second they were added in. While a
+    reconciliation holds its lease flushes are held back; afterwards buckets from
+    before its aggregation started are dropped, since the aggregation counted them.
+    """
+
+    def __init__(self):
+        self.pending: Dict[datetime, Counter] = defaultdict(Counter)
+        self.senders: Dict[datetime, Dict[str, Counter]] = defaultdict(lambda: defaultdict(Counter))
+        self.last_received: Dict[str, datetime] = {}
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, delta: Dict[str, int], sender: Optional[str] = None, sender_delta: Optional[Dict[str, int]] = None, received_at: Optional[datetime] = None):
+        second = datetime.utcnow().replace(microsecond=0)
+        self.pending[second].update(delta)
+        if sender and sender_delta:
+            self.senders[second][sender].update(sender_delta)
+            if received_at and (sender not in self.last_received or received_at > self.last_received[sender]):
+                self.last_received[sender] = received_at
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    def add_ingested(self, documents: Iterable[dict]):
+        for doc in documents:
+            unread = 0 if doc.get("is_read") else 1
+            self.add({"total": 1, "unread": unread}, doc["sender"], {"total": 1, "unread": unread}, doc.get("timestamp"))
+
+    def add_processed(self, metadata: dict, is_read: bool):
+        self.add({"processed": 1, **metadata_delta(metadata, is_read)})
+
+    def add_reanalyzed(self, old: dict, new: dict, is_read: bool):
+        delta = metadata_delta(new, is_read)
+        delta.update(metadata_delta(old, is_read, -1))
+        changed = {key: value for key, value in delta.items() if value}
+        if changed:
+            self.add(changed)
+
+    def add_read_change(self, email: dict, is_read: bool):
+        """email as it was before is_read changed."""
+        sign = -1 if is_read else 1
+        delta = {"unread": sign}
+        if email.get("processed"):
+            category = field_key((email.get("metadata") or {}).get("category") or UNCATEGORIZED)
+            delta[f"categories.{category}.unread"] = sign
+        self.add(delta, email["sender"], {"unread": sign})
+
+    async def _flush_later(self):
+        # Deltas held back by a reconciliation or a failed write are retried on the next tick
+        while True:
+            await asyncio.sleep(settings.INBOX_STATS_FLUSH_SECONDS)
+            await self.flush()
+            if not self.pending and not self.senders:
+                return
+
+    def _keep(self, pending: dict, senders: dict, last_received: dict):
+        """Put deltas that could not be written back for the next flush."""
+        for second, counts in pending.items():
+            self.pending[second].update(counts)
+        for second, by_sender in senders.items():
+            for sender, counts in by_sender.items():
+                self.senders[second][sender].update(counts)
+        for sender, received_at in last_received.items():
+            self.last_received[sender] = max(received_at, self.last_received.get(sender, received_at))
+
+    async def flush(self):
+        async with self._lock:
+            pending, senders, last_received = self.pending, self.senders, self.last_received
+            if not pending and not senders:
+                return
+            self.pending, self.senders, self.last_received = defaultdict(Counter), defaultdict(lambda: defaultdict(Counter)), {}
+            try:
+                doc = await stats_collection().find_one({"_id": STATS_ID}, {"reconcile_until": 1, "reconciled_from": 1}) or {}
+            except PyMongoError as e:
+                logger.warning(f"Could not write inbox stats, keeping them for the next flush: {e}")
+                self._keep(pending, senders, last_received)
+                return
+            if doc.get("reconcile_until") and doc["reconcile_until"] > datetime.utcnow():
+                # A reconciliation is reading the counts
+                self._keep(pending, senders, last_received)
+                return
+            if doc.get("reconciled_from"):
+                counted = [second for second in set(pending) | set(senders) if second + timedelta(seconds=1) <= doc["reconciled_from"]]
+                for second in counted:
+                    pending.pop(second, None)
+                    senders.pop(second, None)
+                if counted:
+                    logger.info(f"Dropped inbox stats deltas from {len(counted)}s already counted by reconciliation")
+
+            inc = Counter()
+            for counts in pending.values():
+                inc.update(counts)
+            inc = {key: value for key, value in inc.items() if value}
+            sender_inc: Dict[str, Counter] = defaultdict(Counter)
+            for by_sender in senders.values():
+                for sender, counts in by_sender.items():
+                    sender_inc[sender].update(counts)
+            try:
+                if inc:
+                    await stats_collection().update_one(
+                        {"_id": STATS_ID}, {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}}, upsert=True
+                    )
+                pending = {}
+                operations = []
+                for sender in set(sender_inc) | set(last_received):
+                    update = {"$inc": dict(sender_inc.get(sender, {}))}
+                    if sender in last_received:
+                        update["$max"] = {"last_received_at": last_received[sender]}
+                    operations.append(UpdateOne({"_id": sender}, update, upsert=True))
+                if operations:
+                    await sender_collection().bulk_write(operations, ordered=False)
+            except PyMongoError as e:
+                logger.warning(f"Could not write inbox stats, keeping them for the next flush: {e}")
+                # pending is emptied once the summary document is written, so nothing is counted twice
+                self._keep(pending, senders, last_received)
+
+    async def get(self, senders: int = 20) -> dict:
+        doc = await stats_collection().find_one({"_id": STATS_ID}) or {}
+        top_senders = []
+        if senders:
+            top_senders = await sender_collection().find().sort("total", DESCENDING).limit(senders).to_list(senders)
+        categories = {name: {"total": 0, "unread": 0, **counts} for name, counts in decode_keys(doc.get("categories")).items()}
+        return {
+            "total": doc.get("total", 0),
+            "unread": doc.get("unread", 0),
+            "processed": doc.get("processed", 0),
+            "categories": {name: counts for name, counts in categories.items() if counts["total"] or counts["unread"]},
+            "action_items": {name: count for name, count in decode_keys(doc.get("action_items")).items() if count},
+            "senders": [
+                {"sender": s["_id"], "total": s.get("total", 0), "unread": s.get("unread", 0), "last_received_at": s.get("last_received_at")}
+                for s in top_senders
+            ],
+            "updated_at": doc.get("updated_at"),
+            "reconciled_at": doc.get("reconciled_at"),
+        }
+
+    async def reconcile(self) -> dict:
+        """Recompute every count from the emails collection; returns the counters that had drifted.
+
+        Runs under a lease that holds back every process's flushes, so the counts read
+        before aggregating stay put until the difference is applied with $inc.
+        """
+        await self.flush()
+        lease = await self._acquire_reconcile_lease()
+        if lease is None:
+            logger.info("Inbox stats are already being reconciled elsewhere, skipping")
+            return {"skipped": True, "drift": {}, "senders": 0, "senders_removed": 0}
+        try:
+            return await self._reconcile(lease)
+        except BaseException:
+            await stats_collection().update_one({"_id": STATS_ID, "reconcile_until": lease}, {"$unset": {"reconcile_until": ""}})
+            raise
+
+    async def _acquire_reconcile_lease(self) -> Optional[datetime]:
+        now = datetime.utcnow()
+        until = now + timedelta(seconds=settings.INBOX_STATS_RECONCILE_LEASE_SECONDS)
+        await stats_collection().update_one({"_id": STATS_ID}, {"$setOnInsert": {"reconcile_until": None}}, upsert=True)
+        claimed = await stats_collection().update_one(
+            {"_id": STATS_ID, "$or": [{"reconcile_until": None}, {"reconcile_until": {"$lte": now}}]},
+            {"$set": {"reconcile_until": until}}
+        )
+        return until if claimed.modified_count else None
+
+    async def _reconcile(self, lease: datetime) -> dict:
+        # Let flushes that looked for a lease just before it was taken land first
+        await asyncio.sleep(RECONCILE_SETTLE_SECONDS)
+        emails = db.get_db()["emails"]
+        previous = await stats_collection().find_one({"_id": STATS_ID}) or {}
+        previous_senders = {
+            doc["_id"]: doc async for doc in sender_collection().find({}, {"total": 1, "unread": 1})
+        }
+        # Deltas added from here on may or may not be seen by the aggregations; they are kept
+        started = datetime.utcnow()
+
+        totals = await emails.aggregate([{"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "unread": {"$sum": {"$cond": ["$is_read", 0, 1]}},
+            "processed": {"$sum": {"$cond": ["$processed", 1, 0]}},
+        }}]).to_list(1)
+        computed = {key: (totals[0][key] if totals else 0) for key in ("total", "unread", "processed")}
+
+        categories = {}
+        async for row in emails.aggregate([
+            {"$match": {"processed": True}},
+            {"$group": {"_id": "$metadata.category", "total": {"$sum": 1}, "unread": {"$sum": {"$cond": ["$is_read", 0, 1]}}}},
+        ]):
+            key = field_key(row["_id"] or UNCATEGORIZED)
+            counts = categories.setdefault(key, {"total": 0, "unread": 0})
+            counts["total"] += row["total"]
+            counts["unread"] += row["unread"]
+
+        action_items = Counter()
+        async for row in emails.aggregate([
+            {"$match": {"processed": True, "metadata.action_items.0": {"$exists": True}}},
+            {"$unwind": "$metadata.action_items"},
+            {"$group": {"_id": "$metadata.action_items.priority", "count": {"$sum": 1}}},
+        ]):
+            action_items[field_key(row["_id"] or "Medium")] += row["count"]
+
+        # Keyed by the stored (escaped) field path
+        correction = {key: value - previous.get(key, 0) for key, value in computed.items()}
+        previous_categories = previous.get("categories") or {}
+        for name in set(categories) | set(previous_categories):
+            for field in ("total", "unread"):
+                correction[f"categories.{name}.{field}"] = (
+                    categories.get(name, {}).get(field, 0) - previous_categories.get(name, {}).get(field, 0)
+                )
+        previous_items = previous.get("action_items") or {}
+        for name in set(action_items) | set(previous_items):
+            correction[f"action_items.{name}"] = action_items.get(name, 0) - previous_items.get(name, 0)
+        correction = {key: value for key, value in correction.items() if value}
+
+        senders = 0
+        batch = []
+
+        async def write(operation: UpdateOne):
+            batch.append(operation)
+            if len(batch) >= 1000:
+                await sender_collection().bulk_write(batch, ordered=False)
+                batch.clear()
+
+        async for row in emails.aggregate([{"$group": {
+            "_id": "$sender",
+            "total": {"$sum": 1},
+            "unread": {"$sum": {"$cond": ["$is_read", 0, 1]}},
+            "last_received_at": {"$max": "$timestamp"},
+        }}], allowDiskUse=True):
+            old = previous_senders.pop(row["_id"], {})
+            inc = {field: row[field] - old.get(field, 0) for field in ("total", "unread")}
+            update = {"$set": {"last_received_at": row["last_received_at"], "reconciled_at": started}}
+            if any(inc.values()):
+                update["$inc"] = inc
+            await write(UpdateOne({"_id": row["_id"]}, update, upsert=True))
+            senders += 1
+        # Senders with no emails left
+        for sender, old in previous_senders.items():
+            await write(UpdateOne({"_id": sender}, {
+                "$inc": {"total": -old.get("total", 0), "unread": -old.get("unread", 0)},
+                "$set": {"reconciled_at": started},
+            }))
+        if batch:
+            await sender_collection().bulk_write(batch, ordered=False)
+
+        # Publishing reconciled_from and releasing the lease together lets held deltas through
+        update = {
+            "$set": {"updated_at": datetime.utcnow(), "reconciled_at": datetime.utcnow(), "reconciled_from": started},
+            "$unset": {"reconcile_until": ""},
+        }
+        if correction:
+            update["$inc"] = correction
+        released = await stats_collection().update_one({"_id": STATS_ID, "reconcile_until": lease}, update)
+        if not released.matched_count:
+            raise RuntimeError("Inbox stats reconciliation outlived its lease; raise INBOX_STATS_RECONCILE_LEASE_SECONDS")
+
+        # A sender whose emails arrived while this ran has a count again and is kept
+        removed = await sender_collection().delete_many({"reconciled_at": {"$lte": started}, "total": {"$lte": 0}})
+
+        drift = {unquote(key): value for key, value in correction.items()}
+        return {"drift": drift, "senders": senders, "senders_removed": removed.deleted_count}
+
+    async def schedule_reconciliation(self):
+        """Queue a reconcile job every INBOX_STATS_RECONCILE_SECONDS; whichever process claims the slot first queues it."""
+        while True:
+            now = datetime.utcnow()
+            try:
+                await stats_collection().update_one({"_id": STATS_ID}, {"$setOnInsert": {"next_reconcile_at": now}}, upsert=True)
+                # Summaries predating scheduling are reconciled straight away
+                claimed = await stats_collection().update_one(
+                    {"_id": STATS_ID, "$or": [{"next_reconcile_at": {"$lte": now}}, {"next_reconcile_at": {"$exists": False}}]},
+                    {"$set": {"next_reconcile_at": now + timedelta(seconds=settings.INBOX_STATS_RECONCILE_SECONDS)}}
+                )
+                if claimed.modified_count:
+                    await job_queue.enqueue("reconcile_stats")
+            except PyMongoError as e:
+                logger.warning(f"Could not schedule inbox stats reconciliation: {e}")
+            await asyncio.sleep(min(settings.INBOX_STATS_RECONCILE_SECONDS, 300))
+
+    def start(self):
+        if settings.INBOX_STATS_RECONCILE_SECONDS and self._task is None:
+            self._task = asyncio.create_task(self.schedule_reconciliation())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+
+inbox_stats = InboxStats()
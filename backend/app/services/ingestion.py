@@ -1,50 +1,126 @@
-import json
+import logging
 import os
-from typing import List
+from typing import Iterable, List, Optional
+from pymongo.errors import BulkWriteError
+from app.config import settings
 from app.utils.db import db
 from app.models.email import Email
+from app.services.mailbox_reader import read_mailbox
+from app.services.search_index import search_index
+from app.services.near_duplicates import fingerprint_fields
+from app.services.inbox_stats import inbox_stats
 from datetime import datetime
 
 MOCK_DATA_PATH = "../../../data/mock_inbox.json"
+DUPLICATE_KEY_ERROR = 11000
 
-from app.services.processing import process_unprocessed_emails
+from app.services.processing import ProcessingProgress, process_unprocessed_emails
 
-async def ingest_mock_data():
-    # Construct absolute path relative to this file
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(base_dir, MOCK_DATA_PATH)
-    
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"Mock data file not found at {file_path}")
+logger = logging.getLogger(__name__)
 
-    with open(file_path, "r") as f:
-        data = json.load(f)
+async def insert_email_batch(documents: List[dict]) -> int:
+    """Insert a batch of emails, skipping ones the unique index has already seen."""
+    if not documents:
+        return 0
 
     emails_collection = db.get_db()["emails"]
-    
-    new_emails = 0
-    for item in data:
-        # Check if email already exists (simple check by subject + timestamp)
-        # In a real app, we'd use a unique ID or message-id
-        timestamp = datetime.fromisoformat(item["timestamp"].replace("Z", "+00:00"))
-        existing = await emails_collection.find_one({
-            "subject": item["subject"],
-            "timestamp": timestamp
-        })
-        
-        if not existing:
+    try:
+        result = await emails_collection.insert_many(documents, ordered=False)
+        search_index.add_documents(documents)
+        inbox_stats.add_ingested(documents)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Duplicate keys mean "already ingested"; anything else is a real failure
+        write_errors = e.details.get("writeErrors", [])
+        other_errors = [err for err in write_errors if err.get("code") != DUPLICATE_KEY_ERROR]
+        if other_errors:
+            raise
+        duplicates = {err["index"] for err in write_errors}
+        inserted = [doc for i, doc in enumerate(documents) if i not in duplicates]
+        search_index.add_documents(inserted)
+        inbox_stats.add_ingested(inserted)
+        return e.details.get("nInserted", 0)
+
+async def ingest_emails(items: Iterable[dict], batch_size: Optional[int] = None, stats: Optional[dict] = None) -> dict:
+    """Consume an iterable of raw email dicts, writing them in batches so memory stays bounded.
+
+    Pass a stats dict to watch counts update while ingestion is running.
+    """
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+
+    if stats is None:
+        stats = {}
+    stats.update({"read": 0, "inserted": 0, "skipped": 0})
+    batch = []
+    for item in items:
+        stats["read"] += 1
+        if not isinstance(item, dict):
+            # Readers yield None for entries they could not parse
+            logger.warning(f"Skipping malformed email #{stats['read']}: not a JSON object")
+            stats["skipped"] += 1
+            continue
+        try:
             email = Email(
                 sender=item["sender"],
                 subject=item["subject"],
                 body=item["body"],
-                timestamp=timestamp,
+                timestamp=datetime.fromisoformat(item["timestamp"].replace("Z", "+00:00")),
                 is_read=False,
                 processed=False
             )
-            await emails_collection.insert_one(email.model_dump(by_alias=True, exclude=["id"]))
-            new_emails += 1
-            
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Skipping malformed email #{stats['read']}: {e}")
+            stats["skipped"] += 1
+            continue
+        document = email.model_dump(by_alias=True, exclude=["id"])
+        document.update(fingerprint_fields(document))
+        batch.append(document)
+
+        if len(batch) >= batch_size:
+            stats["inserted"] += await insert_email_batch(batch)
+            batch = []
+
+    stats["inserted"] += await insert_email_batch(batch)
+    return stats
+
+def resolve_mailbox_path(path: str) -> str:
+    """Resolve a user-supplied mailbox path, refusing anything outside the import directory."""
+    import_dir = os.path.realpath(settings.MAILBOX_IMPORT_DIR or os.path.dirname(get_mock_data_path()))
+    file_path = os.path.realpath(os.path.join(import_dir, path))
+    if os.path.commonpath([import_dir, file_path]) != import_dir:
+        raise ValueError("Mailbox path must be inside the import directory")
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"Mailbox file not found: {path}")
+    return file_path
+
+def get_mock_data_path() -> str:
+    # Construct absolute path relative to this file
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.normpath(os.path.join(base_dir, MOCK_DATA_PATH))
+
+async def ingest_file(file_path: str, format: Optional[str] = None, stats: Optional[dict] = None, progress: Optional[ProcessingProgress] = None):
+    new_emails = await ingest_emails(read_mailbox(file_path, format), stats=stats)
+
+    if settings.CHANGE_FEED_ENABLED:
+        # The change feed picks new emails up as they are inserted
+        return {
+            "message": f"Ingested {new_emails['inserted']} new emails; processing continues in the background",
+            "ingestion": new_emails,
+            "progress": None
+        }
+
     # Trigger processing
-    processed_count = await process_unprocessed_emails()
-            
-    return {"message": f"Ingested {new_emails} new emails and processed {processed_count} emails"}
+    progress = await process_unprocessed_emails(progress=progress)
+
+    return {
+        "message": f"Ingested {new_emails['inserted']} new emails and processed {progress.processed} emails",
+        "ingestion": new_emails,
+        "progress": progress.snapshot()
+    }
+
+async def ingest_mock_data():
+    file_path = get_mock_data_path()
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Mock data file not found at {file_path}")
+
+    return await ingest_file(file_path, "json")
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.config import settings
+from app.models.job import Job
+from app.utils.db import db
+
+def jobs_collection():
+    return db.get_db()["jobs"]
+
+async def enqueue(job_type: str, params: Optional[Dict[str, Any]] = None, max_attempts: Optional[int] = None) -> str:
+    job = Job(
+        type=job_type,
+        params=params or {},
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS
+    )
+    result = await jobs_collection().insert_one(job.model_dump(by_alias=True, exclude=["id"]))
+    return str(result.inserted_id)
+
+async def get_job(job_id: str) -> Optional[dict]:
+    return await jobs_collection().find_one({"_id": ObjectId(job_id)})
+
+async def claim(worker_id: str) -> Optional[dict]:
+    """Atomically take the oldest runnable job, including ones whose worker's lease ran out."""
+    now = datetime.utcnow()
+    while True:
+        job = await jobs_collection().find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued", "run_after": {"$lte": now}},
+                    # The previous worker crashed or stalled without renewing its lease
+                    {"status": "running", "lease_expires_at": {"$lt": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "worker_id": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return None
+        if job["attempts"] <= job["max_attempts"]:
+            return job
+
+        # A job that keeps killing its workers is not retried forever
+        await jobs_collection().update_one(
+            {"_id": job["_id"], "worker_id": worker_id},
+            {"$set": {"status": "failed", "error": job.get("error") or "Lease expired too many times", "updated_at": now}}
+        )
+
+async def heartbeat(job_id: ObjectId, worker_id: str, progress: Dict[str, Any]) -> bool:
+    """Extend the lease and publish progress; False means another worker now owns the job."""
+    now = datetime.utcnow()
+    result = await jobs_collection().update_one(
+        {"_id": job_id, "worker_id": worker_id, "status": "running"},
+        {"$set": {
+            "progress": progress,
+            "lease_expires_at": now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+            "updated_at": now,
+        }}
+    )
+    return result.matched_count == 1
+
+async def complete(job_id: ObjectId, worker_id: str, result: Dict[str, Any], progress: Dict[str, Any]):
+    await jobs_collection().update_one(
+        {"_id": job_id, "worker_id": worker_id},
+        {"$set": {
+            "status": "completed",
+            "result": result,
+            "progress": progress,
+            "error": None,
+            "lease_expires_at": None,
+            "updated_at": datetime.utcnow(),
+        }}
+    )
+
+async def fail(job: dict, worker_id: str, error: str, progress: Dict[str, Any]):
+    """Requeue with exponential backoff, or mark failed once attempts are used up."""
+    now = datetime.utcnow()
+    update = {
+        "error": error,
+        "progress": progress,
+        "lease_expires_at": None,
+        "updated_at": now,
+    }
+    if job["attempts"] < job["max_attempts"]:
+        update["status"] = "queued"
+        update["run_after"] = now + timedelta(seconds=settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1))
+    else:
+        update["status"] = "failed"
+
+    await jobs_collection().update_one({"_id": job["_id"], "worker_id": worker_id}, {"$set": update})
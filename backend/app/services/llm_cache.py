@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+from app.utils.db import db
+from app.utils.metrics import LLM_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(provider: str, model: str, system_prompt: str, prompt: str) -> str:
+    digest = hashlib.sha256()
+    for part in (provider, model, system_prompt, prompt):
+        digest.update(part.encode("utf-8"))
+        # Separator so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class CacheBackend(ABC):
+    """Interface for a response cache tier."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: int):
+        ...
+
+    @abstractmethod
+    async def clear(self):
+        ...
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU tier with per-entry expiry."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str, ttl: int):
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def clear(self):
+        self.entries.clear()
+
+
+class MongoCache(CacheBackend):
+    """Persistent tier shared across processes; expiry is handled by a TTL index on expires_at."""
+
+    collection_name = "llm_cache"
+
+    def _collection(self):
+        return db.get_db()[self.collection_name]
+
+    async def get(self, key: str) -> Optional[str]:
+        doc = await self._collection().find_one({"_id": key})
+        if not doc or doc["expires_at"] < datetime.utcnow():
+            return None
+        return doc["response"]
+
+    async def set(self, key: str, value: str, ttl: int):
+        await self._collection().update_one(
+            {"_id": key},
+            {"$set": {"response": value, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    async def clear(self):
+        await self._collection().delete_many({})
+
+
+class LLMCache:
+    """Tiered response cache: memory first, then the optional persistent tier."""
+
+    def __init__(self, tiers: list, ttl: int):
+        self.tiers = tiers
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[str]:
+        for i, tier in enumerate(self.tiers):
+            try:
+                value = await tier.get(key)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"LLM cache read failed: {e}")
+                continue
+            if value is not None:
+                self.hits += 1
+                LLM_CACHE_LOOKUPS.labels(result="hit").inc()
+                # Promote into the faster tiers
+                for faster in self.tiers[:i]:
+                    try:
+                        await faster.set(key, value, self.ttl)
+                    except Exception as e:
+                        self.errors += 1
+                        logger.warning(f"LLM cache write failed: {e}")
+                return value
+        self.misses += 1
+        LLM_CACHE_LOOKUPS.labels(result="miss").inc()
+        return None
+
+    async def set(self, key: str, value: str):
+        for tier in self.tiers:
+            try:
+                await tier.set(key, value, self.ttl)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"LLM cache write failed: {e}")
+
+    async def clear(self):
+        for tier in self.tiers:
+            await tier.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "tiers": [type(tier).__name__ for tier in self.tiers],
+        }
@@ -0,0 +1,90 @@
+import asyncio
+from typing import Optional
+
+
+class LLMError(Exception):
+    """Base class for LLM failures. retryable errors may succeed if the call is repeated."""
+
+    retryable = False
+    status_code = 503
+
+    def __init__(self, message: str, provider: Optional[str] = None):
+        super().__init__(message)
+        self.provider = provider
+
+
+class LLMRateLimitError(LLMError):
+    retryable = True
+    status_code = 429
+
+    def __init__(self, message: str, provider: Optional[str] = None, retry_after: Optional[float] = None):
+        super().__init__(message, provider)
+        self.retry_after = retry_after
+
+
+class LLMTimeoutError(LLMError):
+    retryable = True
+
+
+class LLMProviderError(LLMError):
+    """The provider failed on its side (5xx, connection reset) - worth retrying."""
+
+    retryable = True
+
+
+class LLMAuthError(LLMError):
+    """Bad or missing credentials; retrying won't help but another provider might."""
+
+
+class LLMRequestError(LLMError):
+    """The request itself was rejected; neither retries nor failover will help."""
+
+    status_code = 502
+
+
+class LLMUnavailableError(LLMError):
+    """No configured provider could take the call (all circuits open or all failed)."""
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    for attr in ("status_code", "http_status", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    headers = getattr(exc, "headers", None) or getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def classify_exception(provider: str, exc: Exception) -> LLMError:
+    """Map an OpenAI / Gemini SDK exception onto the typed errors above.
+
+    Works off status codes and class names so it doesn't depend on one SDK version.
+    """
+    if isinstance(exc, LLMError):
+        return exc
+
+    name = type(exc).__name__
+    message = f"{provider}: {name}: {exc}"
+    status = _status_code(exc)
+
+    if status == 429 or name in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+        return LLMRateLimitError(message, provider, retry_after=_retry_after(exc))
+    if isinstance(exc, asyncio.TimeoutError) or "Timeout" in name or name == "DeadlineExceeded":
+        return LLMTimeoutError(message, provider)
+    if status in (401, 403) or name in ("AuthenticationError", "PermissionDeniedError", "PermissionDenied", "Unauthenticated"):
+        return LLMAuthError(message, provider)
+    if status is not None and 400 <= status < 500 or name in ("InvalidRequestError", "BadRequestError", "InvalidArgument"):
+        return LLMRequestError(message, provider)
+    return LLMProviderError(message, provider)
@@ -0,0 +1,194 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, Optional, Tuple
+import google.generativeai as genai
+import httpx
+from openai import AsyncOpenAI
+from app.config import settings
+
+# (text, response headers, total tokens used)
+Completion = Tuple[str, Optional[dict], Optional[int]]
+
+
+class ProviderBackend(ABC):
+    """Long-lived client for one LLM provider. Created once at startup and reused by every call."""
+
+    name = ""
+
+    def __init__(self, model: str, max_connections: int):
+        self.model = model
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+
+    @property
+    def configured(self) -> bool:
+        return True
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def complete(self, system_prompt: str, prompt: str) -> Completion:
+        ...
+
+    @abstractmethod
+    def stream(self, system_prompt: str, prompt: str) -> AsyncIterator[str]:
+        """Implemented as an async generator yielding text as it arrives."""
+
+    def _enter(self):
+        self.in_flight += 1
+        self.requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self):
+        self.in_flight -= 1
+
+    def pool_stats(self) -> dict:
+        return {
+            "model": self.model,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "max_connections": self.max_connections,
+            "utilization": round(self.in_flight / self.max_connections, 3) if self.max_connections else 0.0,
+            "requests": self.requests,
+        }
+
+
+class OpenAIBackend(ProviderBackend):
+    name = "openai"
+
+    def __init__(self):
+        super().__init__(settings.OPENAI_MODEL, settings.LLM_MAX_CONNECTIONS)
+        self.http_client: Optional[httpx.AsyncClient] = None
+        self.client: Optional[AsyncOpenAI] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(settings.OPENAI_API_KEY)
+
+    async def start(self):
+        if self.client is not None:
+            return
+        # One keep-alive pool for the lifetime of the process
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=10.0),
+        )
+        # Retries are handled by LLMService so they can honour the shared rate limiter
+        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, http_client=self.http_client, max_retries=0)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+            self.http_client = None
+
+    async def complete(self, system_prompt: str, prompt: str) -> Completion:
+        await self.start()
+        self._enter()
+        try:
+            raw = await self.client.chat.completions.with_raw_response.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+            )
+        finally:
+            self._exit()
+        response = raw.parse()
+        usage = response.usage.total_tokens if response.usage else None
+        return (response.choices[0].message.content or "").strip(), dict(raw.headers), usage
+
+    async def stream(self, system_prompt: str, prompt: str) -> AsyncIterator[str]:
+        await self.start()
+        self._enter()
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                stream=True,
+            )
+            async for chunk in response:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    yield token
+        finally:
+            self._exit()
+
+
+class GeminiBackend(ProviderBackend):
+    name = "gemini"
+
+    def __init__(self):
+        model = settings.GEMINI_MODEL
+        if not model.startswith("models/"):
+            model = f"models/{model}"
+        super().__init__(model, settings.LLM_MAX_CONNECTIONS)
+        self.models: Dict[str, genai.GenerativeModel] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(settings.GEMINI_API_KEY)
+
+    async def start(self):
+        if self._slots is not None:
+            return
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        # The SDK manages its own channel; cap concurrent calls to the same pool size as OpenAI
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self.models[self.model] = genai.GenerativeModel(self.model)
+
+    async def close(self):
+        self.models.clear()
+        self._slots = None
+
+    async def complete(self, system_prompt: str, prompt: str) -> Completion:
+        await self.start()
+        # Gemini doesn't have system prompts in the same way, usually prepended
+        full_prompt = f"{system_prompt}\n\n{prompt}"
+        async with self._slots:
+            self._enter()
+            try:
+                response = await asyncio.wait_for(
+                    self.models[self.model].generate_content_async(full_prompt),
+                    settings.LLM_REQUEST_TIMEOUT
+                )
+            finally:
+                self._exit()
+        usage = getattr(response, "usage_metadata", None)
+        return response.text.strip(), None, getattr(usage, "total_token_count", None)
+
+    async def stream(self, system_prompt: str, prompt: str) -> AsyncIterator[str]:
+        await self.start()
+        async with self._slots:
+            self._enter()
+            try:
+                response = await asyncio.wait_for(
+                    self.models[self.model].generate_content_async(f"{system_prompt}\n\n{prompt}", stream=True),
+                    settings.LLM_REQUEST_TIMEOUT
+                )
+                async for chunk in response:
+                    if chunk.text:
+                        yield chunk.text
+            finally:
+                self._exit()
+
+
+PROVIDER_BACKENDS = {
+    "openai": OpenAIBackend,
+    "gemini": GeminiBackend,
+}
@@ -1,63 +1,260 @@
-import openai
-import google.generativeai as genai
 from app.config import settings
+from app.services.llm_providers import PROVIDER_BACKENDS, ProviderBackend
+from app.utils.rate_limit import BACKGROUND, PRIORITIES, RateLimiter
+from app.services.llm_cache import LLMCache, MemoryCache, MongoCache, make_cache_key
+from app.services.llm_errors import LLMError, LLMRateLimitError, LLMRequestError, LLMUnavailableError, classify_exception
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.metrics import LLM_ERRORS, LLM_REQUEST_SECONDS, LLM_TOKENS
+from app.models.email import ActionItem, EmailMetadata
+from pydantic import ValidationError
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Optional
 import json
 import logging
+import random
+import time
 
 logger = logging.getLogger(__name__)
 
 class LLMService:
     def __init__(self):
         self.provider = settings.LLM_PROVIDER.lower()
-        self.openai_api_key = settings.OPENAI_API_KEY
-        self.gemini_api_key = settings.GEMINI_API_KEY
-        
-        if self.provider == "openai" and self.openai_api_key:
-            openai.api_key = self.openai_api_key
-        elif self.provider == "gemini" and self.gemini_api_key:
-            genai.configure(api_key=self.gemini_api_key)
+        self.fallback_provider = settings.LLM_FALLBACK_PROVIDER.lower()
+
+        # Long-lived provider clients, created by startup() (or lazily on first use)
+        self.backends: Dict[str, ProviderBackend] = {}
+
+        # One limiter per provider and model, shared by processing, chat and drafts
+        self.rate_limiters: Dict[str, RateLimiter] = {}
+
+        self.circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+        self.cache = None
+        if settings.LLM_CACHE_ENABLED:
+            tiers = [MemoryCache(settings.LLM_CACHE_MAX_ENTRIES)]
+            if settings.LLM_CACHE_PERSISTENT:
+                tiers.append(MongoCache())
+            self.cache = LLMCache(tiers, ttl=settings.LLM_CACHE_TTL_SECONDS)
+
+    async def startup(self):
+        for provider in (self.provider, self.fallback_provider):
+            backend = self.backend(provider)
+            if backend and backend.configured:
+                await backend.start()
+
+    async def shutdown(self):
+        for backend in self.backends.values():
+            await backend.close()
+
+    def register_backend(self, backend: ProviderBackend):
+        """Install a backend under backend.name, e.g. a fake provider for benchmarks."""
+        self.backends[backend.name] = backend
+
+    def backend(self, provider: str) -> Optional[ProviderBackend]:
+        if provider not in self.backends and provider in PROVIDER_BACKENDS:
+            self.backends[provider] = PROVIDER_BACKENDS[provider]()
+        return self.backends.get(provider)
+
+    def model_name(self, provider: Optional[str] = None) -> str:
+        backend = self.backend(provider or self.provider)
+        return backend.model if backend else ""
+
+    def rate_limiter(self, provider: str) -> RateLimiter:
+        model = self.model_name(provider)
+        key = f"{provider}:{model}"
+        if key not in self.rate_limiters:
+            if provider == "openai":
+                self.rate_limiters[key] = RateLimiter(key, settings.OPENAI_RPM, settings.OPENAI_TPM)
+            elif provider == "gemini":
+                self.rate_limiters[key] = RateLimiter(key, settings.GEMINI_RPM, settings.GEMINI_TPM)
+            else:
+                self.rate_limiters[key] = RateLimiter(key, 0, 0)
+        return self.rate_limiters[key]
+
+    def circuit_breaker(self, provider: str) -> CircuitBreaker:
+        if provider not in self.circuit_breakers:
+            self.circuit_breakers[provider] = CircuitBreaker(
+                provider,
+                failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                recovery_timeout=settings.LLM_CIRCUIT_RECOVERY_SECONDS
+            )
+        return self.circuit_breakers[provider]
+
+    def providers(self) -> list:
+        """Configured providers in failover order: LLM_PROVIDER first, then LLM_FALLBACK_PROVIDER."""
+        order = [self.provider]
+        if self.fallback_provider and self.fallback_provider != self.provider:
+            order.append(self.fallback_provider)
+        return [p for p in order if self.backend(p) and self.backend(p).configured]
+
+    def cache_stats(self) -> dict:
+        if not self.cache:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+
+    def health(self) -> dict:
+        return {
+            "providers": self.providers(),
+            "circuit_breakers": {p: b.snapshot() for p, b in self.circuit_breakers.items()},
+            "rate_limiters": {key: limiter.snapshot() for key, limiter in self.rate_limiters.items()},
+            "pools": self.pool_stats(),
+        }
+
+    def pool_stats(self) -> dict:
+        return {name: backend.pool_stats() for name, backend in self.backends.items()}
+
+    async def generate_text(self, prompt: str, system_prompt: str = "You are a helpful assistant.", use_cache: bool = True, priority: str = "background", operation: str = "generate", cache_if: Optional[Callable[[str], bool]] = None) -> str:
+        """Return the completion text. Raises LLMError when no provider can answer.
+
+        priority="interactive" jumps ahead of background work waiting on the rate limiter.
+        operation labels the call in metrics (categorize, extract, summarize, draft, chat, ...).
+        cache_if, when given, decides whether a fresh response is worth caching.
+        """
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = make_cache_key(self.provider, self.model_name(), system_prompt, prompt)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        chosen = {}
+
+        async def call(provider: str):
+            chosen["provider"] = provider
+            return await self._call_provider(provider, prompt, system_prompt)
+
+        estimated_tokens = estimate_tokens(system_prompt + prompt) + settings.LLM_ESTIMATED_OUTPUT_TOKENS
+        response = await self._with_failover(call, estimated_tokens, PRIORITIES.get(priority, BACKGROUND), operation)
+
+        # The key names the primary provider; a fallback's answer must not be served as its own
+        if cache_key and chosen["provider"] == self.provider and (cache_if is None or cache_if(response)):
+            await self.cache.set(cache_key, response)
+        return response
+
+    async def _with_failover(self, call, estimated_tokens: int, priority: int, operation: str):
+        """Run call(provider) with retries on each configured provider in turn.
+
+        call returns (result, response_headers, total_tokens_used).
+        """
+        providers = self.providers()
+        if not providers:
+            raise LLMUnavailableError("No LLM provider is configured")
+
+        last_error = None
+        for provider in providers:
+            breaker = self.circuit_breaker(provider)
+            if not breaker.allow_request():
+                last_error = LLMUnavailableError(f"{provider} circuit is open", provider)
+                continue
+            try:
+                result = await self._with_retries(provider, call, estimated_tokens, priority, operation)
+            except asyncio.CancelledError:
+                breaker.abandon()
+                raise
+            except LLMRequestError:
+                # The provider is healthy, it just didn't like this request
+                breaker.record_success()
+                raise
+            except LLMError as e:
+                breaker.record_failure()
+                last_error = e
+                logger.warning(f"LLM provider {provider} failed, trying next provider: {e}")
+                continue
+            breaker.record_success()
+            return result
+
+        raise LLMUnavailableError(f"All LLM providers failed: {last_error}") from last_error
+
+    async def _with_retries(self, provider: str, call, estimated_tokens: int, priority: int, operation: str):
+        limiter = self.rate_limiter(provider)
+        attempt = 0
+        while True:
+            await limiter.acquire(estimated_tokens, priority)
+            start = time.perf_counter()
+            try:
+                result, headers, used_tokens = await call(provider)
+                LLM_REQUEST_SECONDS.labels(provider=provider, operation=operation, outcome="success").observe(time.perf_counter() - start)
+                if used_tokens:
+                    LLM_TOKENS.labels(provider=provider, operation=operation).inc(used_tokens)
+                limiter.on_success(headers)
+                limiter.record_usage(estimated_tokens, used_tokens)
+                return result
+            except Exception as e:
+                error = classify_exception(provider, e)
+                LLM_REQUEST_SECONDS.labels(provider=provider, operation=operation, outcome="error").observe(time.perf_counter() - start)
+                LLM_ERRORS.labels(provider=provider, operation=operation, error=type(error).__name__).inc()
+                if isinstance(error, LLMRateLimitError):
+                    limiter.on_rate_limited(error.retry_after)
+                attempt += 1
+                if not error.retryable or attempt > settings.LLM_MAX_RETRIES:
+                    logger.error(f"LLM Error: {error}")
+                    raise error from e
+
+                # Exponential backoff with full jitter, but never sooner than Retry-After
+                delay = random.uniform(0, min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+                retry_after = getattr(error, "retry_after", None)
+                if retry_after:
+                    delay = max(delay, retry_after)
+                logger.warning(f"LLM call to {provider} failed ({error}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _call_provider(self, provider: str, prompt: str, system_prompt: str):
+        return await self.backend(provider).complete(system_prompt, prompt)
+
+    async def _open_stream(self, provider: str, prompt: str, system_prompt: str):
+        tokens = self.backend(provider).stream(system_prompt, prompt)
+        # Pull the first token here so connection errors still get retries and failover
+        try:
+            first = await tokens.__anext__()
+        except StopAsyncIteration:
+            first = None
+
+        async def rest():
+            if first is None:
+                return
+            yield first
+            async for token in tokens:
+                yield token
+        return rest(), None, None
+
+    async def stream_text(self, prompt: str, system_prompt: str = "You are a helpful assistant.", use_cache: bool = True, priority: str = "interactive", operation: str = "stream") -> AsyncIterator[str]:
+        """Yield the completion in pieces as the provider produces them.
+
+        Retries and failover apply until the stream is open; an error after that raises LLMError.
+        """
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = make_cache_key(self.provider, self.model_name(), system_prompt, prompt)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        chosen = {}
+
+        async def open_stream(provider: str):
+            chosen["provider"] = provider
+            return await self._open_stream(provider, prompt, system_prompt)
 
-    async def generate_text(self, prompt: str, system_prompt: str = "You are a helpful assistant.") -> str:
-        if not (self.openai_api_key or self.gemini_api_key):
-            logger.warning("No API Key found. Returning mock response.")
-            return "Mock LLM Response: Please configure API Key."
+        estimated_tokens = estimate_tokens(system_prompt + prompt) + settings.LLM_ESTIMATED_OUTPUT_TOKENS
+        tokens = await self._with_failover(open_stream, estimated_tokens, PRIORITIES.get(priority, BACKGROUND), operation)
 
+        parts = []
         try:
-            if self.provider == "openai":
-                response = await openai.ChatCompletion.acreate(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                return response.choices[0].message.content.strip()
-            
-            elif self.provider == "gemini":
-                model_name = getattr(settings, "GEMINI_MODEL", "gemini-1.5-flash")
-                if not model_name.startswith("models/"):
-                    model_name = f"models/{model_name}"
-                model = genai.GenerativeModel(model_name)
-                # Gemini doesn't have system prompts in the same way, usually prepended
-                full_prompt = f"{system_prompt}\n\n{prompt}"
-                response = await model.generate_content_async(full_prompt)
-                return response.text.strip()
-                
-            return "Mock LLM Response: Provider not implemented."
+            async for token in tokens:
+                parts.append(token)
+                yield token
         except Exception as e:
-            logger.error(f"LLM Error: {e}")
-            return f"Error generating response: {str(e)}"
+            raise classify_exception(chosen["provider"], e) from e
 
-    async def generate_json(self, prompt: str, system_prompt: str = "You are a helpful assistant.") -> dict:
-        text_response = await self.generate_text(prompt, system_prompt)
+        if cache_key and parts and chosen["provider"] == self.provider:
+            await self.cache.set(cache_key, "".join(parts).strip())
+
+    async def generate_json(self, prompt: str, system_prompt: str = "You are a helpful assistant.", use_cache: bool = True, priority: str = "background", operation: str = "generate") -> dict:
+        # A malformed or truncated answer is not cached, so the next call asks again
+        text_response = await self.generate_text(prompt, system_prompt, use_cache=use_cache, priority=priority, operation=operation, cache_if=is_json_response)
         try:
-            # Attempt to find JSON in the response
-            if "```json" in text_response:
-                text_response = text_response.split("```json")[1].split("```")[0].strip()
-            elif "```" in text_response:
-                text_response = text_response.split("```")[1].split("```")[0].strip()
-            
-            return json.loads(text_response)
+            return parse_json_response(text_response)
         except json.JSONDecodeError:
             logger.error(f"Failed to parse JSON: {text_response}")
             return {}
@@ -72,7 +269,7 @@ class LLMService:
         
         {prompt_template}
         """
-        return await self.generate_text(full_prompt, system_prompt="You are an email categorization assistant.")
+        return await self.generate_text(full_prompt, system_prompt="You are an email categorization assistant.", operation="categorize")
 
     async def extract_action_items(self, content: str, prompt_template: str, instructions: str = "") -> dict:
         full_prompt = f"""
@@ -84,7 +281,7 @@ class LLMService:
         
         {prompt_template}
         """
-        return await self.generate_json(full_prompt, system_prompt="You are a task extraction assistant. Output valid JSON.")
+        return await self.generate_json(full_prompt, system_prompt="You are a task extraction assistant. Output valid JSON.", operation="extract")
 
     async def summarize_email(self, content: str, prompt_template: str, instructions: str = "") -> str:
         full_prompt = f"""
@@ -96,7 +293,129 @@ class LLMService:
         
         {prompt_template}
         """
-        return await self.generate_text(full_prompt, system_prompt="You are an email summarization assistant.")
+        return await self.generate_text(full_prompt, system_prompt="You are an email summarization assistant.", operation="summarize")
+
+    async def analyze_email(self, content: str, categorization_prompt: str, extraction_prompt: str, summarization_prompt: str, instructions: str = "", category: Optional[str] = None) -> EmailMetadata:
+        """Categorize, extract action items and summarize in one structured request.
+
+        Fields that come back missing or malformed are re-asked individually, so a bad
+        answer for one field never costs a full second round-trip for the others.
+        Pass category when it is already known (e.g. from batch categorization) to skip it.
+        """
+        category_field = "" if category else f'- "category": a string. {categorization_prompt}'
+        full_prompt = f"""
+        Email Content:
+        {content}
+        
+        Instructions:
+        {instructions}
+        
+        Analyze the email and respond with a single JSON object with exactly these keys:
+        {category_field}
+        - "action_items": a list of objects with "task", "deadline" (or null) and "priority" (High/Medium/Low). {extraction_prompt} Put the tasks in "action_items" whatever shape the previous sentence asks for.
+        - "summary": a string. {summarization_prompt}
+        """
+        result = await self.generate_json(full_prompt, system_prompt="You are an email analysis assistant. Output valid JSON.", operation="analyze")
+        if not isinstance(result, dict):
+            result = {}
+
+        if not category:
+            category = result.get("category")
+            category = category.strip() if isinstance(category, str) and category.strip() else None
+
+        action_items = result.get("action_items", result.get("tasks"))
+        try:
+            action_items = [ActionItem.model_validate(item) for item in action_items] if isinstance(action_items, list) else None
+        except ValidationError:
+            action_items = None
+
+        summary = result.get("summary")
+        summary = summary.strip() if isinstance(summary, str) and summary.strip() else None
+
+        # Targeted re-asks for only the fields that failed
+        fallbacks = {}
+        if category is None:
+            fallbacks["category"] = self.categorize_email(content, categorization_prompt, instructions)
+        if action_items is None:
+            fallbacks["action_items"] = self.extract_action_items(content, extraction_prompt, instructions)
+        if summary is None:
+            fallbacks["summary"] = self.summarize_email(content, summarization_prompt, instructions)
+
+        if fallbacks:
+            logger.warning(f"Combined analysis re-asking for: {', '.join(fallbacks)}")
+            values = dict(zip(fallbacks, await asyncio.gather(*fallbacks.values())))
+            if "category" in values:
+                category = values["category"].strip()
+            if "action_items" in values:
+                action_items = parse_action_items(values["action_items"])
+            if "summary" in values:
+                summary = values["summary"].strip()
+
+        return EmailMetadata(category=category, action_items=action_items, summary=summary)
+
+    async def categorize_batch(self, emails: Dict[str, str], prompt_template: str, token_budget: Optional[int] = None) -> Dict[str, str]:
+        """Categorize many short emails with as few requests as possible.
+
+        emails maps an id to its content. Emails are packed into prompts of at most
+        token_budget estimated tokens; entries missing from a response are retried in
+        smaller groups until they fall back to categorize_email.
+        """
+        token_budget = token_budget or settings.LLM_BATCH_TOKEN_BUDGET
+
+        chunks = []
+        chunk, chunk_tokens = {}, 0
+        for email_id, content in emails.items():
+            tokens = estimate_tokens(content)
+            if chunk and chunk_tokens + tokens > token_budget:
+                chunks.append(chunk)
+                chunk, chunk_tokens = {}, 0
+            chunk[email_id] = content
+            chunk_tokens += tokens
+        if chunk:
+            chunks.append(chunk)
+
+        categories = {}
+        for result in await asyncio.gather(*(self._categorize_chunk(c, prompt_template) for c in chunks)):
+            categories.update(result)
+        return categories
+
+    async def _categorize_chunk(self, chunk: Dict[str, str], prompt_template: str) -> Dict[str, str]:
+        if len(chunk) == 1:
+            email_id, content = next(iter(chunk.items()))
+            return {email_id: (await self.categorize_email(content, prompt_template)).strip()}
+
+        emails_text = "\n".join(f'<email id="{email_id}">\n{content}\n</email>' for email_id, content in chunk.items())
+        full_prompt = f"""
+        Emails:
+        {emails_text}
+        
+        {prompt_template}
+        
+        Categorize every email above independently. Respond with a single JSON object
+        mapping each email id to its category name, e.g. {{"<id>": "<category>"}}.
+        """
+        result = await self.generate_json(full_prompt, system_prompt="You are an email categorization assistant. Output valid JSON.", operation="categorize_batch")
+        if not isinstance(result, dict):
+            result = {}
+
+        categories = {
+            email_id: result[email_id].strip()
+            for email_id in chunk
+            if isinstance(result.get(email_id), str) and result[email_id].strip()
+        }
+
+        missing = {email_id: content for email_id, content in chunk.items() if email_id not in categories}
+        if missing:
+            if len(missing) == len(chunk):
+                # Nothing usable came back; split so one bad email can't sink the rest
+                items = list(chunk.items())
+                half = len(items) // 2
+                parts = [dict(items[:half]), dict(items[half:])]
+            else:
+                parts = [missing]
+            for result in await asyncio.gather(*(self._categorize_chunk(p, prompt_template) for p in parts)):
+                categories.update(result)
+        return categories
 
     async def generate_draft(self, content: str, prompt_template: str, instructions: str = "") -> str:
         full_prompt = f"""
@@ -108,6 +427,36 @@ class LLMService:
         
         {prompt_template}
         """
-        return await self.generate_text(full_prompt, system_prompt="You are an email drafting assistant.")
+        return await self.generate_text(full_prompt, system_prompt="You are an email drafting assistant.", operation="draft")
+
+def parse_json_response(text: str):
+    """The JSON in a response, unwrapped from a markdown code fence if there is one."""
+    if "```json" in text:
+        text = text.split("```json")[1].split("```")[0].strip()
+    elif "```" in text:
+        text = text.split("```")[1].split("```")[0].strip()
+    return json.loads(text)
+
+def is_json_response(text: str) -> bool:
+    try:
+        parse_json_response(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+def parse_action_items(actions_json: dict) -> list:
+    """Validate extraction output, dropping entries that don't fit ActionItem."""
+    tasks = actions_json.get("tasks", actions_json.get("action_items", [])) if isinstance(actions_json, dict) else []
+    items = []
+    for task in tasks if isinstance(tasks, list) else []:
+        try:
+            items.append(ActionItem.model_validate(task))
+        except ValidationError:
+            logger.warning(f"Dropping malformed action item: {task}")
+    return items
 
 llm_service = LLMService()
@@ -0,0 +1,131 @@
+import json
+import os
+from email import message_from_bytes, policy
+from email.utils import parsedate_to_datetime
+from typing import Iterator, Optional
+
+CHUNK_SIZE = 64 * 1024
+SUPPORTED_FORMATS = ("json", "jsonl", "mbox")
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if ext in (".mbox", ".mbx", ""):
+        return "mbox"
+    return "json"
+
+def iter_json_array(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """Yield the items of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        started = False
+        eof = False
+
+        while True:
+            # Skip whitespace and separators between items
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+
+            if pos >= len(buf):
+                if eof:
+                    raise ValueError("Unexpected end of JSON array")
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+
+            if buf[pos] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The item straddles the chunk boundary; read more and retry
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+
+            pos = end
+            yield item
+
+def iter_jsonl(path: str) -> Iterator[Optional[dict]]:
+    """Yield one item per line; a line that is not valid JSON yields None so the import counts it as skipped."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+
+def _message_to_item(raw: bytes) -> Optional[dict]:
+    message = message_from_bytes(raw, policy=policy.default)
+
+    body_part = message.get_body(preferencelist=("plain", "html"))
+    body = body_part.get_content() if body_part is not None else ""
+
+    date = message.get("Date")
+    try:
+        timestamp = parsedate_to_datetime(date).isoformat() if date else None
+    except (TypeError, ValueError):
+        timestamp = None
+    if timestamp is None:
+        return None
+
+    return {
+        "sender": str(message.get("From", "")),
+        "subject": str(message.get("Subject", "")),
+        "body": body,
+        "timestamp": timestamp,
+    }
+
+def iter_mbox(path: str) -> Iterator[dict]:
+    """Yield messages from an RFC 822 mbox file, holding one message in memory at a time."""
+    with open(path, "rb") as f:
+        lines = []
+        previous_blank = True
+        for line in f:
+            if line.startswith(b"From ") and previous_blank:
+                if lines:
+                    item = _message_to_item(b"".join(lines))
+                    if item:
+                        yield item
+                lines = []
+            else:
+                # mboxrd escapes body lines that look like separators
+                if line.startswith(b">") and line.lstrip(b">").startswith(b"From "):
+                    line = line[1:]
+                lines.append(line)
+            previous_blank = line in (b"\n", b"\r\n")
+
+        if lines:
+            item = _message_to_item(b"".join(lines))
+            if item:
+                yield item
+
+def read_mailbox(path: str, format: Optional[str] = None) -> Iterator[dict]:
+    format = (format or detect_format(path)).lower()
+    if format == "json":
+        return iter_json_array(path)
+    if format == "jsonl":
+        return iter_jsonl(path)
+    if format == "mbox":
+        return iter_mbox(path)
+    raise ValueError(f"Unsupported mailbox format: {format}. Expected one of {', '.join(SUPPORTED_FORMATS)}")
@@ -0,0 +1,127 @@
+import asyncio
+import re
+from hashlib import blake2b
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+from app.config import settings
+from app.models.email import EmailMetadata
+from app.utils.db import db
+from app.utils.metrics import NEAR_DUPLICATE_MATCHES
+
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+DIGITS_PATTERN = re.compile(r"\d+")
+REPLY_PREFIX = re.compile(r"^\s*((re|fwd?|aw)\s*:\s*)+", re.IGNORECASE)
+SHINGLE_SIZE = 3
+# 64-bit fingerprints split into 4 bands of 16 bits: two fingerprints within
+# 3 bits of each other always share at least one band
+BANDS = 4
+BAND_BITS = 16
+MASK_64 = (1 << 64) - 1
+
+
+def normalized_tokens(email: dict) -> List[str]:
+    """Words of the subject and body, ignoring quoted reply text, links and the digits that vary between notifications."""
+    body = "\n".join(line for line in email.get("body", "").splitlines() if not line.lstrip().startswith(">"))
+    text = f"{REPLY_PREFIX.sub('', email.get('subject', ''))}\n{body}".lower()
+    text = DIGITS_PATTERN.sub("0", URL_PATTERN.sub(" ", text))
+    return WORD_PATTERN.findall(text)
+
+
+def simhash(tokens: List[str]) -> int:
+    """64-bit SimHash over word shingles, as a signed integer so MongoDB stores it as a long."""
+    shingles = [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))]
+    digests = np.array(
+        [int.from_bytes(blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+    bits = np.unpackbits(digests.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    majority = bits.sum(axis=0) * 2 > len(digests)
+    value = int(np.packbits(majority, bitorder="little").view("<u8")[0])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def bands(fingerprint: int) -> List[int]:
+    unsigned = fingerprint & MASK_64
+    return [(band << BAND_BITS) | ((unsigned >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1)) for band in range(BANDS)]
+
+
+def distance(a: int, b: int) -> int:
+    return bin((a ^ b) & MASK_64).count("1")
+
+
+def fingerprint_fields(email: dict) -> dict:
+    """simhash and simhash_bands for an email document; empty if it is too short to fingerprint reliably."""
+    if "simhash" in email:
+        return {"simhash": email["simhash"], "simhash_bands": email.get("simhash_bands", [])}
+    tokens = normalized_tokens(email)
+    if len(tokens) < settings.NEAR_DUPLICATE_MIN_TOKENS:
+        return {}
+    fingerprint = simhash(tokens)
+    return {"simhash": fingerprint, "simhash_bands": bands(fingerprint)}
+
+
+class NearDuplicateIndex:
+    """Finds an already analysed email whose text is nearly the same as a new one.
+
+    Candidates come from the banded simhash index on the emails collection, plus
+    emails being analysed right now in this process, so a flood of identical
+    notifications in one run costs one analysis.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[ObjectId, Tuple[int, asyncio.Future]] = {}
+        self.matches = 0
+
+    async def find_original(self, email_id: ObjectId, fingerprint: Optional[int]) -> Optional[dict]:
+        if not settings.NEAR_DUPLICATE_ENABLED or fingerprint is None:
+            return None
+        max_distance = settings.NEAR_DUPLICATE_MAX_DISTANCE
+
+        candidates = await db.get_db()["emails"].find(
+            {"simhash_bands": {"$in": bands(fingerprint)}, "processed": True, "_id": {"$ne": email_id}},
+            {"simhash": 1, "metadata": 1}
+        ).limit(100).to_list(100)
+        scored = [(distance(fingerprint, c["simhash"]), c) for c in candidates if c.get("simhash") is not None]
+        scored = [(d, c) for d, c in scored if d <= max_distance]
+        if scored:
+            self.matches += 1
+            NEAR_DUPLICATE_MATCHES.labels(source="stored").inc()
+            return min(scored, key=lambda item: item[0])[1]
+
+        for other_id, (other_fingerprint, future) in list(self.in_flight.items()):
+            if distance(fingerprint, other_fingerprint) <= max_distance:
+                metadata = await asyncio.shield(future)
+                if metadata is not None:
+                    self.matches += 1
+                    NEAR_DUPLICATE_MATCHES.labels(source="in_flight").inc()
+                    return {"_id": other_id, "metadata": metadata}
+        return None
+
+    def begin(self, email_id: ObjectId, fingerprint: Optional[int]):
+        if fingerprint is not None and settings.NEAR_DUPLICATE_ENABLED:
+            self.in_flight[email_id] = (fingerprint, asyncio.get_running_loop().create_future())
+
+    def finish(self, email_id: ObjectId, metadata: Optional[dict]):
+        """Hand the analysis to duplicates waiting on it; a result stays findable here until release()."""
+        entry = self.in_flight.get(email_id)
+        if entry and not entry[1].done():
+            entry[1].set_result(metadata)
+        if metadata is None:
+            self.in_flight.pop(email_id, None)
+
+    def release(self, email_id: ObjectId):
+        """The result is stored, so the emails collection answers for it from now on."""
+        self.in_flight.pop(email_id, None)
+
+    @staticmethod
+    def reuse_metadata(original: dict) -> EmailMetadata:
+        metadata = EmailMetadata.model_validate(original.get("metadata") or {})
+        # Point at the root of the cluster so clusters stay one level deep
+        metadata.duplicate_of = metadata.duplicate_of or str(original["_id"])
+        metadata.category_source = "duplicate"
+        return metadata
+
+
+near_duplicates = NearDuplicateIndex()
@@ -0,0 +1,392 @@
+import asyncio
+import logging
+import os
+import re
+import socket
+import uuid
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from bson.binary import Binary
+from bson.errors import InvalidDocument
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from app.config import settings
+from app.utils.db import db
+from app.utils.metrics import PRECLASSIFIER_DECISIONS
+from app.services.search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+MODEL_ID = "preclassifier"
+# Lease in service_state held by the one process that trains and saves the model
+WRITER_ID = "preclassifier_writer"
+# Where categories came from; only LLM labels are used for training
+LOCAL_SOURCES = ("rules", "sender", "model")
+# Results are written behind, so emails updated this recently may not all be visible yet
+TRAINING_LAG = timedelta(seconds=30)
+
+
+def configured_categories() -> List[str]:
+    return [c.strip() for c in settings.PRECLASSIFIER_CATEGORIES.split(",") if c.strip()]
+
+
+def normalize_label(label: Optional[str], categories: List[str]) -> Optional[str]:
+    """The configured category an LLM answer names (ignoring case and stray punctuation), or None."""
+    cleaned = re.sub(r"[^\w -]", "", label or "").strip().lower()
+    for category in categories:
+        if category.lower() == cleaned:
+            return category
+    return None
+
+ADDRESS_PATTERN = re.compile(r"([\w.+-]+)@([\w-]+(?:\.[\w-]+)+)")
+BULK_LOCAL_PARTS = re.compile(r"^(newsletters?|news|digest|weekly|updates|marketing|promo(tions)?|offers|deals)\b", re.IGNORECASE)
+UNSUBSCRIBE_PATTERN = re.compile(
+    r"unsubscribe|list-unsubscribe|manage (your )?(email )?(preferences|subscriptions)|view (this email )?in (your )?browser",
+    re.IGNORECASE
+)
+SPAM_PATTERN = re.compile(
+    r"you('ve| have) (won|been selected)|claim your (prize|reward)|lottery|wire transfer|act now|100% free|verify your account immediately",
+    re.IGNORECASE
+)
+
+
+class Prediction(NamedTuple):
+    category: str
+    confidence: float
+    source: str  # rules, sender or model
+
+
+def sender_address(sender: str) -> Tuple[str, str]:
+    match = ADDRESS_PATTERN.search(sender or "")
+    if not match:
+        return "", ""
+    return match.group(1).lower(), match.group(2).lower()
+
+
+def rule_prediction(email: dict) -> Optional[Prediction]:
+    """Fixed heuristics for bulk mail and spam; a single signal alone is not conclusive."""
+    local, _ = sender_address(email.get("sender", ""))
+    body = email.get("body", "")
+    bulk_sender = bool(BULK_LOCAL_PARTS.match(local))
+    unsubscribe = bool(UNSUBSCRIBE_PATTERN.search(body))
+    if bulk_sender and unsubscribe:
+        return Prediction("Newsletter", 0.97, "rules")
+    if SPAM_PATTERN.search(f"{email.get('subject', '')}\n{body}"):
+        return Prediction("Spam", 0.8, "rules")
+    if bulk_sender or unsubscribe:
+        return Prediction("Newsletter", 0.75, "rules")
+    return None
+
+
+class LinearModel:
+    """Multinomial logistic regression over hashed features, trained online with SGD."""
+
+    def __init__(self, bits: int, classes: List[str]):
+        # A fixed class list keeps the saved model a fixed size
+        self.bits = bits
+        self.classes = list(classes)
+        self.weights = np.zeros((len(self.classes), 1 << bits), dtype=np.float32)
+        self.bias = np.zeros(len(self.classes), dtype=np.float32)
+        self.examples = 0
+
+    def features(self, email: dict) -> np.ndarray:
+        local, domain = sender_address(email.get("sender", ""))
+        body = email.get("body", "")[:5000]
+        tokens = [f"s:{t}" for t in tokenize(email.get("subject", ""))] + [f"b:{t}" for t in tokenize(body)]
+        tokens += [f"d:{domain}", f"l:{local}"]
+        if UNSUBSCRIBE_PATTERN.search(body):
+            tokens.append("unsubscribe")
+        mask = (1 << self.bits) - 1
+        # crc32 rather than hash(), which is salted per process
+        return np.array(sorted({zlib.crc32(t.encode("utf-8")) & mask for t in tokens}), dtype=np.int64)
+
+    def probabilities(self, indices: np.ndarray) -> np.ndarray:
+        # Binary features scaled to unit length
+        value = 1 / np.sqrt(max(len(indices), 1))
+        logits = self.weights[:, indices].sum(axis=1) * value + self.bias
+        logits -= logits.max()
+        exp = np.exp(logits)
+        return exp / exp.sum()
+
+    def predict(self, email: dict) -> Optional[Tuple[str, float]]:
+        if len(self.classes) < 2:
+            return None
+        probabilities = self.probabilities(self.features(email))
+        best = int(probabilities.argmax())
+        return self.classes[best], float(probabilities[best])
+
+    def update(self, email: dict, label: str, learning_rate: float):
+        """label must be one of classes."""
+        indices = self.features(email)
+        gradient = self.probabilities(indices)
+        gradient[self.classes.index(label)] -= 1
+        value = 1 / np.sqrt(max(len(indices), 1))
+        self.weights[:, indices] -= (learning_rate * value * gradient)[:, None].astype(np.float32)
+        self.bias -= (learning_rate * gradient).astype(np.float32)
+        self.examples += 1
+
+    def to_doc(self) -> dict:
+        return {
+            "bits": self.bits,
+            "classes": self.classes,
+            "weights": Binary(self.weights.tobytes()),
+            "bias": Binary(self.bias.tobytes()),
+            "examples": self.examples,
+        }
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "LinearModel":
+        model = cls(doc["bits"], doc["classes"])
+        model.weights = np.frombuffer(doc["weights"], dtype=np.float32).reshape(len(model.classes), 1 << model.bits).copy()
+        model.bias = np.frombuffer(doc["bias"], dtype=np.float32).copy()
+        model.examples = doc["examples"]
+        return model
+
+
+class PreClassifier:
+    """Settles obvious categories locally so only uncertain emails need the LLM.
+
+    Combines fixed bulk/spam rules, per-sender label history and a hashed-feature
+    linear model, all learned from LLM-assigned categories. Emails scoring below
+    PRECLASSIFIER_CONFIDENCE are left to the LLM.
+
+    One process at a time (the holder of a lease in service_state) trains the model,
+    from emails the LLM has categorized since its last pass, and saves it; every other
+    process reloads the saved model when it changes.
+    """
+
+    def __init__(self, owner: str = None):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.categories = configured_categories()
+        self.model = LinearModel(settings.PRECLASSIFIER_FEATURE_BITS, self.categories)
+        self.senders: Dict[str, Dict[str, int]] = {}
+        self.decisions = Counter()
+        self.learned = 0
+        self.unsaved = 0
+        self.loaded = False
+        self.is_writer = False
+        # updated_at of the newest emails learned from, and of the model document loaded
+        self.trained_until: Optional[datetime] = None
+        self.version: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _collection(self):
+        return db.get_db()["classifier_models"]
+
+    def sender_prediction(self, email: dict) -> Optional[Prediction]:
+        local, domain = sender_address(email.get("sender", ""))
+        counts = self.senders.get(f"{local}@{domain}")
+        if not counts:
+            return None
+        category, count = max(counts.items(), key=lambda item: item[1])
+        # Laplace-smoothed share, so a sender needs a track record before it is trusted
+        return Prediction(category, (count + 1) / (sum(counts.values()) + 2), "sender")
+
+    def classify(self, email: dict) -> Optional[Prediction]:
+        """Best local guess with its confidence, or None when there is nothing to go on."""
+        candidates = [p for p in (rule_prediction(email), self.sender_prediction(email)) if p]
+        if self.model.examples >= settings.PRECLASSIFIER_MIN_EXAMPLES:
+            predicted = self.model.predict(email)
+            if predicted:
+                candidates.append(Prediction(predicted[0], predicted[1], "model"))
+        if not candidates:
+            return None
+
+        best = max(candidates, key=lambda p: p.confidence)
+        # Independent signals agreeing make the answer more certain
+        doubt = 1.0
+        for prediction in candidates:
+            if prediction.category == best.category:
+                doubt *= 1 - prediction.confidence
+        return Prediction(best.category, round(1 - doubt, 4), best.source)
+
+    def confident(self, email: dict) -> Optional[Prediction]:
+        if not settings.PRECLASSIFIER_ENABLED:
+            return None
+        prediction = self.classify(email)
+        if prediction and prediction.confidence >= settings.PRECLASSIFIER_CONFIDENCE:
+            return prediction
+        return None
+
+    def decide(self, email: dict) -> Optional[Prediction]:
+        """Like confident(), but counted towards the skip rate."""
+        prediction = self.confident(email)
+        outcome = prediction.source if prediction else "llm"
+        self.decisions[outcome] += 1
+        PRECLASSIFIER_DECISIONS.labels(outcome=outcome).inc()
+        return prediction
+
+    def learn(self, email: dict, category: str) -> bool:
+        """Train on a category assigned by the LLM; answers outside the configured categories are ignored."""
+        category = normalize_label(category, self.categories)
+        if not category:
+            return False
+        self.model.update(email, category, settings.PRECLASSIFIER_LEARNING_RATE)
+
+        local, domain = sender_address(email.get("sender", ""))
+        if domain:
+            key = f"{local}@{domain}"
+            if key in self.senders or len(self.senders) < settings.PRECLASSIFIER_MAX_SENDERS:
+                counts = self.senders.setdefault(key, {})
+                counts[category] = counts.get(category, 0) + 1
+
+        self.learned += 1
+        self.unsaved += 1
+        return True
+
+    async def save(self):
+        if not self.is_writer:
+            return
+        self.unsaved = 0
+        now = datetime.utcnow()
+        try:
+            await self._collection().replace_one(
+                {"_id": MODEL_ID},
+                # Addresses contain dots, so senders are stored as pairs rather than field names
+                {**self.model.to_doc(), "senders": list(self.senders.items()), "trained_until": self.trained_until, "updated_at": now},
+                upsert=True
+            )
+            self.version = now
+        except (PyMongoError, InvalidDocument) as e:
+            # InvalidDocument covers a model too big for one document (too many categories or feature bits)
+            logger.warning(f"Could not save pre-classifier: {e}")
+
+    async def _learn_from(self, query: dict, limit: int) -> int:
+        cursor = db.get_db()["emails"].find(query, {"sender": 1, "subject": 1, "body": 1, "metadata.category": 1})
+        if "updated_at" in query:
+            cursor = cursor.sort("updated_at", ASCENDING)
+        trained = 0
+        async for email in cursor.limit(limit):
+            self.learn(email, email["metadata"]["category"])
+            trained += 1
+            if trained % 500 == 0:
+                await asyncio.sleep(0)
+        return trained
+
+    async def train_from_history(self, limit: int) -> int:
+        """Bootstrap from emails the LLM has already categorized."""
+        self.trained_until = datetime.utcnow()
+        return await self._learn_from(
+            {"processed": True, "metadata.category": {"$ne": None}, "metadata.category_source": {"$nin": list(LOCAL_SOURCES)}},
+            limit
+        )
+
+    async def train_recent(self) -> int:
+        """Learn from emails the LLM has categorized (or recategorized) since the last pass."""
+        until = datetime.utcnow() - TRAINING_LAG
+        updated = {"$lte": until}
+        if self.trained_until:
+            updated["$gt"] = self.trained_until
+        trained = await self._learn_from(
+            {"processed": True, "metadata.category_source": "llm", "updated_at": updated},
+            settings.PRECLASSIFIER_BOOTSTRAP_LIMIT
+        )
+        self.trained_until = until
+        return trained
+
+    def _compatible(self, doc: Optional[dict]) -> bool:
+        return bool(doc) and doc.get("bits") == settings.PRECLASSIFIER_FEATURE_BITS and list(doc.get("classes", [])) == self.categories
+
+    def _apply(self, doc: dict):
+        self.model = LinearModel.from_doc(doc)
+        self.senders = {sender: counts for sender, counts in doc.get("senders", [])}
+        self.trained_until = doc.get("trained_until") or doc.get("updated_at")
+        self.version = doc.get("updated_at")
+
+    async def load(self):
+        """Load the saved model; the writer bootstraps one from history if there is none for these settings."""
+        doc = await self._collection().find_one({"_id": MODEL_ID})
+        if self._compatible(doc):
+            self._apply(doc)
+        elif self.is_writer:
+            trained = await self.train_from_history(settings.PRECLASSIFIER_BOOTSTRAP_LIMIT)
+            logger.info(f"Pre-classifier bootstrapped from {trained} categorized emails")
+            await self.save()
+        self.loaded = True
+
+    async def refresh(self):
+        """Reload the model if the writer has saved a newer one."""
+        doc = await self._collection().find_one({"_id": MODEL_ID}, {"updated_at": 1})
+        if doc and doc.get("updated_at") != self.version:
+            doc = await self._collection().find_one({"_id": MODEL_ID})
+            if self._compatible(doc):
+                self._apply(doc)
+
+    async def _acquire_writer(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            result = await db.get_db()["service_state"].update_one(
+                {"_id": WRITER_ID, "$or": [{"owner": self.owner}, {"owner": None}, {"lease_expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "lease_expires_at": now + timedelta(seconds=settings.PRECLASSIFIER_SYNC_SECONDS * 3)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Someone else holds a live lease
+            return False
+        return result.matched_count > 0 or result.upserted_id is not None
+
+    async def sync(self):
+        """One pass: the writer trains on new LLM labels and saves; everyone else picks up its saves."""
+        was_writer = self.is_writer
+        self.is_writer = await self._acquire_writer()
+        if self.is_writer and not was_writer:
+            # Continue from the last saved model rather than this process's copy
+            self.loaded = False
+        if not self.loaded:
+            await self.load()
+        elif not self.is_writer:
+            await self.refresh()
+        if self.is_writer and await self.train_recent():
+            await self.save()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except PyMongoError as e:
+                logger.warning(f"Pre-classifier sync failed: {e}")
+            await asyncio.sleep(settings.PRECLASSIFIER_SYNC_SECONDS)
+
+    def start(self):
+        if settings.PRECLASSIFIER_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_writer:
+            if self.unsaved:
+                await self.save()
+            try:
+                await db.get_db()["service_state"].update_one({"_id": WRITER_ID, "owner": self.owner}, {"$set": {"owner": None}})
+            except PyMongoError:
+                pass
+            self.is_writer = False
+
+    def stats(self) -> dict:
+        decided = sum(self.decisions.values())
+        skipped = decided - self.decisions["llm"]
+        return {
+            "enabled": settings.PRECLASSIFIER_ENABLED,
+            "loaded": self.loaded,
+            "confidence_threshold": settings.PRECLASSIFIER_CONFIDENCE,
+            "decisions": dict(self.decisions),
+            "skip_rate": round(skipped / decided, 4) if decided else 0.0,
+            "model_examples": self.model.examples,
+            "model_active": self.model.examples >= settings.PRECLASSIFIER_MIN_EXAMPLES,
+            "classes": self.model.classes,
+            "senders": len(self.senders),
+            "writer": self.is_writer,
+            "learned_this_process": self.learned,
+        }
+
+
+preclassifier = PreClassifier()
@@ -1,56 +1,350 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from pydantic import BaseModel
+from pymongo import UpdateOne
+from app.config import settings
 from app.utils.db import db
-from app.services.llm_service import llm_service
-from app.models.email import Email
+from app.services.llm_service import llm_service, parse_action_items
+from app.services.prompt_registry import prompt_registry
+from app.services.search_index import search_index
+from app.services.preclassifier import preclassifier
+from app.services.near_duplicates import fingerprint_fields, near_duplicates
+from app.services.result_sink import result_sink
+from app.services.inbox_stats import inbox_stats
+from app.utils.metrics import EMAILS_PROCESSED, PROCESSING_QUEUE_DEPTH, PROCESSING_STAGE_SECONDS, timed
+from app.models.email import Email, EmailMetadata
 from app.models.prompt import Prompt
 
-async def process_email(email_data: dict):
-    # Fetch Prompts
-    prompts_collection = db.get_db()["prompts"]
-    cat_prompt_doc = await prompts_collection.find_one({"type": "categorization", "is_active": True})
-    ext_prompt_doc = await prompts_collection.find_one({"type": "extraction", "is_active": True})
-    
-    # Default Prompts if not found
-    cat_prompt_text = cat_prompt_doc["template"] if cat_prompt_doc else "Categorize this email into: Important, Newsletter, Spam, To-Do. Return only the category name."
-    ext_prompt_text = ext_prompt_doc["template"] if ext_prompt_doc else "Extract tasks from the email. Respond in JSON: { \"tasks\": [ { \"task\": \"...\", \"deadline\": \"...\" } ] }."
-
-    # 1. Categorization
-    category = await llm_service.categorize_email(
-        content=f"Subject: {email_data['subject']}\nBody: {email_data['body']}",
-        prompt_template=cat_prompt_text
-    )
-    
-    # 2. Action Extraction
-    actions_json = await llm_service.extract_action_items(
-        content=email_data['body'],
-        prompt_template=ext_prompt_text
-    )
-    
-    # Update Email in DB
-    emails_collection = db.get_db()["emails"]
-    
+logger = logging.getLogger(__name__)
+
+class ProcessingProgress(BaseModel):
+    total: int = 0
+    processed: int = 0
+    failed: int = 0
+    in_flight: int = 0
+    queue_depth: int = 0
+    queue_size: int = 0
+    concurrency: int = 0
+    # Times the producer had to wait because workers were saturated
+    backpressure_waits: int = 0
+    llm_waiting: int = 0
+    running: bool = False
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def snapshot(self) -> dict:
+        data = self.model_dump()
+        data["elapsed_seconds"] = round(self.elapsed, 2)
+        data["emails_per_second"] = round(self.processed / self.elapsed, 2) if self.elapsed else 0.0
+        return data
+
+# Progress of the most recent run in this process
+current_progress = ProcessingProgress()
+
+DEFAULT_CATEGORIZATION_PROMPT = "Categorize this email into: Important, Newsletter, Spam, To-Do. Return only the category name."
+DEFAULT_EXTRACTION_PROMPT = "Extract tasks from the email. Respond in JSON: { \"tasks\": [ { \"task\": \"...\", \"deadline\": \"...\" } ] }."
+DEFAULT_SUMMARIZATION_PROMPT = "Summarize the following email in 2-3 concise sentences. Focus on the main action items and key information."
+# Prompt type of each analysis stage, with its built-in prompt
+STAGE_DEFAULT_PROMPTS = {
+    "categorization": DEFAULT_CATEGORIZATION_PROMPT,
+    "extraction": DEFAULT_EXTRACTION_PROMPT,
+    "summarization": DEFAULT_SUMMARIZATION_PROMPT,
+}
+
+# Lease fields set on emails a run has claimed; cleared when the result is written
+CLAIM_FIELDS = {"processing_owner": "", "processing_until": ""}
+
+def skip_analysis_categories() -> set:
+    return {c.strip().lower() for c in settings.SKIP_ANALYSIS_CATEGORIES.split(",") if c.strip()}
+
+def email_content(email_data: dict) -> str:
+    return f"Subject: {email_data['subject']}\nBody: {email_data['body']}"
+
+async def analyze(email_data: dict, category: Optional[str] = None) -> EmailMetadata:
+    """Categorize, extract and summarize one email, locally where possible and otherwise with the LLM."""
+    # Active prompts, with defaults if not found
+    with timed(PROCESSING_STAGE_SECONDS, stage="prompts"):
+        cat_prompt_text, cat_version = await prompt_registry.get_versioned("categorization", DEFAULT_CATEGORIZATION_PROMPT)
+        ext_prompt_text, ext_version = await prompt_registry.get_versioned("extraction", DEFAULT_EXTRACTION_PROMPT)
+        sum_prompt_text, sum_version = await prompt_registry.get_versioned("summarization", DEFAULT_SUMMARIZATION_PROMPT)
+
+    content = email_content(email_data)
+
+    # Obvious categories are settled locally; a batch-assigned category came from the LLM
+    prediction = None
+    if category is None:
+        with timed(PROCESSING_STAGE_SECONDS, stage="preclassify"):
+            prediction = preclassifier.decide(email_data)
+        if prediction:
+            category = prediction.category
+
+    skipped = bool(category) and category.lower() in skip_analysis_categories()
+    with timed(PROCESSING_STAGE_SECONDS, stage="analysis"):
+        if skipped:
+            # Bulk mail already categorized (in a batch or locally) has nothing worth a per-email call
+            metadata = EmailMetadata(category=category)
+        elif settings.LLM_COMBINED_ANALYSIS:
+            # One structured request for category, action items and summary
+            metadata = await llm_service.analyze_email(
+                content=content,
+                categorization_prompt=cat_prompt_text,
+                extraction_prompt=ext_prompt_text,
+                summarization_prompt=sum_prompt_text,
+                category=category
+            )
+        else:
+            # The stages are independent, so run them together
+            async def categorize():
+                if category:
+                    return category
+                return await llm_service.categorize_email(content=content, prompt_template=cat_prompt_text)
+
+            category, actions_json, summary = await asyncio.gather(
+                categorize(),
+                llm_service.extract_action_items(content=email_data['body'], prompt_template=ext_prompt_text),
+                llm_service.summarize_email(content=content, prompt_template=sum_prompt_text),
+            )
+            metadata = EmailMetadata(
+                category=category.strip(),
+                action_items=parse_action_items(actions_json),
+                summary=summary.strip()
+            )
+
+    if prediction:
+        metadata.category_source = prediction.source
+        metadata.category_confidence = prediction.confidence
+    elif metadata.category:
+        # The pre-classifier's training process learns from this once it is written
+        metadata.category_source = "llm"
+        metadata.prompt_versions["categorization"] = cat_version
+    if not skipped:
+        metadata.prompt_versions.update(extraction=ext_version, summarization=sum_version)
+
+    return metadata
+
+async def process_email(email_data: dict, category: Optional[str] = None, on_written: Optional[Callable[[bool], None]] = None):
+    """Analyse one email and queue its result; on_written is told whether the result reached the database."""
+    fingerprint = fingerprint_fields(email_data)
+
+    # A nearly identical email that has already been analysed answers for this one
+    with timed(PROCESSING_STAGE_SECONDS, stage="dedupe"):
+        original = await near_duplicates.find_original(email_data["_id"], fingerprint.get("simhash"))
+
+    if original:
+        metadata = near_duplicates.reuse_metadata(original)
+    else:
+        near_duplicates.begin(email_data["_id"], fingerprint.get("simhash"))
+        metadata = None
+        try:
+            metadata = await analyze(email_data, category)
+        finally:
+            near_duplicates.finish(email_data["_id"], metadata.model_dump() if metadata else None)
+
     update_data = {
         "processed": True,
-        "metadata": {
-            "category": category.strip(),
-            "action_items": actions_json.get("tasks", []),
-            "summary": "Processed by AI"
-        }
+        "metadata": metadata.model_dump()
     }
-    
-    await emails_collection.update_one(
-        {"_id": email_data["_id"]},
-        {"$set": update_data}
+
+    # Written behind in bulk; near-duplicates keep finding this result in memory until then
+    email_id = email_data["_id"]
+    # updated_at is how search index polling in other processes sees the new category
+    fields = {**update_data, "updated_at": datetime.utcnow()}
+    if "simhash" not in email_data:
+        # Emails ingested before fingerprinting get theirs now
+        fields.update(fingerprint)
+    result_sink.add(
+        UpdateOne({"_id": email_id}, {"$set": fields, "$unset": CLAIM_FIELDS}),
+        on_flushed=lambda written: written_back(email_id, written, on_written)
     )
-    
+    search_index.set_category(email_data["_id"], metadata.category)
+    inbox_stats.add_processed(update_data["metadata"], email_data.get("is_read", False))
+
     return update_data
 
-async def process_unprocessed_emails():
+class ResultDropped(Exception):
+    """The email was analysed but the result sink gave up writing the result."""
+
+def written_back(email_id, written: bool, on_written: Optional[Callable[[bool], None]] = None):
+    near_duplicates.release(email_id)
+    if on_written:
+        on_written(written)
+
+async def _worker(queue: asyncio.Queue, progress: ProcessingProgress, on_done: Optional[Callable[[dict, Optional[Exception]], None]] = None):
+    while True:
+        item = await queue.get()
+        if item is None:
+            queue.task_done()
+            return
+
+        email, category = item
+        progress.in_flight += 1
+
+        # A result counts as done once it is written, not when it is handed to the sink
+        def on_written(written: bool, email: dict = email):
+            if not written:
+                progress.failed += 1
+            if on_done:
+                on_done(email, None if written else ResultDropped(f"Result for email {email['_id']} was not written"))
+
+        try:
+            with timed(PROCESSING_STAGE_SECONDS, stage="total"):
+                await process_email(email, category=category, on_written=on_written)
+            progress.processed += 1
+            EMAILS_PROCESSED.labels(outcome="success").inc()
+        except Exception as e:
+            progress.failed += 1
+            EMAILS_PROCESSED.labels(outcome="failed").inc()
+            logger.warning(f"Failed to process email {email.get('_id')}: {e}")
+            if on_done:
+                on_done(email, e)
+        finally:
+            progress.in_flight -= 1
+            progress.queue_depth = queue.qsize()
+            PROCESSING_QUEUE_DEPTH.set(progress.queue_depth)
+            progress.llm_waiting = sum(l.waiting for l in llm_service.rate_limiters.values())
+            queue.task_done()
+
+def claimable_filter(now: datetime, owner: Optional[str] = None) -> dict:
+    """Unprocessed emails nobody else holds a live claim on."""
+    holders = [{"processing_until": None}, {"processing_until": {"$lt": now}}]
+    if owner:
+        holders.append({"processing_owner": owner})
+    return {"processed": False, "$or": holders}
+
+async def claim_emails(emails: List[dict], owner: str) -> List[dict]:
+    """Claim unprocessed emails for owner; returns those it got.
+
+    A claim is a lease of PROCESSING_CLAIM_SECONDS, so emails held by a process
+    that died are picked up again once it runs out. Owners may re-claim their own.
+    """
+    if not emails:
+        return []
+    now = datetime.utcnow()
+    ids = [email["_id"] for email in emails]
+    emails_collection = db.get_db()["emails"]
+    await emails_collection.update_many(
+        {"_id": {"$in": ids}, **claimable_filter(now, owner)},
+        {"$set": {"processing_owner": owner, "processing_until": now + timedelta(seconds=settings.PROCESSING_CLAIM_SECONDS)}}
+    )
+    claimed = set(await emails_collection.distinct("_id", {"_id": {"$in": ids}, "processed": False, "processing_owner": owner}))
+    return [email for email in emails if email["_id"] in claimed]
+
+def release_claim(email_id, owner: str):
+    """Give up a claim after a failure, so another run can retry the email straight away."""
+    result_sink.add(UpdateOne({"_id": email_id, "processing_owner": owner}, {"$unset": CLAIM_FIELDS}))
+
+async def categorize_batch(emails: List[dict]) -> Dict[str, str]:
+    """Batch-categorize the short emails in a group; long ones are left to per-email analysis.
+
+    Emails the pre-classifier is sure about are left out; process_email settles them locally.
+    """
+    short_emails = {
+        str(email["_id"]): email_content(email)
+        for email in emails
+        if len(email["body"]) <= settings.LLM_BATCH_MAX_EMAIL_CHARS and not preclassifier.confident(email)
+    }
+    if len(short_emails) < 2:
+        return {}
+
+    cat_prompt_text = await prompt_registry.get_template("categorization", DEFAULT_CATEGORIZATION_PROMPT)
+
+    try:
+        return await llm_service.categorize_batch(short_emails, cat_prompt_text)
+    except Exception as e:
+        logger.warning(f"Batch categorization failed, falling back to per-email analysis: {e}")
+        return {}
+
+async def process_unprocessed_emails(concurrency: Optional[int] = None, batch_categorization: Optional[bool] = None, progress: Optional[ProcessingProgress] = None) -> ProcessingProgress:
+    """Process every unprocessed email; pass progress to observe the run while it is going."""
+    global current_progress
+
+    concurrency = concurrency or settings.PROCESSING_CONCURRENCY
+    queue_size = max(settings.PROCESSING_QUEUE_SIZE, concurrency)
+    if batch_categorization is None:
+        batch_categorization = settings.LLM_BATCH_CATEGORIZATION
+
     emails_collection = db.get_db()["emails"]
-    cursor = emails_collection.find({"processed": False})
-    
-    processed_count = 0
-    async for email in cursor:
-        await process_email(email)
-        processed_count += 1
-        
-    return processed_count
+    # Concurrent runs (other workers, the change feed) skip the emails this one has claimed
+    owner = uuid.uuid4().hex
+    progress = progress or ProcessingProgress()
+    progress.total = await emails_collection.count_documents({"processed": False})
+    progress.concurrency = concurrency
+    progress.queue_size = queue_size
+    progress.running = True
+    progress.started_at = time.time()
+    current_progress = progress
+
+    # A bounded queue keeps the cursor from racing ahead of the workers
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def on_done(email: dict, error: Optional[Exception]):
+        if error is not None:
+            release_claim(email["_id"], owner)
+
+    workers = [asyncio.create_task(_worker(queue, progress, on_done=on_done)) for _ in range(concurrency)]
+
+    async def enqueue(email: dict, category: Optional[str] = None):
+        if queue.full():
+            progress.backpressure_waits += 1
+        await queue.put((email, category))
+        progress.queue_depth = queue.qsize()
+        PROCESSING_QUEUE_DEPTH.set(progress.queue_depth)
+
+    # Batch categorization requests run alongside the workers, a few at a time
+    batch_slots = asyncio.Semaphore(max(1, concurrency // 2))
+    batch_tasks = []
+
+    async def categorize_and_enqueue(batch: List[dict]):
+        try:
+            categories = await categorize_batch(batch)
+            for email in batch:
+                await enqueue(email, categories.get(str(email["_id"])))
+        finally:
+            batch_slots.release()
+
+    async def claim_and_enqueue(batch: List[dict]):
+        nonlocal batch_tasks
+        batch = await claim_emails(batch, owner)
+        if not batch:
+            return
+        if batch_categorization:
+            await batch_slots.acquire()
+            batch_tasks = [task for task in batch_tasks if not task.done()]
+            batch_tasks.append(asyncio.create_task(categorize_and_enqueue(batch)))
+        else:
+            for email in batch:
+                await enqueue(email)
+
+    try:
+        # Claimed a batch at a time, just before the emails are queued
+        batch = []
+        async for email in emails_collection.find(claimable_filter(datetime.utcnow())):
+            batch.append(email)
+            if len(batch) >= settings.PROCESSING_BATCH_SIZE:
+                await claim_and_enqueue(batch)
+                batch = []
+        await claim_and_enqueue(batch)
+        await asyncio.gather(*batch_tasks)
+
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        await result_sink.flush()
+    finally:
+        for task in batch_tasks + workers:
+            task.cancel()
+        progress.running = False
+        progress.queue_depth = 0
+        progress.finished_at = time.time()
+
+    return progress
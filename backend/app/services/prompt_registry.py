@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from pymongo.errors import PyMongoError
+from app.config import settings
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+# Recorded for results produced by a built-in prompt rather than a stored one
+DEFAULT_VERSION = "default"
+
+
+def prompt_version(prompt: Optional[dict]) -> str:
+    """Identifies the exact prompt text behind a result: the prompt's id plus its edit count."""
+    if not prompt:
+        return DEFAULT_VERSION
+    return f"{prompt['_id']}:{prompt.get('version', 1)}"
+
+
+class PromptRegistry:
+    """In-memory view of the active prompts, shared by processing and the agent routes.
+
+    Loaded once and reused until a prompt route invalidates it, a change stream event
+    arrives, or PROMPT_CACHE_TTL_SECONDS passes (covers other processes when change
+    streams are unavailable).
+    """
+
+    def __init__(self):
+        self.prompts: Optional[Dict[str, dict]] = None
+        self.loaded_at = 0.0
+        self.generation = 0
+        self.loads = 0
+        self._lock = asyncio.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def invalidate(self):
+        self.generation += 1
+        self.prompts = None
+
+    def _is_fresh(self) -> bool:
+        return self.prompts is not None and time.monotonic() - self.loaded_at < settings.PROMPT_CACHE_TTL_SECONDS
+
+    async def _load(self) -> Dict[str, dict]:
+        async with self._lock:
+            if self._is_fresh():
+                return self.prompts
+
+            generation = self.generation
+            prompts = {}
+            cursor = db.get_db()["prompts"].find({"is_active": True})
+            async for doc in cursor:
+                # Keep the first active prompt per type, like find_one did
+                prompts.setdefault(doc["type"], doc)
+
+            # Don't publish a snapshot that was invalidated while it was loading
+            if generation == self.generation:
+                self.prompts = prompts
+                self.loaded_at = time.monotonic()
+            self.loads += 1
+            return prompts
+
+    async def get(self, prompt_type: str) -> Optional[dict]:
+        prompts = self.prompts if self._is_fresh() else await self._load()
+        return prompts.get(prompt_type)
+
+    async def get_template(self, prompt_type: str, default: str) -> str:
+        prompt = await self.get(prompt_type)
+        return prompt["template"] if prompt else default
+
+    async def get_versioned(self, prompt_type: str, default: str) -> Tuple[str, str]:
+        """The active template and the version to record on results it produces."""
+        prompt = await self.get(prompt_type)
+        return (prompt["template"] if prompt else default), prompt_version(prompt)
+
+    async def watch(self):
+        """Invalidate on any change to the prompts collection (requires a replica set)."""
+        try:
+            async with db.get_db()["prompts"].watch() as stream:
+                logger.info("Watching prompts collection for changes")
+                async for _ in stream:
+                    self.invalidate()
+        except PyMongoError as e:
+            logger.warning(f"Prompt change stream unavailable, relying on route invalidation and TTL: {e}")
+
+    def start(self):
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self.watch())
+
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+
+prompt_registry = PromptRegistry()
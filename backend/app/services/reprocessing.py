@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from pymongo import UpdateMany, UpdateOne
+from app.config import settings
+from app.utils.db import db
+from app.services import job_queue
+from app.services.llm_service import llm_service, parse_action_items
+from app.services.prompt_registry import prompt_registry
+from app.services.search_index import search_index
+from app.services.result_sink import result_sink
+from app.services.inbox_stats import inbox_stats
+from app.services.processing import STAGE_DEFAULT_PROMPTS, ProcessingProgress, email_content, skip_analysis_categories
+
+logger = logging.getLogger(__name__)
+
+REPROCESS_PROJECTION = {"sender": 1, "subject": 1, "body": 1, "is_read": 1, "metadata": 1}
+
+
+def stale_filter(stage: str, version: str) -> dict:
+    """Processed emails whose result for a stage came from another version of its prompt.
+
+    Near-duplicates are left out; they are updated along with the email they copied.
+    Emails the stage never ran on (settled locally, skipped bulk mail) have no
+    version recorded and are not touched.
+    """
+    return {
+        "processed": True,
+        "metadata.duplicate_of": None,
+        f"metadata.prompt_versions.{stage}": {"$exists": True, "$ne": version},
+    }
+
+
+async def run_stage(stage: str, email: dict, template: str) -> dict:
+    """Fresh metadata fields from the extraction or summarization stage."""
+    if stage == "extraction":
+        actions_json = await llm_service.extract_action_items(content=email["body"], prompt_template=template)
+        return {"action_items": [item.model_dump() for item in parse_action_items(actions_json)]}
+    summary = await llm_service.summarize_email(content=email_content(email), prompt_template=template)
+    return {"summary": summary.strip()}
+
+
+async def reprocess_email(stage: str, email: dict, template: str, version: str, category: Optional[str] = None):
+    metadata = email.get("metadata") or {}
+    fields: dict = {}
+    versions = {stage: version}
+    unset: List[str] = []
+
+    if stage == "categorization":
+        if not category:
+            category = await llm_service.categorize_email(content=email_content(email), prompt_template=template)
+        category = category.strip()
+        fields.update(category=category, category_source="llm", category_confidence=None)
+
+        skip = skip_analysis_categories()
+        was_skipped = (metadata.get("category") or "").lower() in skip
+        now_skipped = category.lower() in skip
+        if was_skipped and not now_skipped:
+            # The old category skipped the other stages, the new one needs them
+            others = ("extraction", "summarization")
+            prompts = [await prompt_registry.get_versioned(other, STAGE_DEFAULT_PROMPTS[other]) for other in others]
+            results = await asyncio.gather(*(run_stage(other, email, text) for other, (text, _) in zip(others, prompts)))
+            for other, (_, other_version), result in zip(others, prompts, results):
+                fields.update(result)
+                versions[other] = other_version
+        elif now_skipped and not was_skipped:
+            fields.update(action_items=[], summary=None)
+            unset = ["extraction", "summarization"]
+    else:
+        fields.update(await run_stage(stage, email, template))
+
+    update = {"$set": {
+        **{f"metadata.{key}": value for key, value in fields.items()},
+        **{f"metadata.prompt_versions.{key}": value for key, value in versions.items()},
+        "updated_at": datetime.utcnow(),
+    }}
+    if unset:
+        update["$unset"] = {f"metadata.prompt_versions.{key}": "" for key in unset}
+
+    # Only replace the result this run read, not one written meanwhile by a newer prompt
+    result_sink.add(UpdateOne({"_id": email["_id"], f"metadata.prompt_versions.{stage}": metadata["prompt_versions"][stage]}, update))
+    result_sink.add(UpdateMany({"metadata.duplicate_of": str(email["_id"])}, update))
+
+    updated = {**metadata, **fields}
+    duplicates = await db.get_db()["emails"].find({"metadata.duplicate_of": str(email["_id"])}, {"is_read": 1}).to_list(None)
+    for doc in [email] + duplicates:
+        inbox_stats.add_reanalyzed(metadata, updated, doc.get("is_read", False))
+        if stage == "categorization" and category != metadata.get("category"):
+            search_index.set_category(doc["_id"], category)
+
+
+async def reprocess_batch(stage: str, batch: List[dict], template: str, version: str, progress: ProcessingProgress):
+    categories: Dict[str, str] = {}
+    if stage == "categorization":
+        try:
+            categories = await llm_service.categorize_batch({str(email["_id"]): email_content(email) for email in batch}, template)
+        except Exception as e:
+            logger.warning(f"Batch recategorization failed, falling back to per-email requests: {e}")
+
+    async def reprocess_one(email: dict):
+        progress.in_flight += 1
+        try:
+            await reprocess_email(stage, email, template, version, categories.get(str(email["_id"])))
+            progress.processed += 1
+        except Exception as e:
+            progress.failed += 1
+            logger.warning(f"Failed to reprocess {stage} for email {email['_id']}: {e}")
+        finally:
+            progress.in_flight -= 1
+
+    await asyncio.gather(*(reprocess_one(email) for email in batch))
+
+
+async def reprocess_stage(stage: str, progress: Optional[ProcessingProgress] = None) -> ProcessingProgress:
+    """Re-run one analysis stage for the emails whose result came from an older prompt."""
+    if stage not in STAGE_DEFAULT_PROMPTS:
+        raise ValueError(f"Unknown stage: {stage}")
+    # Read the prompts from the database, not a cached copy that may predate the edit that queued this job
+    prompt_registry.invalidate()
+    template, version = await prompt_registry.get_versioned(stage, STAGE_DEFAULT_PROMPTS[stage])
+
+    emails_collection = db.get_db()["emails"]
+    query = stale_filter(stage, version)
+    progress = progress or ProcessingProgress()
+    progress.total = await emails_collection.count_documents(query)
+    progress.concurrency = settings.PROCESSING_CONCURRENCY
+    progress.running = True
+    progress.started_at = time.time()
+
+    # Batches run a few at a time, each with its emails in parallel
+    batch_slots = asyncio.Semaphore(max(1, settings.PROCESSING_CONCURRENCY // 2))
+    tasks: List[asyncio.Task] = []
+
+    async def run_batch(batch: List[dict]):
+        try:
+            await reprocess_batch(stage, batch, template, version, progress)
+        finally:
+            batch_slots.release()
+
+    try:
+        batch = []
+        async for email in emails_collection.find(query, REPROCESS_PROJECTION):
+            batch.append(email)
+            if len(batch) >= settings.PROCESSING_BATCH_SIZE:
+                await batch_slots.acquire()
+                tasks = [task for task in tasks if not task.done()]
+                tasks.append(asyncio.create_task(run_batch(batch)))
+                batch = []
+        if batch:
+            await batch_slots.acquire()
+            tasks.append(asyncio.create_task(run_batch(batch)))
+        await asyncio.gather(*tasks)
+        await result_sink.flush()
+    finally:
+        for task in tasks:
+            task.cancel()
+        progress.running = False
+        progress.finished_at = time.time()
+
+    return progress
+
+
+async def queue_reprocess(prompt_type: str) -> Optional[str]:
+    """Queue a reprocess job when a processing stage's prompt may have changed."""
+    if prompt_type not in STAGE_DEFAULT_PROMPTS or not settings.REPROCESS_ON_PROMPT_CHANGE:
+        return None
+    return await job_queue.enqueue("reprocess", {"stage": prompt_type})
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional, Set, Tuple
+from pymongo.errors import PyMongoError
+from app.config import settings
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+
+class ResultSink:
+    """Write-behind buffer for analysis results on the emails collection.
+
+    Workers add update operations and move on; the buffer is written with one
+    unordered bulk_write once it holds RESULT_SINK_BATCH_SIZE operations or has
+    waited RESULT_SINK_FLUSH_SECONDS. Results that never reach the database leave
+    their emails unprocessed, so a later run picks them up again. An operation's
+    on_flushed callback is told whether it was written (True) or dropped (False).
+    """
+
+    def __init__(self):
+        # (operation, callback run once it is written or dropped)
+        self.pending: List[Tuple[object, Optional[Callable[[bool], None]]]] = []
+        self.flushes = 0
+        self.written = 0
+        self.dropped = 0
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    def add(self, operation, on_flushed: Optional[Callable[[bool], None]] = None):
+        self.pending.append((operation, on_flushed))
+        if len(self.pending) >= settings.RESULT_SINK_BATCH_SIZE:
+            task = asyncio.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        elif self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.RESULT_SINK_FLUSH_SECONDS)
+        await self.flush()
+
+    async def flush(self):
+        # One flush at a time, so updates to the same email land in order
+        async with self._lock:
+            while self.pending:
+                batch = self.pending[:settings.RESULT_SINK_BATCH_SIZE]
+                del self.pending[:len(batch)]
+                await self._write(batch)
+
+    async def _write(self, batch: List[Tuple[object, Optional[Callable[[bool], None]]]]):
+        operations = [operation for operation, _ in batch]
+        written = False
+        for attempt in range(settings.RESULT_SINK_MAX_RETRIES + 1):
+            try:
+                # Operations only set fields, so a partly applied batch can be rewritten whole
+                await db.get_db()["emails"].bulk_write(operations, ordered=False)
+                self.written += len(operations)
+                written = True
+                break
+            except PyMongoError as e:
+                if attempt == settings.RESULT_SINK_MAX_RETRIES:
+                    logger.error(f"Dropping {len(operations)} buffered results after {attempt + 1} attempts: {e}")
+                    self.dropped += len(operations)
+                    break
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        self.flushes += 1
+        for _, on_flushed in batch:
+            if on_flushed:
+                try:
+                    on_flushed(written)
+                except Exception:
+                    logger.exception("Result sink callback failed")
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {"pending": len(self.pending), "flushes": self.flushes, "written": self.written, "dropped": self.dropped}
+
+
+result_sink = ResultSink()
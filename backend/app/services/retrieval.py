@@ -0,0 +1,159 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from bson import ObjectId
+from pydantic import BaseModel
+from app.config import settings
+from app.utils.db import db
+from app.services.llm_service import estimate_tokens
+from app.services.search_index import search_index
+
+RETRIEVAL_PROJECTION = {
+    "sender": 1,
+    "subject": 1,
+    "timestamp": 1,
+    "metadata": 1,
+    "excerpt": {"$substrCP": ["$body", 0, 2000]},
+}
+# Don't squeeze an email into less room than this; stop packing instead
+MIN_BLOCK_TOKENS = 60
+
+# (fingerprint, formatted block)
+Block = Tuple[str, str]
+
+
+class RetrievedContext(BaseModel):
+    text: str = ""
+    sources: List[str] = []
+    tokens: int = 0
+    reused: int = 0
+    duplicates: int = 0
+    truncated: int = 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text[:max(0, (max_tokens - 1) * 4 - 3)]
+    # Don't end mid-word
+    return cut.rsplit(" ", 1)[0] + "..."
+
+
+def fingerprint(doc: dict) -> str:
+    """Same sender, subject and gist means the same information (forwards, repeated newsletters)."""
+    metadata = doc.get("metadata") or {}
+    gist = metadata.get("summary") or doc.get("excerpt", "")[:500]
+    normalized = " ".join(f"{doc.get('sender', '')} {doc.get('subject', '')} {gist}".lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def format_email_block(doc: dict) -> str:
+    metadata = doc.get("metadata") or {}
+    timestamp = doc.get("timestamp")
+    lines = [
+        f"From: {doc.get('sender', 'Unknown')} | Subject: {doc.get('subject', 'No Subject')}"
+        + (f" | Date: {timestamp:%Y-%m-%d}" if timestamp else "")
+    ]
+    if metadata.get("summary"):
+        lines.append(f"Summary: {metadata['summary']}")
+    else:
+        lines.append(f"Excerpt: {doc.get('excerpt', '')}")
+    for item in metadata.get("action_items") or []:
+        deadline = f" (due {item['deadline']})" if item.get("deadline") else ""
+        lines.append(f"- Action: {item.get('task', '')}{deadline}")
+    return truncate_to_tokens("\n".join(lines), settings.RETRIEVAL_MAX_EMAIL_TOKENS)
+
+
+class ContextCache:
+    """Formatted emails already retrieved for each conversation, so follow-up turns reuse them."""
+
+    def __init__(self, max_conversations: int, ttl: int):
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[Dict[str, Block], float]]" = OrderedDict()
+
+    def get(self, conversation_id: str) -> Dict[str, Block]:
+        entry = self.entries.get(conversation_id)
+        if entry is None:
+            return {}
+        blocks, expires_at = entry
+        if expires_at < time.monotonic():
+            del self.entries[conversation_id]
+            return {}
+        self.entries.move_to_end(conversation_id)
+        return blocks
+
+    def put(self, conversation_id: str, blocks: Dict[str, Block]):
+        self.entries[conversation_id] = (blocks, time.monotonic() + self.ttl)
+        self.entries.move_to_end(conversation_id)
+        while len(self.entries) > self.max_conversations:
+            self.entries.popitem(last=False)
+
+    def discard(self, conversation_id: str):
+        self.entries.pop(conversation_id, None)
+
+
+context_cache = ContextCache(settings.RETRIEVAL_CACHE_MAX_CONVERSATIONS, settings.RETRIEVAL_CACHE_TTL_SECONDS)
+
+
+async def search_emails(question: str) -> List[str]:
+    if not search_index.ready:
+        return []
+    mode = "hybrid" if search_index.semantic_enabled else "keyword"
+    hits, _ = await search_index.search(question, limit=settings.RETRIEVAL_CANDIDATES, mode=mode)
+    return [str(email_id) for email_id, _ in hits]
+
+
+async def retrieve_context(
+    question: str,
+    conversation_id: Optional[str] = None,
+    exclude_ids: Iterable[str] = (),
+    token_budget: Optional[int] = None
+) -> RetrievedContext:
+    """Pick the mailbox emails most relevant to a question and pack them into a token budget."""
+    budget = token_budget or settings.RETRIEVAL_TOKEN_BUDGET
+    cached = context_cache.get(conversation_id) if conversation_id else {}
+    hit_ids = await search_emails(question)
+
+    blocks = dict(cached)
+    missing = [ObjectId(email_id) for email_id in hit_ids if email_id not in blocks]
+    if missing:
+        docs = await db.get_db()["emails"].find({"_id": {"$in": missing}}, RETRIEVAL_PROJECTION).to_list(len(missing))
+        for doc in docs:
+            blocks[str(doc["_id"])] = (fingerprint(doc), format_email_block(doc))
+
+    # This turn's hits in rank order, then what earlier turns of the conversation used
+    ordered = hit_ids + [email_id for email_id in cached if email_id not in hit_ids]
+    excluded = set(exclude_ids)
+    context = RetrievedContext()
+    seen = set()
+    parts = []
+    for email_id in ordered:
+        if email_id in excluded or email_id not in blocks:
+            continue
+        key, block = blocks[email_id]
+        if key in seen:
+            context.duplicates += 1
+            continue
+
+        block = f"[{len(parts) + 1}] {block}"
+        tokens = estimate_tokens(block)
+        remaining = budget - context.tokens
+        if tokens > remaining:
+            if remaining < MIN_BLOCK_TOKENS:
+                break
+            block = truncate_to_tokens(block, remaining)
+            tokens = estimate_tokens(block)
+            context.truncated += 1
+
+        seen.add(key)
+        parts.append(block)
+        context.sources.append(email_id)
+        context.tokens += tokens
+        context.reused += email_id in cached
+
+    context.text = "\n\n".join(parts)
+    if conversation_id:
+        context_cache.put(conversation_id, {email_id: blocks[email_id] for email_id in context.sources})
+    return context
@@ -0,0 +1,575 @@
+import asyncio
+import logging
+import math
+import os
+import pickle
+import re
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from app.config import settings
+from app.utils.db import db
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have i in is it of on or re fw fwd that the this to was we will with you your".split()
+)
+MAX_TOKEN_LENGTH = 40
+# Subject terms count this many times towards term frequency
+SUBJECT_WEIGHT = 2
+# Ids from other processes can land slightly out of order, so catch-up rescans a little behind the watermark
+CATCH_UP_OVERLAP = timedelta(minutes=1)
+INDEX_PROJECTION = {"sender": 1, "subject": 1, "body": 1, "metadata.category": 1}
+SNAPSHOT_VERSION = 1
+# Reciprocal rank fusion constant for hybrid search
+RRF_K = 60
+SEARCH_MODES = ("keyword", "semantic", "hybrid")
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS and len(token) <= MAX_TOKEN_LENGTH
+    ]
+
+
+def document_terms(doc: dict) -> Counter:
+    terms = Counter(tokenize(doc.get("sender", "")))
+    for token in tokenize(doc.get("subject", "")):
+        terms[token] += SUBJECT_WEIGHT
+    terms.update(tokenize(doc.get("body", "")))
+    return terms
+
+
+def embedding_text(doc: dict) -> str:
+    return f"{doc.get('subject', '')}\n{doc.get('body', '')[:2000]}"
+
+
+class TextIndex:
+    """BM25 inverted index over sender, subject and body.
+
+    Each email gets a dense integer position; postings are append-only arrays of
+    positions and term frequencies, scored with numpy at query time.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.ids: List[ObjectId] = []
+        self.positions: Dict[ObjectId, int] = {}
+        self.lengths = array("f")
+        self.categories = array("i")
+        self.live = array("b")
+        # Category name -> code; 0 means not categorized yet
+        self.category_codes: Dict[str, int] = {}
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.total_length = 0.0
+        self.live_count = 0
+
+    def __len__(self) -> int:
+        return self.live_count
+
+    def category_code(self, category: Optional[str], create: bool = True) -> int:
+        if not category:
+            return 0
+        code = self.category_codes.get(category)
+        if code is None:
+            if not create:
+                return -1
+            code = self.category_codes[category] = len(self.category_codes) + 1
+        return code
+
+    def add(self, doc: dict) -> bool:
+        """Index a new email; returns False if it was already indexed."""
+        email_id = doc["_id"]
+        category = (doc.get("metadata") or {}).get("category")
+        if email_id in self.positions:
+            if category:
+                self.set_category(email_id, category)
+            return False
+
+        terms = document_terms(doc)
+        length = sum(terms.values())
+        position = len(self.ids)
+        self.ids.append(email_id)
+        self.positions[email_id] = position
+        self.lengths.append(length)
+        self.categories.append(self.category_code(category))
+        self.live.append(1)
+        self.total_length += length
+        self.live_count += 1
+
+        for term, frequency in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("I"), array("H"))
+            postings[0].append(position)
+            postings[1].append(min(frequency, 65535))
+        return True
+
+    def set_category(self, email_id: ObjectId, category: Optional[str]):
+        position = self.positions.get(email_id)
+        if position is not None:
+            self.categories[position] = self.category_code(category)
+
+    def remove(self, email_id: ObjectId):
+        position = self.positions.get(email_id)
+        if position is not None and self.live[position]:
+            self.live[position] = 0
+            self.live_count -= 1
+            self.total_length -= self.lengths[position]
+
+    def mask(self, category_code: Optional[int] = None) -> np.ndarray:
+        """Boolean array over positions: live documents, optionally in one category."""
+        mask = np.frombuffer(self.live, dtype=np.int8) == 1
+        if category_code is not None:
+            mask &= np.frombuffer(self.categories, dtype=np.int32) == category_code
+        return mask
+
+    def search(self, terms: List[str], limit: int, category_code: Optional[int] = None) -> Tuple[List[Tuple[int, float]], int]:
+        """Top positions by BM25 score, and how many documents matched at all."""
+        if not self.ids or not self.live_count:
+            return [], 0
+
+        avg_length = self.total_length / self.live_count or 1.0
+        lengths = np.frombuffer(self.lengths, dtype=np.float32)
+        live = self.mask()
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(terms):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            docs = np.frombuffer(postings[0], dtype=np.uint32)
+            frequencies = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+            # Removed emails keep their postings; they must not count towards document frequency
+            kept = live[docs]
+            docs, frequencies = docs[kept], frequencies[kept]
+            if not len(docs):
+                continue
+            idf = math.log(1 + (self.live_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.K1 * (1 - self.B + self.B * lengths[docs] / avg_length)
+            scores[docs] += idf * frequencies * (self.K1 + 1) / (frequencies + norm)
+
+        scores[~self.mask(category_code)] = 0
+        matched = int(np.count_nonzero(scores))
+        if not matched:
+            return [], 0
+        k = min(limit, matched)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(position), float(scores[position])) for position in top], matched
+
+    def copy(self) -> "TextIndex":
+        clone = TextIndex()
+        clone.ids = list(self.ids)
+        clone.positions = dict(self.positions)
+        clone.lengths = array("f", self.lengths)
+        clone.categories = array("i", self.categories)
+        clone.live = array("b", self.live)
+        clone.category_codes = dict(self.category_codes)
+        clone.postings = {term: (docs[:], frequencies[:]) for term, (docs, frequencies) in self.postings.items()}
+        clone.total_length = self.total_length
+        clone.live_count = self.live_count
+        return clone
+
+
+class EmbeddingIndex:
+    """Normalized vectors by position, with random-hyperplane LSH tables for approximate nearest neighbours."""
+
+    def __init__(self, dim: int, tables: int, bits: int, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables, bits, dim)).astype(np.float32)
+        self.bit_values = 1 << np.arange(bits, dtype=np.int64)
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.count = 0
+        self.buckets: List[Dict[int, List[int]]] = [{} for _ in range(tables)]
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        # (tables, n) bucket codes from the sign of each hyperplane projection
+        signs = np.einsum("tbd,nd->tnb", self.planes, vectors) > 0
+        return signs.astype(np.int64) @ self.bit_values
+
+    def add(self, vectors: np.ndarray):
+        n = len(vectors)
+        if self.count + n > len(self.vectors):
+            grown = np.zeros((max(2 * len(self.vectors), self.count + n, 1024), self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.count] = self.vectors[:self.count]
+            self.vectors = grown
+        self.vectors[self.count:self.count + n] = vectors
+        for table, codes in zip(self.buckets, self._codes(vectors)):
+            for offset, code in enumerate(codes.tolist()):
+                table.setdefault(code, []).append(self.count + offset)
+        self.count += n
+
+    def search(self, vector: np.ndarray, limit: int, mask: np.ndarray) -> List[Tuple[int, float]]:
+        codes = self._codes(vector[None, :])[:, 0].tolist()
+        found = set()
+        for table, code in zip(self.buckets, codes):
+            found.update(table.get(code, ()))
+        if len(found) < limit * 4:
+            # Multi-probe: neighbouring buckets one bit away
+            for table, code in zip(self.buckets, codes):
+                for bit in self.bit_values.tolist():
+                    found.update(table.get(code ^ bit, ()))
+
+        candidates = np.fromiter(found, dtype=np.int64, count=len(found))
+        candidates = candidates[mask[candidates]]
+        if not len(candidates):
+            return []
+        scores = self.vectors[candidates] @ vector
+        k = min(limit, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
+
+
+class SearchIndex:
+    """In-process search over the inbox, kept current without full rebuilds.
+
+    Ingestion and processing update it directly; a change stream on the emails
+    collection (or polling for new ids, updated_at and deletions where change
+    streams are unavailable) picks up writes from other processes. A snapshot on disk means a restart only has to
+    index emails newer than the snapshot's watermark.
+    """
+
+    def __init__(self):
+        self.text = TextIndex()
+        self.embeddings: Optional[EmbeddingIndex] = None
+        self.embedder = None
+        self.watermark: Optional[ObjectId] = None
+        self.active = False
+        self.ready = False
+        self.follow_mode = "starting"
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.snapshot_at: Optional[float] = None
+        # When polling last looked for updated emails
+        self._polled_at: Optional[datetime] = None
+        self._dirty = False
+        self._new_documents = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.embeddings is not None
+
+    def add_documents(self, docs: Iterable[dict]):
+        if not self.active:
+            return
+        added = False
+        for doc in docs:
+            if self.text.add(doc):
+                added = True
+                if self.watermark is None or doc["_id"] > self.watermark:
+                    self.watermark = doc["_id"]
+        if added:
+            self._dirty = True
+            self._new_documents.set()
+
+    def set_category(self, email_id: ObjectId, category: Optional[str]):
+        if self.active:
+            self.text.set_category(email_id, category)
+            self._dirty = True
+
+    def remove(self, email_id: ObjectId):
+        if self.active:
+            self.text.remove(email_id)
+            self._dirty = True
+
+    async def search(self, query: str, limit: int = 20, category: Optional[str] = None, mode: str = "keyword") -> Tuple[List[Tuple[ObjectId, float]], int]:
+        """Ranked (email id, score) pairs and the total number of matches."""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"mode must be one of {', '.join(SEARCH_MODES)}")
+        if mode != "keyword" and not self.semantic_enabled:
+            raise ValueError("Semantic search is not enabled (set SEARCH_EMBEDDING_MODEL)")
+
+        start = time.perf_counter()
+        category_code = self.text.category_code(category, create=False) if category else None
+        # Fuse from a deeper pool than requested so both rankings get a say
+        pool = limit * 3 if mode == "hybrid" else limit
+
+        keyword, total = [], 0
+        if mode != "semantic":
+            keyword, total = self.text.search(tokenize(query), pool, category_code)
+        semantic = []
+        if mode != "keyword":
+            vector = (await asyncio.to_thread(self._encode, [query]))[0]
+            semantic = self.embeddings.search(vector, pool, self.text.mask(category_code)[:self.embeddings.count])
+
+        if mode == "keyword":
+            ranked = keyword
+        elif mode == "semantic":
+            ranked, total = semantic, len(semantic)
+        else:
+            fused: Dict[int, float] = {}
+            for results in (keyword, semantic):
+                for rank, (position, _) in enumerate(results):
+                    fused[position] = fused.get(position, 0.0) + 1 / (RRF_K + rank + 1)
+            ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+            total = max(total, len(fused))
+
+        self.queries += 1
+        self.query_seconds += time.perf_counter() - start
+        return [(self.text.ids[position], score) for position, score in ranked], total
+
+    async def search_documents(self, query: str, limit: int, category: Optional[str], mode: str, projection: dict) -> Tuple[List[dict], int]:
+        """Matching emails from MongoDB with their scores, best first, and the total number of matches.
+
+        Hits are checked against the database before the cut to limit: emails deleted
+        or recategorized by another process since the index last heard are dropped
+        from the page and corrected in the index, and the total no longer counts them.
+        """
+        while True:
+            # A little deeper than limit, so a few stale hits still leave a full page
+            hits, total = await self.search(query, limit=limit + max(5, limit // 4), category=category, mode=mode)
+            docs = await db.get_db()["emails"].find({"_id": {"$in": [email_id for email_id, _ in hits]}}, projection).to_list(len(hits))
+            by_id = {doc["_id"]: doc for doc in docs}
+            results, stale = [], 0
+            for email_id, score in hits:
+                doc = by_id.get(email_id)
+                current = (doc.get("metadata") or {}).get("category") if doc else None
+                if doc is None:
+                    self.remove(email_id)
+                    stale += 1
+                elif category and current != category:
+                    self.set_category(email_id, current)
+                    stale += 1
+                else:
+                    results.append({**doc, "score": score})
+            # Corrections are in the index now, so searching again fills the page from fresh hits
+            if not stale or len(results) >= limit or len(hits) >= total:
+                return results[:limit], max(total - stale, len(results[:limit]))
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.embedder.encode(
+            texts,
+            batch_size=settings.SEARCH_EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        ).astype(np.float32)
+
+    def _load_embedder(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            logger.warning("sentence-transformers is not installed, semantic search disabled")
+            return None
+        return SentenceTransformer(settings.SEARCH_EMBEDDING_MODEL, device="cpu")
+
+    async def _embed_loop(self):
+        """Embed indexed emails in position order, fetching text from MongoDB a batch at a time."""
+        emails = db.get_db()["emails"]
+        while True:
+            if self.embeddings.count >= len(self.text.ids):
+                self._new_documents.clear()
+                await self._new_documents.wait()
+                continue
+            ids = self.text.ids[self.embeddings.count:self.embeddings.count + settings.SEARCH_EMBEDDING_BATCH_SIZE]
+            try:
+                docs = await emails.find({"_id": {"$in": ids}}, {"subject": 1, "body": 1}).to_list(len(ids))
+            except PyMongoError as e:
+                logger.warning(f"Search embedding fetch failed, retrying: {e}")
+                await asyncio.sleep(settings.SEARCH_REFRESH_SECONDS)
+                continue
+            by_id = {doc["_id"]: doc for doc in docs}
+            vectors = await asyncio.to_thread(self._encode, [embedding_text(by_id.get(i, {})) for i in ids])
+            self.embeddings.add(vectors)
+            self._dirty = True
+
+    async def _catch_up(self, query: Optional[dict] = None):
+        """Index every email newer than the watermark (or matching query)."""
+        if query is None:
+            query = {}
+            if self.watermark is not None:
+                since = self.watermark.generation_time - CATCH_UP_OVERLAP
+                query = {"_id": {"$gt": ObjectId.from_datetime(since)}}
+        cursor = db.get_db()["emails"].find(query, INDEX_PROJECTION).sort("_id", 1)
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= settings.INGEST_BATCH_SIZE:
+                self.add_documents(batch)
+                batch = []
+                # Let requests run between batches during a large catch-up
+                await asyncio.sleep(0)
+        self.add_documents(batch)
+
+    async def _sync_categories(self):
+        """Categories assigned while the snapshot was on disk."""
+        cursor = db.get_db()["emails"].find({"processed": True}, {"metadata.category": 1})
+        async for doc in cursor:
+            self.text.set_category(doc["_id"], (doc.get("metadata") or {}).get("category"))
+
+    def _apply_change(self, change: dict):
+        operation = change["operationType"]
+        if operation in ("insert", "replace"):
+            self.add_documents([change["fullDocument"]])
+        elif operation == "update":
+            fields = change["updateDescription"]["updatedFields"]
+            metadata = fields.get("metadata")
+            category = metadata.get("category") if isinstance(metadata, dict) else fields.get("metadata.category")
+            if category:
+                self.set_category(change["documentKey"]["_id"], category)
+        elif operation == "delete":
+            self.remove(change["documentKey"]["_id"])
+
+    async def _follow(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "replace", "update", "delete"]}}}]
+        try:
+            async with db.get_db()["emails"].watch(pipeline) as stream:
+                self.follow_mode = "change_stream"
+                # Cover writes between the initial catch-up and the stream opening
+                await self._catch_up()
+                async for change in stream:
+                    self._apply_change(change)
+        except PyMongoError as e:
+            logger.warning(f"Email change stream unavailable, polling for changes instead: {e}")
+
+        self.follow_mode = "polling"
+        while True:
+            await asyncio.sleep(settings.SEARCH_REFRESH_SECONDS)
+            try:
+                await self._catch_up()
+                await self._poll_changes()
+            except PyMongoError as e:
+                logger.warning(f"Search index catch-up failed: {e}")
+
+    async def _poll_changes(self):
+        """Polling's stand-in for update and delete events: recent updated_at stamps, and a full id check once emails go missing."""
+        emails = db.get_db()["emails"]
+        since, polled_at = self._polled_at, datetime.utcnow()
+        if since is not None:
+            async for doc in emails.find({"updated_at": {"$gte": since - CATCH_UP_OVERLAP}}, {"metadata.category": 1}):
+                self.set_category(doc["_id"], (doc.get("metadata") or {}).get("category"))
+        self._polled_at = polled_at
+
+        if await emails.estimated_document_count() < len(self.text):
+            present = set()
+            async for doc in emails.find({}, {"_id": 1}):
+                present.add(doc["_id"])
+            for email_id, position in list(self.text.positions.items()):
+                if self.text.live[position] and email_id not in present:
+                    self.remove(email_id)
+
+    async def _run(self):
+        self._polled_at = datetime.utcnow()
+        loaded = await self._load_snapshot()
+        if settings.SEARCH_EMBEDDING_MODEL:
+            self.embedder = await asyncio.to_thread(self._load_embedder)
+            if self.embedder is not None:
+                dim = self.embedder.get_sentence_embedding_dimension()
+                vectors = loaded.get("vectors") if loaded.get("embedding_model") == settings.SEARCH_EMBEDDING_MODEL else None
+                self.embeddings = EmbeddingIndex(dim, settings.SEARCH_LSH_TABLES, settings.SEARCH_LSH_BITS)
+                if vectors is not None and len(vectors):
+                    self.embeddings.add(vectors)
+                self._tasks.append(asyncio.create_task(self._embed_loop()))
+
+        start = time.perf_counter()
+        await self._catch_up()
+        if loaded:
+            await self._sync_categories()
+        self.ready = True
+        logger.info(f"Search index ready: {len(self.text)} emails ({time.perf_counter() - start:.1f}s catch-up)")
+        await self._follow()
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(settings.SEARCH_SNAPSHOT_SECONDS)
+            if self.ready and self._dirty:
+                await self.save_snapshot()
+
+    async def save_snapshot(self):
+        if not settings.SEARCH_INDEX_PATH:
+            return
+        # Copy on the loop so the index can't change under the pickler
+        state = {
+            "version": SNAPSHOT_VERSION,
+            "text": self.text.copy(),
+            "watermark": self.watermark,
+            "embedding_model": settings.SEARCH_EMBEDDING_MODEL if self.embeddings else "",
+            "vectors": self.embeddings.vectors[:self.embeddings.count].copy() if self.embeddings else None,
+        }
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write_snapshot, state)
+            self.snapshot_at = time.time()
+        except OSError as e:
+            self._dirty = True
+            logger.warning(f"Could not write search index snapshot: {e}")
+
+    def _write_snapshot(self, state: dict):
+        path = settings.SEARCH_INDEX_PATH
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+
+    async def _load_snapshot(self) -> dict:
+        path = settings.SEARCH_INDEX_PATH
+        if not path or not os.path.exists(path):
+            return {}
+
+        def read():
+            with open(path, "rb") as f:
+                return pickle.load(f)
+
+        try:
+            state = await asyncio.to_thread(read)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable search index snapshot: {e}")
+            return {}
+        if state.get("version") != SNAPSHOT_VERSION:
+            return {}
+        self.text = state["text"]
+        self.watermark = state["watermark"]
+        logger.info(f"Loaded search index snapshot with {len(self.text)} emails")
+        return state
+
+    def start(self):
+        if not settings.SEARCH_INDEX_ENABLED or self.active:
+            return
+        self.active = True
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._snapshot_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.exception(f"Search index task failed: {e}")
+        self._tasks = []
+        if self.ready and self._dirty:
+            await self.save_snapshot()
+        self.active = False
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.active,
+            "ready": self.ready,
+            "follow_mode": self.follow_mode,
+            "documents": len(self.text),
+            "terms": len(self.text.postings),
+            "watermark": str(self.watermark) if self.watermark else None,
+            "semantic": {
+                "enabled": self.semantic_enabled,
+                "model": settings.SEARCH_EMBEDDING_MODEL or None,
+                "embedded": self.embeddings.count if self.embeddings else 0,
+            },
+            "queries": self.queries,
+            "avg_query_ms": round(self.query_seconds / self.queries * 1000, 2) if self.queries else 0.0,
+            "snapshot_at": self.snapshot_at,
+        }
+
+
+search_index = SearchIndex()
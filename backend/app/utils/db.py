@@ -1,19 +1,84 @@
+import logging
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from app.config import settings
+from app.utils.metrics import MongoCommandListener
+
+logger = logging.getLogger(__name__)
 
 class Database:
     client: AsyncIOMotorClient = None
 
     def connect(self):
-        self.client = AsyncIOMotorClient(settings.MONGODB_URL)
-        print("Connected to MongoDB")
+        self.client = AsyncIOMotorClient(settings.MONGODB_URL, event_listeners=[MongoCommandListener()])
+        logger.info("Connected to MongoDB")
 
     def close(self):
         if self.client:
             self.client.close()
-            print("Closed MongoDB connection")
+            logger.info("Closed MongoDB connection")
 
     def get_db(self):
         return self.client[settings.DATABASE_NAME]
 
+    async def ensure_indexes(self):
+        database = self.get_db()
+        # Dedup key for ingestion: the same subject at the same timestamp is the same email
+        try:
+            await database["emails"].create_index(
+                [("subject", ASCENDING), ("timestamp", ASCENDING)],
+                unique=True,
+                name="subject_timestamp_unique"
+            )
+        except OperationFailure as e:
+            # Ingestion relies on duplicate key errors to skip emails it has seen; without the index it would store them twice
+            logger.error(f"Could not create unique email index, remove duplicate (subject, timestamp) emails and restart: {e}")
+            raise
+
+        # Inbox listing: keyset pagination on (timestamp, _id), alone or behind a filter
+        emails = database["emails"]
+        await emails.create_index([("timestamp", DESCENDING), ("_id", DESCENDING)])
+        for field in ("metadata.category", "processed", "is_read", "sender"):
+            await emails.create_index([(field, ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+
+        # Analysis changes, for search index polling
+        await emails.create_index("updated_at", sparse=True)
+
+        # Near-duplicate candidates by SimHash band, and cluster listings
+        await emails.create_index("simhash_bands")
+        await emails.create_index(
+            [("metadata.duplicate_of", ASCENDING), ("timestamp", DESCENDING)],
+            partialFilterExpression={"metadata.duplicate_of": {"$type": "string"}}
+        )
+
+        # Active prompt lookups
+        await database["prompts"].create_index([("type", ASCENDING), ("is_active", ASCENDING)])
+
+        # Job queue claims and lease recovery
+        await database["jobs"].create_index([("status", ASCENDING), ("run_after", ASCENDING), ("created_at", ASCENDING)])
+        await database["jobs"].create_index([("status", ASCENDING), ("lease_expires_at", ASCENDING)])
+
+        # Finding emails that already have a draft from the current reply prompt
+        await database["drafts"].create_index([("email_id", ASCENDING), ("prompt_version", ASCENDING)])
+
+        # Busiest senders first on the stats dashboard
+        await database["sender_stats"].create_index([("total", DESCENDING)])
+
+        # Persistent LLM response cache entries expire on their own
+        await database["llm_cache"].create_index("expires_at", expireAfterSeconds=0)
+
+        # Chat sessions and their message history, dropped after a period of inactivity
+        session_ttl = settings.CHAT_SESSION_TTL_DAYS * 86400
+        await database["chat_sessions"].create_index("updated_at", expireAfterSeconds=session_ttl)
+        await database["chat_messages"].create_index([("session_id", ASCENDING), ("_id", ASCENDING)])
+        # Messages expire by their session's activity (refreshed at most daily, hence the extra day)
+        try:
+            await database["chat_messages"].drop_index("created_at_1")
+            # Messages from before then expire from when they were written
+            await database["chat_messages"].update_many({"active_at": {"$exists": False}}, [{"$set": {"active_at": "$created_at"}}])
+        except OperationFailure:
+            pass
+        await database["chat_messages"].create_index("active_at", expireAfterSeconds=session_ttl + 86400)
+
 db = Database()
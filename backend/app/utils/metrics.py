@@ -0,0 +1,80 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+
+# Request handlers
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+
+# LLM calls, one observation per provider attempt
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_duration_seconds", "LLM provider call latency", ["provider", "operation", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by LLM providers", ["provider", "operation"])
+LLM_ERRORS = Counter("llm_errors_total", "LLM call failures", ["provider", "operation", "error"])
+LLM_CACHE_LOOKUPS = Counter("llm_cache_lookups_total", "LLM response cache lookups", ["result"])
+LLM_IN_FLIGHT = Gauge("llm_pool_in_flight", "In-flight requests per provider pool", ["provider"])
+LLM_RATE_LIMIT_WAITING = Gauge("llm_rate_limiter_waiting", "Calls waiting on the rate limiter", ["limiter"])
+
+# MongoDB commands
+MONGO_OP_SECONDS = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ["collection", "command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+MONGO_ERRORS = Counter("mongo_command_errors_total", "Failed MongoDB commands", ["collection", "command"])
+
+# Email processing
+PROCESSING_STAGE_SECONDS = Histogram(
+    "email_processing_stage_duration_seconds", "Time spent in each process_email stage", ["stage"]
+)
+EMAILS_PROCESSED = Counter("emails_processed_total", "Emails run through process_email", ["outcome"])
+PROCESSING_QUEUE_DEPTH = Gauge("email_processing_queue_depth", "Emails waiting for a processing worker")
+NEAR_DUPLICATE_MATCHES = Counter(
+    "near_duplicate_matches_total", "Emails that reused a near-duplicate's analysis", ["source"]
+)
+PRECLASSIFIER_DECISIONS = Counter(
+    "preclassifier_decisions_total", "Emails categorized locally (by source) or left to the LLM", ["outcome"]
+)
+
+# Job queue
+JOB_QUEUE_DEPTH = Gauge("job_queue_depth", "Jobs by status", ["status"])
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command the driver sends, labelled by collection and command name."""
+
+    # Commands whose first argument is not a collection name
+    NON_COLLECTION_COMMANDS = {"ping", "hello", "isMaster", "ismaster", "buildInfo", "endSessions", "saslStart", "saslContinue"}
+
+    def __init__(self):
+        self._collections = {}
+
+    def _key(self, event):
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        collection = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        if event.command_name in self.NON_COLLECTION_COMMANDS or not isinstance(collection, str):
+            collection = "-"
+        self._collections[self._key(event)] = collection
+
+    def succeeded(self, event):
+        collection = self._collections.pop(self._key(event), "-")
+        MONGO_OP_SECONDS.labels(collection=collection, command=event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collections.pop(self._key(event), "-")
+        MONGO_OP_SECONDS.labels(collection=collection, command=event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_ERRORS.labels(collection=collection, command=event.command_name).inc()
@@ -0,0 +1,25 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+
+def encode_cursor(doc: dict, sort_field: str = "timestamp") -> str:
+    """Opaque cursor pointing just past doc in (sort_field, _id) descending order."""
+    value = doc[sort_field]
+    payload = {"v": value.isoformat() if isinstance(value, datetime) else value, "id": str(doc["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor: str) -> dict:
+    payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return {"v": datetime.fromisoformat(payload["v"]), "id": ObjectId(payload["id"])}
+
+def keyset_filter(cursor: Optional[str], sort_field: str = "timestamp") -> dict:
+    """Query matching everything after the cursor in (sort_field, _id) descending order."""
+    if not cursor:
+        return {}
+    position = decode_cursor(cursor)
+    return {"$or": [
+        {sort_field: {"$lt": position["v"]}},
+        {sort_field: position["v"], "_id": {"$lt": position["id"]}},
+    ]}
@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Mapping, Optional
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITIES = {"interactive": INTERACTIVE, "background": BACKGROUND}
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by every caller of one model.
+
+    Waiters are served in priority order (interactive before background, FIFO within a
+    priority). The effective rate backs off multiplicatively on 429s and recovers
+    additively on success, and the configured limits follow the provider's rate-limit
+    headers when it sends them (OpenAI does, Gemini doesn't).
+    """
+
+    MIN_SCALE = 0.05
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int = 0):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.scale = 1.0
+        self.request_tokens = float(max(requests_per_minute, 1))
+        self.token_tokens = float(max(tokens_per_minute, 1))
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _rates(self):
+        return self.requests_per_minute * self.scale / 60.0, self.tokens_per_minute * self.scale / 60.0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        request_rate, token_rate = self._rates()
+        self.request_tokens = min(max(self.requests_per_minute, 1), self.request_tokens + elapsed * request_rate)
+        if self.tokens_per_minute > 0:
+            self.token_tokens = min(self.tokens_per_minute, self.token_tokens + elapsed * token_rate)
+
+    def _delay_for(self, tokens: int) -> float:
+        """Seconds until a request needing this many tokens fits in both buckets."""
+        request_rate, token_rate = self._rates()
+        delay = max(0.0, self.paused_until - time.monotonic())
+        if self.requests_per_minute > 0 and self.request_tokens < 1:
+            delay = max(delay, (1 - self.request_tokens) / request_rate)
+        if self.tokens_per_minute > 0 and self.token_tokens < tokens:
+            delay = max(delay, (tokens - self.token_tokens) / token_rate)
+        return delay
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def acquire(self, tokens: int = 1, priority: int = BACKGROUND):
+        if self.requests_per_minute <= 0 and self.tokens_per_minute <= 0:
+            return
+
+        if self.tokens_per_minute > 0:
+            # A single oversized request can never exceed one minute of budget
+            tokens = min(tokens, self.tokens_per_minute)
+
+        entry = (priority, next(self._seq))
+        heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                self._refill()
+                delay = self._delay_for(tokens)
+                if self._waiters[0] == entry and delay <= 0:
+                    heapq.heappop(self._waiters)
+                    if self.requests_per_minute > 0:
+                        self.request_tokens -= 1
+                    if self.tokens_per_minute > 0:
+                        self.token_tokens -= tokens
+                    self._notify()
+                    return
+                changed = self._changed
+                try:
+                    # Wake early if the queue head changes (e.g. an interactive request arrives)
+                    await asyncio.wait_for(changed.wait(), timeout=min(max(delay, 0.01), 1.0))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._notify()
+            raise
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Charge (or refund) the difference between the estimate and what the provider reported."""
+        if actual_tokens is not None and self.tokens_per_minute > 0:
+            self.token_tokens -= actual_tokens - estimated_tokens
+
+    def on_success(self, headers: Optional[Mapping[str, str]] = None):
+        # Additive increase back towards the configured limits
+        self.scale = min(1.0, self.scale + 0.05)
+        if headers:
+            self._apply_headers(headers)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        # Multiplicative decrease, and stop everyone until the provider says we can retry
+        self.rate_limited += 1
+        self.scale = max(self.MIN_SCALE, self.scale / 2)
+        self.request_tokens = min(self.request_tokens, 0.0)
+        self.paused_until = max(self.paused_until, time.monotonic() + (retry_after or 1.0))
+        self._notify()
+
+    def _apply_headers(self, headers: Mapping[str, str]):
+        def header(name: str) -> Optional[int]:
+            value = headers.get(name)
+            try:
+                return int(value) if value is not None else None
+            except ValueError:
+                return None
+
+        # OpenAI-style x-ratelimit-* headers report the account's real limits
+        limit_requests = header("x-ratelimit-limit-requests")
+        limit_tokens = header("x-ratelimit-limit-tokens")
+        remaining_requests = header("x-ratelimit-remaining-requests")
+        remaining_tokens = header("x-ratelimit-remaining-tokens")
+
+        if limit_requests:
+            self.requests_per_minute = limit_requests
+        if limit_tokens:
+            self.tokens_per_minute = limit_tokens
+        if remaining_requests is not None:
+            self.request_tokens = min(self.request_tokens, remaining_requests)
+        if remaining_tokens is not None and self.tokens_per_minute > 0:
+            self.token_tokens = min(self.token_tokens, remaining_tokens)
+
+    def snapshot(self) -> dict:
+        self._refill()
+        return {
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "scale": round(self.scale, 3),
+            "available_requests": round(self.request_tokens, 1),
+            "available_tokens": round(self.token_tokens, 1) if self.tokens_per_minute > 0 else None,
+            "waiting": self.waiting,
+            "rate_limited": self.rate_limited,
+        }
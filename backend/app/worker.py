@@ -0,0 +1,181 @@
+"""Background job worker.
+
+Run one or more of these next to the API to scale ingestion and processing out:
+
+    python -m app.worker --concurrency 2
+
+Every worker claims jobs from the MongoDB-backed queue, so any number of
+processes on any number of machines can share the same queue.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Any, Dict
+from prometheus_client import start_http_server
+from app.config import settings
+from app.utils.db import db
+from app.services import job_queue
+from app.services.llm_service import llm_service
+from app.services.preclassifier import preclassifier
+from app.services.change_feed import change_feed
+from app.services.ingestion import get_mock_data_path, ingest_file, resolve_mailbox_path
+from app.services.processing import ProcessingProgress, process_unprocessed_emails
+from app.services.reprocessing import reprocess_stage
+from app.services.result_sink import result_sink
+from app.services.inbox_stats import inbox_stats
+
+logger = logging.getLogger(__name__)
+
+
+class JobContext:
+    """Handed to job handlers; anything placed in progress is published on each heartbeat."""
+
+    def __init__(self, job: dict):
+        self.job = job
+        self.params = job.get("params", {})
+        self.progress: Dict[str, Any] = {}
+        self.lease_lost = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            key: value.snapshot() if isinstance(value, ProcessingProgress) else value
+            for key, value in self.progress.items()
+        }
+
+
+async def run_ingest_job(ctx: JobContext) -> dict:
+    source = ctx.params.get("source", "mock")
+    if source == "file":
+        file_path = resolve_mailbox_path(ctx.params["path"])
+        format = ctx.params.get("format")
+    else:
+        file_path = get_mock_data_path()
+        format = "json"
+
+    ctx.progress["ingestion"] = {}
+    if not settings.CHANGE_FEED_ENABLED:
+        ctx.progress["processing"] = ProcessingProgress()
+    return await ingest_file(file_path, format, stats=ctx.progress["ingestion"], progress=ctx.progress.get("processing"))
+
+
+async def run_process_job(ctx: JobContext) -> dict:
+    ctx.progress["processing"] = ProcessingProgress()
+    progress = await process_unprocessed_emails(progress=ctx.progress["processing"])
+    return {"message": f"Processed {progress.processed} emails", "progress": progress.snapshot()}
+
+
+async def run_reprocess_job(ctx: JobContext) -> dict:
+    stage = ctx.params["stage"]
+    ctx.progress["processing"] = ProcessingProgress()
+    progress = await reprocess_stage(stage, progress=ctx.progress["processing"])
+    return {"message": f"Reprocessed {stage} for {progress.processed} emails", "progress": progress.snapshot()}
+
+
+async def run_reconcile_stats_job(ctx: JobContext) -> dict:
+    result = await inbox_stats.reconcile()
+    if result.get("skipped"):
+        return {"message": "Inbox stats are already being reconciled elsewhere", **result}
+    return {"message": f"Reconciled inbox stats, {len(result['drift'])} counters had drifted", **result}
+
+
+JOB_HANDLERS = {
+    "ingest": run_ingest_job,
+    "process": run_process_job,
+    "reprocess": run_reprocess_job,
+    "reconcile_stats": run_reconcile_stats_job,
+}
+
+
+class Worker:
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+
+    async def _heartbeat(self, ctx: JobContext, handler_task: asyncio.Task):
+        while not handler_task.done():
+            await asyncio.sleep(settings.JOB_HEARTBEAT_SECONDS)
+            still_owner = await job_queue.heartbeat(ctx.job["_id"], self.worker_id, ctx.snapshot())
+            if not still_owner:
+                logger.warning(f"Worker {self.worker_id} lost the lease on job {ctx.job['_id']}, abandoning it")
+                ctx.lease_lost = True
+                handler_task.cancel()
+                return
+
+    async def run_job(self, job: dict):
+        ctx = JobContext(job)
+        handler = JOB_HANDLERS.get(job["type"])
+        if handler is None:
+            await job_queue.fail({**job, "attempts": job["max_attempts"]}, self.worker_id, f"Unknown job type: {job['type']}", {})
+            return
+
+        logger.info(f"Worker {self.worker_id} running {job['type']} job {job['_id']} (attempt {job['attempts']})")
+        handler_task = asyncio.create_task(handler(ctx))
+        heartbeat_task = asyncio.create_task(self._heartbeat(ctx, handler_task))
+        try:
+            result = await handler_task
+        except asyncio.CancelledError:
+            if ctx.lease_lost:
+                return
+            raise
+        except Exception as e:
+            logger.exception(f"Worker {self.worker_id} failed {job['type']} job {job['_id']}")
+            await job_queue.fail(job, self.worker_id, str(e), ctx.snapshot())
+            return
+        finally:
+            heartbeat_task.cancel()
+
+        await job_queue.complete(job["_id"], self.worker_id, result, ctx.snapshot())
+
+    async def run(self):
+        logger.info(f"Worker {self.worker_id} started")
+        while not self._stopping:
+            try:
+                job = await job_queue.claim(self.worker_id)
+            except Exception as e:
+                logger.warning(f"Worker {self.worker_id} could not claim a job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(settings.JOB_POLL_SECONDS)
+                continue
+            await self.run_job(job)
+        logger.info(f"Worker {self.worker_id} stopped")
+
+
+async def main(concurrency: int, metrics_port: int):
+    if metrics_port:
+        # Workers don't serve HTTP, so expose their metrics on a side port
+        start_http_server(metrics_port)
+    db.connect()
+    await db.ensure_indexes()
+    await llm_service.startup()
+    preclassifier.start()
+    inbox_stats.start()
+    workers = [Worker() for _ in range(concurrency)]
+    runners = [worker.run() for worker in workers]
+    if settings.CHANGE_FEED_ENABLED:
+        runners.append(change_feed.run())
+    try:
+        await asyncio.gather(*runners)
+    finally:
+        change_feed.stop()
+        await result_sink.stop()
+        await inbox_stats.stop()
+        await preclassifier.stop()
+        await llm_service.shutdown()
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument("--concurrency", type=int, default=1, help="Jobs to run at once in this process")
+    parser.add_argument("--metrics-port", type=int, default=settings.WORKER_METRICS_PORT, help="Port for /metrics (0 disables)")
+    args = parser.parse_args()
+    # Run on its own, nothing else configures logging for this process
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main(args.concurrency, args.metrics_port))
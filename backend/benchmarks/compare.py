@@ -0,0 +1,62 @@
+"""Compare two benchmark reports written by benchmarks.run.
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import json
+
+# Metric path, and whether a larger value is better
+METRICS = [
+    (("throughput_per_second",), True),
+    (("elapsed_seconds",), False),
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p99"), False),
+    (("peak_traced_memory_mb",), False),
+]
+
+
+def lookup(report: dict, path: tuple):
+    value = report
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(before: dict, after: dict, threshold: float) -> int:
+    """Print a per-scenario table and return the number of regressions beyond the threshold."""
+    regressions = 0
+    for scenario in sorted(set(before["scenarios"]) | set(after["scenarios"])):
+        old = before["scenarios"].get(scenario)
+        new = after["scenarios"].get(scenario)
+        print(f"\n[{scenario}]")
+        if old is None or new is None:
+            print("  only present in one report")
+            continue
+        for path, higher_is_better in METRICS:
+            a, b = lookup(old, path), lookup(new, path)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a * 100 if a else 0.0
+            worse = change < -threshold if higher_is_better else change > threshold
+            regressions += worse
+            flag = "  REGRESSION" if worse else ""
+            print(f"  {'.'.join(path):<24} {a:>12} -> {b:<12} {change:+7.1f}%{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change treated as a regression")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+    regressions = compare(before, after, args.threshold)
+    raise SystemExit(1 if regressions else 0)
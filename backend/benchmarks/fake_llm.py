@@ -0,0 +1,107 @@
+import asyncio
+import json
+import random
+import re
+import time
+from typing import AsyncIterator, Optional
+from app.services.llm_providers import Completion, ProviderBackend
+
+CATEGORIES = ("Important", "To-Do", "Newsletter", "Spam")
+BATCH_ID_PATTERN = re.compile(r'<email id="([^"]+)">')
+
+
+class FakeProviderError(Exception):
+    """Looks enough like an SDK error for classify_exception to map it."""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = {"retry-after": str(retry_after)} if retry_after else {}
+
+
+class FakeBackend(ProviderBackend):
+    """Offline stand-in for a provider with configurable latency, rate limits and failures.
+
+    Latency is log-normal around latency_ms (sigma controls the tail). Requests beyond
+    rpm in any rolling minute get a 429, and failure_rate of the rest get a 503.
+    Answers are shaped after the prompt so the real parsing code paths run.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency_ms: float = 400, sigma: float = 0.5, rpm: int = 0, failure_rate: float = 0.0,
+                 tokens_per_second: float = 50, max_connections: int = 100, seed: int = 0):
+        super().__init__("fake-model", max_connections)
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.rpm = rpm
+        self.failure_rate = failure_rate
+        self.tokens_per_second = tokens_per_second
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self._window = []
+
+    def _latency(self) -> float:
+        return self.random.lognormvariate(0, self.sigma) * self.latency_ms / 1000.0
+
+    def _check_limits(self):
+        self.calls += 1
+        now = time.monotonic()
+        if self.rpm:
+            self._window = [t for t in self._window if now - t < 60]
+            if len(self._window) >= self.rpm:
+                self.rate_limited += 1
+                raise FakeProviderError("Rate limit exceeded", 429, retry_after=60 - (now - self._window[0]))
+            self._window.append(now)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.failed += 1
+            raise FakeProviderError("Service unavailable", 503)
+
+    def _headers(self) -> Optional[dict]:
+        # OpenAI-style rate-limit headers, so the limiter's header adaptation runs too
+        if not self.rpm:
+            return None
+        return {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(self.rpm - len(self._window)),
+        }
+
+    def _answer(self, prompt: str) -> str:
+        category = self.random.choice(CATEGORIES)
+        ids = BATCH_ID_PATTERN.findall(prompt)
+        if ids:
+            return json.dumps({email_id: self.random.choice(CATEGORIES) for email_id in ids})
+        if '"action_items"' in prompt:
+            items = [] if category in ("Newsletter", "Spam") else [{"task": "Follow up", "deadline": None, "priority": "Medium"}]
+            return json.dumps({"category": category, "action_items": items, "summary": "A synthetic summary of the email."})
+        if "JSON" in prompt or "json" in prompt:
+            return json.dumps({"tasks": []})
+        if "categor" in prompt.lower():
+            return category
+        return "This is a synthetic reply generated by the fake provider."
+
+    async def complete(self, system_prompt: str, prompt: str) -> Completion:
+        self._enter()
+        try:
+            await asyncio.sleep(self._latency())
+            self._check_limits()
+            text = self._answer(prompt)
+        finally:
+            self._exit()
+        return text, self._headers(), (len(system_prompt) + len(prompt) + len(text)) // 4
+
+    async def stream(self, system_prompt: str, prompt: str) -> AsyncIterator[str]:
+        self._enter()
+        try:
+            await asyncio.sleep(self._latency())
+            self._check_limits()
+            for word in self._answer(prompt).split(" "):
+                await asyncio.sleep(1.0 / self.tokens_per_second)
+                yield word + " "
+        finally:
+            self._exit()
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "rate_limited": self.rate_limited, "failed": self.failed}
@@ -0,0 +1,245 @@
+"""Offline benchmark suite.
+
+Runs ingestion, processing, list-query and agent scenarios against an in-process
+MongoDB stand-in (mongomock-motor) and a fake LLM provider, so throughput can be
+measured without a database or API spend. From backend/:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.run --emails 10000 --latency-ms 400 --provider-rpm 3000
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Each run writes a JSON report to benchmarks/results/.
+"""
+import os
+
+# Settings are read at import time; point them at the stand-ins before importing the app
+os.environ.setdefault("MONGODB_URL", "mongodb://benchmark.invalid")
+os.environ.setdefault("DATABASE_NAME", "benchmark")
+os.environ.setdefault("EMBEDDED_WORKER", "false")
+
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, List
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+from app.main import app
+from app.services import ingestion, processing
+from app.services.llm_service import llm_service
+from app.utils.db import db
+from app.utils.rate_limit import RateLimiter
+from benchmarks.fake_llm import FakeBackend
+from benchmarks.synthetic import generate_inbox
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Scenario:
+    """Collects per-operation latencies and peak memory for one scenario."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.items = 0
+        self.extra = {}
+
+    def timed(self, func: Callable) -> Callable:
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+        return wrapper
+
+    async def run(self, body):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            await body(self)
+        finally:
+            self.elapsed = time.perf_counter() - start
+            _, self.peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return self.report()
+
+    def report(self) -> dict:
+        return {
+            "items": self.items,
+            "operations": len(self.latencies),
+            "elapsed_seconds": round(self.elapsed, 3),
+            "throughput_per_second": round(self.items / self.elapsed, 2) if self.elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(self.latencies, 50) * 1000, 2),
+                "p99": round(percentile(self.latencies, 99) * 1000, 2),
+                "max": round(max(self.latencies, default=0) * 1000, 2),
+            },
+            "peak_traced_memory_mb": round(self.peak_memory / 2**20, 2),
+            **self.extra,
+        }
+
+
+async def bench_ingest(args, scenario: Scenario):
+    await db.get_db()["emails"].delete_many({})
+    original = ingestion.insert_email_batch
+    ingestion.insert_email_batch = scenario.timed(original)
+    try:
+        stats = await ingestion.ingest_emails(generate_inbox(args.emails, args.seed, args.body_repeat))
+    finally:
+        ingestion.insert_email_batch = original
+    scenario.items = stats["inserted"]
+    scenario.extra["ingestion"] = stats
+
+
+async def bench_process(args, scenario: Scenario):
+    await db.get_db()["emails"].update_many({}, {"$set": {"processed": False}})
+    original = processing.process_email
+    processing.process_email = scenario.timed(original)
+    try:
+        progress = await processing.process_unprocessed_emails(concurrency=args.concurrency)
+    finally:
+        processing.process_email = original
+    scenario.items = progress.processed
+    scenario.extra["progress"] = progress.snapshot()
+
+
+async def bench_list(args, scenario: Scenario):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        get = scenario.timed(client.get)
+        cursor = None
+        for _ in range(args.list_pages):
+            params = {"limit": args.page_size}
+            if cursor:
+                params["cursor"] = cursor
+            response = await get("/api/emails/", params=params)
+            response.raise_for_status()
+            scenario.items += len(response.json())
+            cursor = response.headers.get("x-next-cursor")
+            if not cursor:
+                break
+        for category in ("Newsletter", "Important"):
+            response = await get("/api/emails/", params={"limit": args.page_size, "category": category})
+            response.raise_for_status()
+            scenario.items += len(response.json())
+
+
+async def bench_agent(args, scenario: Scenario):
+    sample = await db.get_db()["emails"].find_one({})
+    email = {key: str(value) for key, value in sample.items() if key in ("_id", "sender", "subject", "body")}
+    transport = httpx.ASGITransport(app=app)
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+        post = scenario.timed(client.post)
+
+        async def one(i: int):
+            async with slots:
+                if i % 2:
+                    payload = {"email": email, "instructions": f"Reply variant {i}", "use_cache": False}
+                    response = await post("/api/agent/draft", json=payload)
+                else:
+                    payload = {"message": f"What does this email want? ({i})", "email": email, "use_cache": False}
+                    response = await post("/api/agent/chat", json=payload)
+                scenario.items += 1
+                scenario.extra.setdefault("status_codes", {})
+                codes = scenario.extra["status_codes"]
+                codes[str(response.status_code)] = codes.get(str(response.status_code), 0) + 1
+
+        await asyncio.gather(*(one(i) for i in range(args.agent_requests)))
+
+
+SCENARIOS = {
+    "ingest": bench_ingest,
+    "process": bench_process,
+    "list": bench_list,
+    "agent": bench_agent,
+}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def main(args):
+    db.client = AsyncMongoMockClient()
+    await db.ensure_indexes()
+
+    fake = FakeBackend(
+        latency_ms=args.latency_ms,
+        sigma=args.latency_sigma,
+        rpm=args.provider_rpm,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+    )
+    llm_service.register_backend(fake)
+    llm_service.provider = fake.name
+    llm_service.fallback_provider = ""
+    if not args.cache:
+        llm_service.cache = None
+    if args.client_rpm:
+        key = f"{fake.name}:{fake.model}"
+        llm_service.rate_limiters[key] = RateLimiter(key, args.client_rpm, 0)
+
+    results = {}
+    for name in args.scenarios.split(","):
+        print(f"Running {name}...")
+        results[name] = await Scenario(name).run(lambda scenario: SCENARIOS[name](args, scenario))
+        print(json.dumps(results[name], indent=2))
+
+    report = {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+            "fake_llm": fake.stats(),
+            "args": vars(args),
+        },
+        "scenarios": results,
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--emails", type=int, default=10000)
+    parser.add_argument("--body-repeat", type=int, default=1, help="Repeat each body to simulate longer emails")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=400, help="Median fake LLM latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of fake LLM latency")
+    parser.add_argument("--provider-rpm", type=int, default=0, help="Fake provider's own limit; excess calls get 429s")
+    parser.add_argument("--client-rpm", type=int, default=0, help="Client-side limiter for the fake provider")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of fake calls that fail with 503")
+    parser.add_argument("--cache", action="store_true", help="Keep the LLM response cache enabled")
+    parser.add_argument("--list-pages", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--agent-requests", type=int, default=200)
+    parser.add_argument("--output", help="Where to write the JSON report")
+    asyncio.run(main(parser.parse_args()))
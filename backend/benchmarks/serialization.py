@@ -0,0 +1,85 @@
+"""Micro-benchmark of list response encoding.
+
+Compares FastAPI's response_model path (validate every document through the
+Pydantic model, dump it, then json.dumps) with app.utils.serialization, on
+synthetic documents shaped like the emails collection. From backend/:
+
+    python -m benchmarks.serialization --page-sizes 100,500,1000 --repeat 20
+"""
+import argparse
+import json
+import time
+from typing import Callable, List, Union
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+# Imported first: it points settings at the stand-ins before the app is imported
+from benchmarks.run import percentile
+from benchmarks.synthetic import generate_inbox
+from app.models.email import Email, EmailListItem
+from app.utils import serialization
+
+
+def documents(count: int, view: str) -> List[dict]:
+    docs = []
+    for email in generate_inbox(count):
+        doc = Email.model_validate(email).model_dump(by_alias=True)
+        doc["_id"] = ObjectId()
+        doc["processed"] = True
+        doc["metadata"].update(
+            category="Important",
+            summary="A short summary of what the email asks for and by when.",
+            action_items=[{"task": "Send the report", "deadline": "Friday", "priority": "High"}],
+        )
+        if view == "list":
+            doc["snippet"] = doc.pop("body")[:200]
+        docs.append(doc)
+    return docs
+
+
+def response_model_path(docs: List[dict], view: str) -> Callable[[], bytes]:
+    # What FastAPI does for response_model=List[...]: validate, dump in JSON mode, encode
+    adapter = TypeAdapter(Union[List[Email], List[EmailListItem]] if view == "full" else List[EmailListItem])
+
+    def encode() -> bytes:
+        data = adapter.dump_python(adapter.validate_python(docs), mode="json", by_alias=True)
+        return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    return encode
+
+
+def measure(encode: Callable[[], bytes], repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode()
+        timings.append(time.perf_counter() - start)
+    return {
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "bytes": len(body),
+    }
+
+
+def main(args):
+    results = {"encoder": "orjson" if serialization.orjson else "json", "brotli": serialization.brotli is not None, "pages": {}}
+    for size in (int(s) for s in args.page_sizes.split(",")):
+        docs = documents(size, args.view)
+        page = {
+            "response_model": measure(response_model_path(docs, args.view), args.repeat),
+            "fast": measure(lambda: serialization.dumps(docs), args.repeat),
+            "fast_gzip": measure(lambda: serialization.compress(serialization.dumps(docs), "gzip"), args.repeat),
+        }
+        if serialization.brotli:
+            page["fast_br"] = measure(lambda: serialization.compress(serialization.dumps(docs), "br"), args.repeat)
+        page["speedup"] = round(page["response_model"]["p50_ms"] / max(page["fast"]["p50_ms"], 1e-6), 1)
+        results["pages"][str(size)] = page
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark list response serialization")
+    parser.add_argument("--page-sizes", default="100,500,1000")
+    parser.add_argument("--view", choices=("full", "list"), default="full")
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,51 @@
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Iterator
+
+# Shaped after data/mock_inbox.json, weighted towards bulk mail like a real inbox
+TEMPLATES = [
+    (0.30, "newsletter@{domain}", "{topic} Weekly: issue #{n}", "Here are the top stories in {topic} this week. Read more on our site. Unsubscribe at any time."),
+    (0.15, "notifications@{domain}", "New activity on your {topic} account", "You have {n} new notifications. View them in the app. You are receiving this because you signed up."),
+    (0.10, "spam@{domain}", "You won a {topic} prize!", "Click here to claim your prize #{n} before it expires..."),
+    (0.15, "boss@company.com", "Urgent: {topic} report due", "Hi, I need the {topic} report by EOD tomorrow. Please prioritize this. Ref {n}."),
+    (0.15, "client@{domain}", "Meeting Request: {topic} kickoff", "Can we meet next Tuesday at 2 PM to discuss the {topic} project? Agenda item {n} is the budget."),
+    (0.15, "colleague{n}@company.com", "Re: {topic} review", "Thanks for the notes on {topic}. I've left comments on section {n}; could you take a look by Friday?"),
+]
+TOPICS = ["AI", "Q4", "Security", "Cloud", "Marketing", "Hiring", "Design", "Finance", "Roadmap", "Infra"]
+DOMAINS = ["techweekly.com", "bigcorp.com", "offers.com", "example.org", "news.io", "startup.dev"]
+
+
+def generate_inbox(count: int, seed: int = 0, body_repeat: int = 1) -> Iterator[dict]:
+    """Yield count synthetic emails in mock_inbox.json format. body_repeat lengthens bodies."""
+    rng = random.Random(seed)
+    weights = [t[0] for t in TEMPLATES]
+    start = datetime(2023, 10, 27, 9, 0, 0)
+    for i in range(count):
+        _, sender, subject, body = rng.choices(TEMPLATES, weights)[0]
+        fields = {"domain": rng.choice(DOMAINS), "topic": rng.choice(TOPICS), "n": rng.randint(1, 10000)}
+        yield {
+            "sender": sender.format(**fields),
+            # The index makes (subject, timestamp) unique, like distinct real messages
+            "subject": f"{subject.format(**fields)} [{i}]",
+            "body": " ".join([body.format(**fields)] * body_repeat),
+            "timestamp": (start + timedelta(seconds=i * 37)).isoformat() + "Z",
+        }
+
+
+def write_jsonl(path: str, count: int, seed: int = 0, body_repeat: int = 1):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in generate_inbox(count, seed, body_repeat):
+            f.write(json.dumps(item) + "\n")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic inbox as JSONL")
+    parser.add_argument("path")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--body-repeat", type=int, default=1)
+    args = parser.parse_args()
+    write_jsonl(args.path, args.count, args.seed, args.body_repeat)
@@ -0,0 +1,93 @@
+"""Shared fixtures: an in-process MongoDB (mongomock-motor) and the benchmarks' fake LLM provider.
+
+From backend/:
+
+    pip install -r tests/requirements.txt
+    python -m pytest
+"""
+import itertools
+import os
+from datetime import datetime, timedelta
+
+# Settings are read at import time; point them at the stand-ins before importing the app
+os.environ.setdefault("MONGODB_URL", "mongodb://tests.invalid")
+os.environ.setdefault("DATABASE_NAME", "tests")
+os.environ.setdefault("EMBEDDED_WORKER", "false")
+os.environ.setdefault("CHANGE_FEED_ENABLED", "false")
+os.environ.setdefault("SEARCH_INDEX_ENABLED", "false")
+os.environ.setdefault("INBOX_STATS_RECONCILE_SECONDS", "0")
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from app.main import app
+from app.services.inbox_stats import InboxStats, inbox_stats
+from app.services.llm_service import llm_service
+from app.services.prompt_registry import prompt_registry
+from app.services.result_sink import ResultSink, result_sink
+from app.utils.db import db
+from benchmarks.fake_llm import FakeBackend
+
+
+@pytest.fixture
+async def mongo():
+    db.client = AsyncMongoMockClient()
+    await db.ensure_indexes()
+    yield db.get_db()
+    await result_sink.stop()
+    result_sink.__dict__.update(ResultSink().__dict__)
+    # Deltas left pending by one test must not reach the next one's database
+    if inbox_stats._flusher:
+        inbox_stats._flusher.cancel()
+    inbox_stats.__dict__.update(InboxStats().__dict__)
+    prompt_registry.invalidate()
+    db.client = None
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    fake = FakeBackend(latency_ms=0, sigma=0, tokens_per_second=10000)
+    llm_service.register_backend(fake)
+    monkeypatch.setattr(llm_service, "provider", fake.name)
+    monkeypatch.setattr(llm_service, "fallback_provider", "")
+    monkeypatch.setattr(llm_service, "cache", None)
+    monkeypatch.setattr(llm_service, "rate_limiters", {})
+    monkeypatch.setattr(llm_service, "circuit_breakers", {})
+    return fake
+
+
+_emails = itertools.count()
+
+
+@pytest.fixture
+def make_email():
+    """make_email(**fields): an unprocessed email document, with fields overriding the defaults.
+
+    Each one gets its own subject and a later timestamp, so the unique (subject,
+    timestamp) index never rejects them and newest-first order is creation order.
+    """
+    def make(**fields) -> dict:
+        n = next(_emails)
+        return {
+            "sender": f"s{n}@example.com", "subject": f"Subject {n}", "body": "Please send the report by Friday.",
+            "timestamp": datetime(2024, 1, 1) + timedelta(minutes=n), "is_read": False, "processed": False, **fields,
+        }
+    return make
+
+
+@pytest.fixture
+def insert_emails(mongo, make_email):
+    """await insert_emails(count, **fields): inserts count emails from make_email and returns them with their _ids."""
+    async def insert(count: int = 1, **fields) -> list:
+        docs = [make_email(**fields) for _ in range(count)]
+        await mongo["emails"].insert_many(docs)
+        return docs
+    return insert
+
+
+@pytest.fixture
+async def client(mongo):
+    # The app's lifespan connects to the real database, so requests go straight to the routes
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
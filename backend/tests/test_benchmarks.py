@@ -0,0 +1,47 @@
+import json
+from benchmarks.compare import compare
+from benchmarks.fake_llm import FakeBackend, FakeProviderError
+from benchmarks.synthetic import generate_inbox
+
+
+def report(throughput: float, p99: float) -> dict:
+    return {"scenarios": {"list": {"throughput_per_second": throughput, "latency_ms": {"p50": 1.0, "p99": p99}}}}
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    assert compare(report(100, 10), report(95, 10.5), threshold=10) == 0
+    # Throughput down 20% and p99 up 50%
+    assert compare(report(100, 10), report(80, 15), threshold=10) == 2
+
+
+def test_compare_ignores_scenarios_missing_from_one_report():
+    assert compare(report(100, 10), {"scenarios": {}}, threshold=10) == 0
+
+
+def test_synthetic_inbox_is_deterministic_and_unique():
+    first = list(generate_inbox(50, seed=3))
+    assert first == list(generate_inbox(50, seed=3))
+    assert len({(e["subject"], e["timestamp"]) for e in first}) == 50
+
+
+async def test_fake_backend_answers_batch_prompts_with_every_id():
+    fake = FakeBackend(latency_ms=0, sigma=0)
+    text, _, tokens = await fake.complete("system", '<email id="a">x</email><email id="b">y</email>')
+    assert set(json.loads(text)) == {"a", "b"}
+    assert tokens > 0
+
+
+async def test_fake_backend_enforces_its_rate_limit():
+    fake = FakeBackend(latency_ms=0, sigma=0, rpm=1)
+    await fake.complete("system", "categorize")
+    try:
+        await fake.complete("system", "categorize")
+    except FakeProviderError as e:
+        assert e.status_code == 429
+    else:
+        raise AssertionError("second call should have been rate limited")
+    assert fake.stats()["rate_limited"] == 1
+
+
+async def test_ensure_indexes_runs_against_the_in_memory_database(mongo):
+    assert "emails" in await mongo.list_collection_names()
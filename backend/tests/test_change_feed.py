@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app.config import settings
+from app.services.change_feed import ChangeFeedProcessor
+from app.services.processing import claim_emails
+
+
+def processor(monkeypatch, owner):
+    monkeypatch.setattr(settings, "LLM_BATCH_CATEGORIZATION", False)
+    feed = ChangeFeedProcessor(owner)
+    feed._queue = asyncio.Queue()
+    return feed
+
+
+async def drain(feed):
+    await asyncio.gather(*feed._batch_tasks)
+    items = []
+    while not feed._queue.empty():
+        items.append(feed._queue.get_nowait()[0])
+    return items
+
+
+async def test_only_one_leader_holds_the_lease(mongo):
+    first, second = ChangeFeedProcessor("first"), ChangeFeedProcessor("second")
+    assert await first._acquire_lease()
+    assert not await second._acquire_lease()
+    # Renewal by the holder keeps it
+    assert await first._acquire_lease()
+    await first._release_lease()
+    assert await second._acquire_lease()
+
+
+async def test_expired_lease_is_taken_over(mongo):
+    first, second = ChangeFeedProcessor("first"), ChangeFeedProcessor("second")
+    assert await first._acquire_lease()
+    await mongo["service_state"].update_one({}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    assert await second._acquire_lease()
+
+
+async def test_feed_skips_emails_a_process_job_has_claimed(mongo, insert_emails, monkeypatch):
+    docs = await insert_emails(4)
+    await claim_emails(docs[:2], "process-job")
+    feed = processor(monkeypatch, "feed")
+
+    taken, _ = await feed._poll()
+    assert taken == 2
+    queued = await drain(feed)
+    assert {email["_id"] for email in queued} == {doc["_id"] for doc in docs[2:]}
+    # And a process job now skips the feed's
+    assert await claim_emails(docs, "process-job") == docs[:2]
+
+
+async def test_failed_emails_are_retried_once_their_backoff_passes(mongo, insert_emails, monkeypatch):
+    docs = await insert_emails(1)
+    feed = processor(monkeypatch, "feed")
+    await feed._dispatch(docs)
+    await drain(feed)
+    feed._on_done(docs[0], RuntimeError("LLM down"))
+
+    assert await feed._retry_failures() == 0
+    feed._failures[docs[0]["_id"]] = (1, 0.0)
+    assert await feed._retry_failures() == 1
+    assert [email["_id"] for email in await drain(feed)] == [docs[0]["_id"]]
+
+
+async def test_sweep_pages_past_emails_it_cannot_take(mongo, insert_emails, monkeypatch):
+    monkeypatch.setattr(settings, "PROCESSING_BATCH_SIZE", 1)
+    docs = await insert_emails(7)
+    feed = processor(monkeypatch, "feed")
+    # The newest page was processed already; polling mustn't stop at it
+    for doc in docs[3:]:
+        feed._recent[doc["_id"]] = None
+
+    await feed._sweep()
+
+    assert {email["_id"] for email in await drain(feed)} == {doc["_id"] for doc in docs[:3]}
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from app.config import settings
+from app.services import chat_sessions
+
+
+async def test_prefix_only_grows_between_turns(mongo, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_SUMMARY_THRESHOLD_TOKENS", 10 ** 6)
+    session = await chat_sessions.create_session(title="Planning")
+    prefixes = []
+    for turn in range(5):
+        session = await chat_sessions.record_turn(session, f"Question {turn} " * 50, f"Answer {turn} " * 50)
+        prefixes.append(chat_sessions.session_prefix(session))
+    for previous, current in zip(prefixes, prefixes[1:]):
+        assert current.startswith(previous.rstrip("\n"))
+
+
+async def test_failed_summary_still_bounds_history(mongo, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_SUMMARY_THRESHOLD_TOKENS", 20)
+    monkeypatch.setattr(settings, "CHAT_KEEP_RECENT_TURNS", 2)
+    monkeypatch.setattr(chat_sessions, "schedule_summary", lambda session: None)
+
+    async def unavailable(*args, **kwargs):
+        raise RuntimeError("provider down")
+
+    monkeypatch.setattr(chat_sessions.llm_service, "generate_text", unavailable)
+    session = await chat_sessions.create_session()
+    for turn in range(3):
+        session = await chat_sessions.record_turn(session, "word " * 20, "word " * 20)
+
+    await chat_sessions.summarize(session)
+
+    stored = await chat_sessions.get_session(str(session["_id"]))
+    assert len(stored["recent"]) == 2
+    assert stored["summary"] == ""
+    assert len(await chat_sessions.get_messages(session["_id"])) == 6
+
+
+async def test_messages_expire_with_session_activity(mongo):
+    session = await chat_sessions.create_session()
+    session = await chat_sessions.record_turn(session, "hello", "hi")
+    first = (await chat_sessions.get_messages(session["_id"]))[0]
+    assert first["active_at"] == session["messages_active_at"]
+
+    # A day later the session is still in use: its older messages are kept alive too
+    stale = datetime.utcnow() - timedelta(days=2)
+    await chat_sessions.sessions_collection().update_one({"_id": session["_id"]}, {"$set": {"messages_active_at": stale}})
+    await chat_sessions.messages_collection().update_many({}, {"$set": {"active_at": stale}})
+    session = await chat_sessions.get_session(str(session["_id"]))
+    session = await chat_sessions.record_turn(session, "again", "sure")
+
+    messages = await chat_sessions.get_messages(session["_id"])
+    assert len(messages) == 4
+    assert all(message["active_at"] > stale for message in messages)
@@ -0,0 +1,71 @@
+import json
+
+from bson import ObjectId
+
+from app.services.llm_cache import LLMCache, MemoryCache
+from app.services.llm_service import llm_service
+from app.services.drafts import draft_document, generate_drafts
+
+
+def test_draft_document_keeps_object_ids():
+    email_id = ObjectId()
+    doc = draft_document({"_id": email_id, "subject": "Hi"}, "Thanks!", "default")
+    assert isinstance(doc["_id"], ObjectId)
+    assert doc["email_id"] == email_id
+    assert "id" not in doc
+
+
+async def test_draft_round_trip(mongo, insert_emails, fake_llm, client):
+    [email] = await insert_emails()
+    created = await client.post("/api/agent/draft", json={"email": {**email, "_id": str(email["_id"]), "timestamp": None}, "use_cache": False})
+    assert created.status_code == 200
+    draft_id = created.json()["draft_id"]
+
+    stored = await mongo["drafts"].find_one({"_id": ObjectId(draft_id)})
+    assert stored["email_id"] == email["_id"]
+
+    updated = await client.put(f"/api/agent/drafts/{draft_id}", json={"body": "Friday works."})
+    assert updated.status_code == 200
+    assert updated.json()["body"] == "Friday works."
+
+    deleted = await client.delete(f"/api/agent/drafts/{draft_id}")
+    assert deleted.status_code == 200
+    assert await mongo["drafts"].count_documents({}) == 0
+    assert (await client.delete(f"/api/agent/drafts/{draft_id}")).status_code == 404
+
+
+async def test_bulk_drafts_skip_emails_with_a_current_draft(mongo, insert_emails, fake_llm, client):
+    emails = await insert_emails(3)
+    ids = [str(email["_id"]) for email in emails]
+
+    first = [json.loads(line) for line in (await client.post("/api/agent/drafts/bulk", json={"email_ids": ids})).text.splitlines()]
+    assert first[-1] == {"done": True, "total": 3, "generated": 3, "skipped": 0, "failed": 0}
+
+    second = [result async for result in generate_drafts(emails)]
+    assert [result["status"] for result in second] == ["skipped"] * 3
+    assert await mongo["drafts"].count_documents({}) == 3
+
+
+async def test_forced_drafts_are_not_served_from_the_llm_cache(mongo, insert_emails, fake_llm, client, monkeypatch):
+    monkeypatch.setattr(llm_service, "cache", LLMCache([MemoryCache(100)], ttl=60))
+    [email] = await insert_emails()
+    payload = {"email": {**email, "_id": str(email["_id"]), "timestamp": None}}
+
+    await client.post("/api/agent/draft", json=payload)
+    await client.post("/api/agent/draft", json=payload)
+    assert fake_llm.calls == 1
+
+    await client.post("/api/agent/draft", json={**payload, "force": True})
+    [result async for result in generate_drafts([email], force=True)]
+    assert fake_llm.calls == 3
+
+
+async def test_bulk_drafts_read_filter_is_validated(mongo, insert_emails, fake_llm, client):
+    await insert_emails(sender="cfo@example.com", subject="Read one", is_read=True)
+    await insert_emails(sender="cfo@example.com", subject="Unread one", is_read=False)
+
+    response = await client.post("/api/agent/drafts/bulk", json={"sender": "cfo@example.com", "is_read": "false"})
+    assert json.loads(response.text.splitlines()[-1])["generated"] == 1
+    assert (await mongo["drafts"].find_one())["subject"] == "Re: Unread one"
+
+    assert (await client.post("/api/agent/drafts/bulk", json={"sender": "cfo@example.com", "is_read": "maybe"})).status_code == 422
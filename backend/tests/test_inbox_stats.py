@@ -0,0 +1,100 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services import inbox_stats as stats_module
+from app.services.inbox_stats import STATS_ID, InboxStats, inbox_stats
+
+
+@pytest.fixture(autouse=True)
+def no_settle(monkeypatch):
+    monkeypatch.setattr(stats_module, "RECONCILE_SETTLE_SECONDS", 0)
+
+
+def age(stats, seconds):
+    """Backdate pending deltas, as if they had been added seconds ago."""
+    shift = timedelta(seconds=seconds)
+    stats.pending = defaultdict(Counter, {second - shift: counts for second, counts in stats.pending.items()})
+    stats.senders = defaultdict(lambda: defaultdict(Counter), {second - shift: by_sender for second, by_sender in stats.senders.items()})
+
+
+async def test_reconcile_corrects_drift(mongo, insert_emails):
+    await insert_emails(sender="a@example.com", processed=True, metadata={"category": "Work", "action_items": [{"task": "Reply", "priority": "High"}]})
+    await insert_emails(sender="a@example.com", is_read=True)
+    await insert_emails(sender="b@example.com")
+    await mongo["inbox_stats"].insert_one({"_id": STATS_ID, "total": 5, "unread": 1, "categories": {"Old": {"total": 2, "unread": 2}}})
+    await mongo["sender_stats"].insert_one({"_id": "gone@example.com", "total": 4, "unread": 1, "reconciled_at": datetime(2020, 1, 1)})
+
+    result = await inbox_stats.reconcile()
+
+    assert result["drift"]["total"] == -2
+    assert result["drift"]["categories.Old.total"] == -2
+    assert result["senders_removed"] == 1
+    stats = await inbox_stats.get()
+    assert (stats["total"], stats["unread"], stats["processed"]) == (3, 2, 1)
+    assert stats["categories"] == {"Work": {"total": 1, "unread": 1}}
+    assert stats["action_items"] == {"High": 1}
+    assert {s["sender"]: s["total"] for s in stats["senders"]} == {"a@example.com": 2, "b@example.com": 1}
+
+
+async def test_deltas_the_reconciliation_counted_are_not_written_again(mongo, insert_emails):
+    other = InboxStats()
+    [first] = await insert_emails(sender="a@example.com")
+    # Another process has not flushed this yet when the reconciliation counts the email
+    other.add_ingested([first])
+    age(other, 5)
+
+    await inbox_stats.reconcile()
+    await other.flush()
+    assert (await mongo["inbox_stats"].find_one())["total"] == 1
+    assert (await mongo["sender_stats"].find_one({"_id": "a@example.com"}))["total"] == 1
+
+    [second] = await insert_emails(sender="a@example.com")
+    other.add_ingested([second])
+    await other.stop()
+    assert (await mongo["inbox_stats"].find_one())["total"] == 2
+    assert (await mongo["sender_stats"].find_one({"_id": "a@example.com"}))["total"] == 2
+
+
+async def test_flushes_wait_for_a_running_reconciliation(mongo):
+    await mongo["inbox_stats"].insert_one({"_id": STATS_ID, "total": 0, "reconcile_until": datetime.utcnow() + timedelta(minutes=1)})
+    other = InboxStats()
+    other.add({"total": 1})
+
+    await other.flush()
+    assert (await mongo["inbox_stats"].find_one())["total"] == 0
+    assert (await inbox_stats.reconcile())["skipped"] is True
+
+    await mongo["inbox_stats"].update_one({"_id": STATS_ID}, {"$unset": {"reconcile_until": ""}})
+    await other.stop()
+    assert (await mongo["inbox_stats"].find_one())["total"] == 1
+
+
+async def test_reconcile_keeps_senders_first_seen_while_it_runs(mongo, insert_emails, monkeypatch):
+    await insert_emails(2, sender="a@example.com")
+    await mongo["inbox_stats"].insert_one({"_id": STATS_ID, "total": 2, "unread": 2})
+    await mongo["sender_stats"].insert_one({"_id": "a@example.com", "total": 2, "unread": 2})
+    senders = mongo["sender_stats"]
+
+    class Senders:
+        """A sender document written after reconcile read the others; it has no reconciled_at."""
+        async def _find(self, *args, **kwargs):
+            async for doc in senders.find(*args, **kwargs):
+                yield doc
+            await senders.insert_one({"_id": "new@example.com", "total": 1, "unread": 1})
+
+        def find(self, *args, **kwargs):
+            return self._find(*args, **kwargs)
+
+        def __getattr__(self, name):
+            return getattr(senders, name)
+
+    monkeypatch.setattr(stats_module, "sender_collection", Senders)
+
+    result = await inbox_stats.reconcile()
+
+    assert result["drift"] == {}
+    assert result["senders_removed"] == 0
+    assert await senders.find_one({"_id": "new@example.com"}) is not None
+    assert "reconcile_until" not in await mongo["inbox_stats"].find_one()
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from app.services.ingestion import ingest_emails
+from app.services.mailbox_reader import read_mailbox
+from app.utils.db import db
+
+
+def write_jsonl(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def jsonl_email(make_email, **fields) -> str:
+    return json.dumps(make_email(**fields), default=lambda value: value.isoformat())
+
+
+def test_jsonl_malformed_line_is_yielded_as_none(tmp_path, make_email):
+    path = write_jsonl(tmp_path / "inbox.jsonl", [jsonl_email(make_email), "{not json", "", jsonl_email(make_email, sender="second@example.com")])
+    items = list(read_mailbox(path))
+    assert len(items) == 3
+    assert items[1] is None
+    assert items[2]["sender"] == "second@example.com"
+
+
+async def test_ingest_skips_malformed_lines_and_continues(tmp_path, mongo, make_email):
+    path = write_jsonl(tmp_path / "inbox.jsonl", [jsonl_email(make_email), '{"sender": "truncated', jsonl_email(make_email), "[1, 2]"])
+    stats = await ingest_emails(read_mailbox(path))
+    assert stats == {"read": 4, "inserted": 2, "skipped": 2}
+    assert await mongo["emails"].count_documents({}) == 2
+
+
+async def test_startup_fails_without_the_unique_email_index(mongo, monkeypatch):
+    create_index = type(mongo["emails"]).create_index
+
+    async def duplicates_exist(self, keys, **kwargs):
+        if kwargs.get("unique"):
+            raise OperationFailure("E11000 duplicate key error", 11000)
+        return await create_index(self, keys, **kwargs)
+
+    monkeypatch.setattr(type(mongo["emails"]), "create_index", duplicates_exist)
+    with pytest.raises(OperationFailure):
+        await db.ensure_indexes()
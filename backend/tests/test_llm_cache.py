@@ -0,0 +1,75 @@
+import pytest
+
+from app.config import settings
+from app.services.llm_cache import CacheBackend, LLMCache, MemoryCache, MongoCache
+from app.services.llm_service import llm_service
+from benchmarks.fake_llm import FakeBackend
+
+
+class BrokenCache(CacheBackend):
+    async def get(self, key):
+        raise ConnectionError("down")
+
+    async def set(self, key, value, ttl):
+        raise ConnectionError("down")
+
+    async def clear(self):
+        pass
+
+
+def test_cache_backend_requires_every_method():
+    class Partial(CacheBackend):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+async def test_hits_in_slower_tier_are_promoted(mongo):
+    memory, persistent = MemoryCache(max_entries=10), MongoCache()
+    cache = LLMCache([memory, persistent], ttl=60)
+    await persistent.set("key", "value", 60)
+
+    assert await cache.get("key") == "value"
+    assert await memory.get("key") == "value"
+    assert cache.stats()["hits"] == 1
+
+
+async def test_failing_tier_counts_errors_and_falls_through():
+    memory = MemoryCache(max_entries=10)
+    cache = LLMCache([BrokenCache(), memory], ttl=60)
+    await cache.set("key", "value")
+
+    assert await cache.get("key") == "value"
+    # The failed write, the failed read and the failed promotion
+    assert cache.stats()["errors"] == 3
+
+
+async def test_fallback_answers_are_not_cached_under_the_primary_key(fake_llm, monkeypatch):
+    backup = FakeBackend(latency_ms=0, sigma=0)
+    backup.name = "backup"
+    llm_service.register_backend(backup)
+    monkeypatch.setattr(llm_service, "fallback_provider", "backup")
+    monkeypatch.setattr(llm_service, "cache", LLMCache([MemoryCache(max_entries=10)], ttl=60))
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 0)
+    fake_llm.failure_rate = 1.0
+
+    await llm_service.generate_text("Write a reply")
+    assert backup.calls == 1
+
+    fake_llm.failure_rate = 0.0
+    await llm_service.generate_text("Write a reply")
+    await llm_service.generate_text("Write a reply")
+    assert (fake_llm.calls, backup.calls) == (2, 1)
+
+
+async def test_unparseable_json_responses_are_not_cached(fake_llm, monkeypatch):
+    monkeypatch.setattr(llm_service, "cache", LLMCache([MemoryCache(max_entries=10)], ttl=60))
+    answers = iter(['```json\n{"tasks": [', '{"tasks": []}'])
+    monkeypatch.setattr(fake_llm, "_answer", lambda prompt: next(answers))
+
+    assert await llm_service.generate_json("Extract tasks as JSON") == {}
+    assert await llm_service.generate_json("Extract tasks as JSON") == {"tasks": []}
+    assert await llm_service.generate_json("Extract tasks as JSON") == {"tasks": []}
+    assert fake_llm.calls == 2
@@ -0,0 +1,30 @@
+import pytest
+
+from app.services.llm_providers import PROVIDER_BACKENDS, ProviderBackend
+from benchmarks.fake_llm import FakeBackend
+
+
+def test_backends_must_implement_complete_and_stream():
+    class CompleteOnly(ProviderBackend):
+        name = "partial"
+
+        async def complete(self, system_prompt, prompt):
+            return "", None, None
+
+    with pytest.raises(TypeError):
+        CompleteOnly("model", 1)
+
+
+def test_provider_backends_are_instantiable():
+    for backend_class in list(PROVIDER_BACKENDS.values()) + [FakeBackend]:
+        assert isinstance(backend_class(), ProviderBackend)
+
+
+async def test_fake_backend_tracks_its_pool():
+    fake = FakeBackend(latency_ms=0, sigma=0, tokens_per_second=10000)
+    text, _, tokens = await fake.complete("system", "Categorize this email")
+    assert text in ("Important", "To-Do", "Newsletter", "Spam")
+    assert tokens > 0
+    assert "".join([chunk async for chunk in fake.stream("system", "Write a reply")]).strip()
+    assert fake.pool_stats()["requests"] == 2
+    assert fake.pool_stats()["in_flight"] == 0
@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+
+from app.config import settings
+from app.services.llm_errors import LLMProviderError, LLMUnavailableError
+from app.services.llm_service import llm_service
+from benchmarks.fake_llm import FakeBackend
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays the retry loop asked for; none of them is actually waited out."""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args, **kwargs):
+        if delay:
+            delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    return delays
+
+
+@pytest.fixture
+def backup(fake_llm, monkeypatch):
+    backend = FakeBackend(latency_ms=0, sigma=0)
+    backend.name = "backup"
+    llm_service.register_backend(backend)
+    monkeypatch.setattr(llm_service, "fallback_provider", backend.name)
+    return backend
+
+
+async def test_retries_back_off_exponentially_with_full_jitter(fake_llm, sleeps, monkeypatch):
+    bounds = []
+    monkeypatch.setattr("app.services.llm_service.random.uniform", lambda low, high: bounds.append((low, high)) or high)
+    monkeypatch.setattr(settings, "LLM_RETRY_BASE_DELAY", 1.0)
+    monkeypatch.setattr(settings, "LLM_RETRY_MAX_DELAY", 3.0)
+    fake_llm.failure_rate = 1.0
+
+    with pytest.raises(LLMUnavailableError) as raised:
+        await llm_service.generate_text("Write a reply")
+
+    assert fake_llm.calls == settings.LLM_MAX_RETRIES + 1
+    assert bounds == [(0, 2.0), (0, 3.0), (0, 3.0)]
+    assert sleeps == [2.0, 3.0, 3.0]
+    assert isinstance(raised.value.__cause__, LLMProviderError)
+
+
+async def test_a_429_is_retried_no_sooner_than_retry_after(fake_llm, monkeypatch):
+    # Another client has used up this minute's single request
+    fake_llm.rpm = 1
+    fake_llm._window = [time.monotonic()]
+    monkeypatch.setattr(fake_llm, "_answer", lambda prompt: "Done")
+    monkeypatch.setattr(settings, "LLM_RETRY_BASE_DELAY", 0.01)
+    sleeps = []
+
+    async def wait_out_the_minute(delay, *args, **kwargs):
+        if delay:
+            sleeps.append(delay)
+            fake_llm._window.clear()
+
+    monkeypatch.setattr(asyncio, "sleep", wait_out_the_minute)
+
+    assert await llm_service.generate_text("Write a reply") == "Done"
+    assert fake_llm.rate_limited == 1
+    assert len(sleeps) == 1 and sleeps[0] >= 59
+
+
+async def test_the_breaker_opens_then_lets_one_probe_through(fake_llm, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(settings, "LLM_CIRCUIT_FAILURE_THRESHOLD", 2)
+    breaker = llm_service.circuit_breaker(fake_llm.name)
+    fake_llm.failure_rate = 1.0
+
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError):
+            await llm_service.generate_text("Write a reply")
+    assert breaker.state == "open"
+
+    # While open the provider is not called at all
+    with pytest.raises(LLMUnavailableError, match="circuit is open"):
+        await llm_service.generate_text("Write a reply")
+    assert fake_llm.calls == 2
+
+    # After the cooldown one probe goes through; its failure reopens the circuit
+    breaker.opened_at -= breaker.recovery_timeout
+    with pytest.raises(LLMUnavailableError):
+        await llm_service.generate_text("Write a reply")
+    assert fake_llm.calls == 3
+    assert breaker.state == "open"
+
+    # A successful probe closes it
+    states = []
+    monkeypatch.setattr(fake_llm, "_answer", lambda prompt: states.append(breaker.state) or "Done")
+    breaker.opened_at -= breaker.recovery_timeout
+    fake_llm.failure_rate = 0.0
+    assert await llm_service.generate_text("Write a reply") == "Done"
+    assert states == ["half_open"]
+    assert breaker.snapshot() == {"state": "closed", "failures": 0}
+
+
+async def test_failing_primary_fails_over_to_the_secondary(fake_llm, backup, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(settings, "LLM_CIRCUIT_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(backup, "_answer", lambda prompt: "From the backup")
+    fake_llm.failure_rate = 1.0
+
+    for _ in range(3):
+        assert await llm_service.generate_text("Write a reply") == "From the backup"
+
+    # Once the primary's circuit opens, calls go straight to the secondary
+    assert (fake_llm.calls, backup.calls) == (2, 3)
+    assert llm_service.health()["circuit_breakers"] == {
+        fake_llm.name: {"state": "open", "failures": 2},
+        backup.name: {"state": "closed", "failures": 0},
+    }
+
+
+async def test_both_providers_failing_raises_llm_unavailable(fake_llm, backup, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 0)
+    fake_llm.failure_rate = 1.0
+    backup.failure_rate = 1.0
+
+    with pytest.raises(LLMUnavailableError, match="All LLM providers failed") as raised:
+        await llm_service.generate_text("Write a reply")
+
+    assert raised.value.status_code == 503
+    assert isinstance(raised.value.__cause__, LLMProviderError)
+    assert raised.value.__cause__.provider == backup.name
+    assert (fake_llm.calls, backup.calls) == (1, 1)
@@ -0,0 +1,14 @@
+from app.routes.emails import get_duplicate_clusters
+
+
+async def test_duplicate_clusters_sample_their_newest_members(mongo, insert_emails):
+    [original] = await insert_emails(processed=True)
+    copies = await insert_emails(4, processed=True, metadata={"duplicate_of": str(original["_id"])})
+
+    [cluster] = await get_duplicate_clusters(limit=20, sample=2)
+
+    assert cluster["original_id"] == str(original["_id"])
+    assert cluster["duplicates"] == 4
+    assert cluster["latest"] == copies[3]["timestamp"]
+    assert cluster["sample_ids"] == [str(copies[3]["_id"]), str(copies[2]["_id"])]
+    assert (await get_duplicate_clusters(limit=20, sample=0))[0]["sample_ids"] == []
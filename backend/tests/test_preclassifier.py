@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from bson.errors import InvalidDocument
+
+from app.services.preclassifier import MODEL_ID, PreClassifier, normalize_label
+
+CATEGORIES = ["Important", "Newsletter", "Spam", "To-Do"]
+
+
+def labelled(category: str) -> dict:
+    """Fields of an email the LLM has categorized."""
+    return {"processed": True, "metadata": {"category": category, "category_source": "llm"}}
+
+
+def test_labels_are_normalized_to_the_configured_categories():
+    assert normalize_label(" important.", CATEGORIES) == "Important"
+    assert normalize_label("TO-DO", CATEGORIES) == "To-Do"
+    assert normalize_label("Important: the sender needs a reply by Friday", CATEGORIES) is None
+
+
+def test_unknown_labels_do_not_grow_the_model(make_email):
+    classifier = PreClassifier()
+    assert not classifier.learn(make_email(), "Urgent!!")
+    assert classifier.learn(make_email(), "spam")
+    assert classifier.model.classes == CATEGORIES
+    assert classifier.model.weights.shape[0] == len(CATEGORIES)
+    assert classifier.model.examples == 1
+
+
+async def test_only_the_writer_trains_and_saves(mongo, insert_emails, monkeypatch):
+    monkeypatch.setattr("app.services.preclassifier.TRAINING_LAG", timedelta(0))
+    old = datetime.utcnow() - timedelta(minutes=5)
+    await insert_emails(5, **labelled("Important"), updated_at=old)
+    writer, reader = PreClassifier("writer"), PreClassifier("reader")
+
+    await writer.sync()
+    await reader.sync()
+    assert writer.is_writer and not reader.is_writer
+    assert writer.model.examples == 5
+    assert reader.model.examples == 5
+
+    # New LLM labels are learned once by the writer and reach the reader through its save
+    await insert_emails(3, **labelled("To-Do"), updated_at=datetime.utcnow())
+    reader.learned = 0
+    await writer.sync()
+    await reader.sync()
+    assert writer.model.examples == 8
+    assert reader.model.examples == 8
+    assert reader.learned == 0
+    saved = await mongo["classifier_models"].find_one({"_id": MODEL_ID})
+    assert saved["examples"] == 8
+
+
+async def test_a_model_too_large_to_save_does_not_kill_the_writer(mongo, make_email, monkeypatch):
+    classifier = PreClassifier("writer")
+    await classifier.sync()
+
+    async def too_large(*args, **kwargs):
+        raise InvalidDocument("BSON document too large")
+
+    monkeypatch.setattr(classifier, "_collection", lambda: type("C", (), {"replace_one": too_large})())
+    classifier.learn(make_email(), "Spam")
+    await classifier.save()
+    await classifier.stop()
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from app.services.llm_service import llm_service
+from app.services.processing import claim_emails, process_unprocessed_emails
+from app.services.result_sink import result_sink
+
+
+async def test_claimed_emails_are_not_claimed_by_another_owner(mongo, insert_emails):
+    docs = await insert_emails(3)
+    assert len(await claim_emails(docs, "a")) == 3
+    assert await claim_emails(docs, "b") == []
+    # Owners may re-claim their own, e.g. to retry a failure
+    assert len(await claim_emails(docs[:1], "a")) == 1
+
+
+async def test_expired_claims_can_be_taken_over(mongo, insert_emails):
+    docs = await insert_emails(2, processing_owner="dead", processing_until=datetime.utcnow() - timedelta(seconds=1))
+    assert len(await claim_emails(docs, "b")) == 2
+
+
+async def test_sweep_skips_emails_claimed_elsewhere_and_clears_its_claims(mongo, insert_emails, fake_llm):
+    await insert_emails(4)
+    other = (await mongo["emails"].find().to_list(None))[:1]
+    await claim_emails(other, "another-run")
+
+    progress = await process_unprocessed_emails(concurrency=2)
+
+    assert progress.processed == 3
+    assert await mongo["emails"].count_documents({"processed": True, "processing_owner": {"$exists": False}}) == 3
+    assert await mongo["emails"].count_documents({"processed": False, "processing_owner": "another-run"}) == 1
+
+
+async def test_failed_email_releases_its_claim(mongo, insert_emails, fake_llm, monkeypatch):
+    await insert_emails(1)
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr("app.services.processing.analyze", fail)
+    progress = await process_unprocessed_emails(concurrency=1, batch_categorization=False)
+    await result_sink.flush()
+
+    assert progress.failed == 1
+    email = await mongo["emails"].find_one()
+    assert email["processed"] is False
+    assert "processing_owner" not in email
+
+
+async def test_emails_stay_unprocessed_without_an_llm_provider(mongo, insert_emails, monkeypatch):
+    monkeypatch.setattr(llm_service, "provider", "unconfigured")
+    monkeypatch.setattr(llm_service, "fallback_provider", "")
+    monkeypatch.setattr(llm_service, "cache", None)
+    await insert_emails(2)
+
+    progress = await process_unprocessed_emails(concurrency=1, batch_categorization=False)
+    await result_sink.flush()
+
+    assert progress.failed == 2
+    assert await mongo["emails"].count_documents({"processed": False, "metadata.category": None}) == 2
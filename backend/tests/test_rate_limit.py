@@ -0,0 +1,40 @@
+from app.services.llm_service import llm_service
+from app.utils.rate_limit import RateLimiter
+
+
+def test_headers_replace_configured_limits_and_cap_buckets():
+    limiter = RateLimiter("test", requests_per_minute=500, tokens_per_minute=200000)
+    limiter.on_success({
+        "x-ratelimit-limit-requests": "60",
+        "x-ratelimit-limit-tokens": "10000",
+        "x-ratelimit-remaining-requests": "3",
+        "x-ratelimit-remaining-tokens": "900",
+    })
+    assert limiter.requests_per_minute == 60
+    assert limiter.tokens_per_minute == 10000
+    assert limiter.request_tokens <= 3
+    assert limiter.token_tokens <= 900
+
+
+def test_unparseable_or_missing_headers_leave_limits_alone():
+    limiter = RateLimiter("test", requests_per_minute=500, tokens_per_minute=200000)
+    limiter.on_success({"x-ratelimit-limit-requests": "soon"})
+    limiter.on_success(None)
+    assert limiter.requests_per_minute == 500
+    assert limiter.tokens_per_minute == 200000
+
+
+def test_rate_limited_backs_off_and_success_recovers():
+    limiter = RateLimiter("test", requests_per_minute=100)
+    limiter.on_rate_limited(retry_after=0.01)
+    assert limiter.scale == 0.5
+    limiter.on_success()
+    assert limiter.scale == 0.55
+
+
+async def test_provider_headers_reach_the_limiter(fake_llm, monkeypatch):
+    monkeypatch.setattr(fake_llm, "rpm", 40)
+    await llm_service.generate_text("Hello", operation="test")
+    limiter = llm_service.rate_limiter(fake_llm.name)
+    assert limiter.requests_per_minute == 40
+    assert limiter.request_tokens <= 39
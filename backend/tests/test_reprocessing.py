@@ -0,0 +1,16 @@
+from app.services.prompt_registry import prompt_registry
+from app.services.reprocessing import reprocess_stage
+
+
+async def test_reprocess_reads_the_prompt_version_from_the_database(mongo, insert_emails, fake_llm):
+    prompt_id = (await mongo["prompts"].insert_one({"name": "Summary", "type": "summarization", "template": "Summarize", "is_active": True, "version": 1})).inserted_id
+    await insert_emails(processed=True, metadata={"summary": "Old", "prompt_versions": {"summarization": f"{prompt_id}:1"}})
+    # Cached in this process before the edit, as a worker without a change stream would have it
+    assert (await prompt_registry.get_versioned("summarization", ""))[1] == f"{prompt_id}:1"
+    await mongo["prompts"].update_one({"_id": prompt_id}, {"$set": {"template": "Summarize briefly", "version": 2}})
+
+    progress = await reprocess_stage("summarization")
+
+    assert progress.processed == 1
+    email = await mongo["emails"].find_one()
+    assert email["metadata"]["prompt_versions"]["summarization"] == f"{prompt_id}:2"
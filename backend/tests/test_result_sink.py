@@ -0,0 +1,79 @@
+import asyncio
+
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect
+
+from app.config import settings
+from app.services.change_feed import ChangeFeedProcessor
+from app.services.processing import ProcessingProgress, _worker
+from app.services.result_sink import ResultSink, result_sink
+
+
+def break_writes(monkeypatch, mongo):
+    async def unavailable(*args, **kwargs):
+        raise AutoReconnect("primary stepped down")
+
+    monkeypatch.setattr(settings, "RESULT_SINK_MAX_RETRIES", 0)
+    monkeypatch.setattr(type(mongo["emails"]), "bulk_write", unavailable)
+
+
+async def test_callbacks_run_once_the_batch_is_written(mongo, insert_emails):
+    [email] = await insert_emails()
+    email_id = email["_id"]
+    sink, outcomes = ResultSink(), []
+    sink.add(UpdateOne({"_id": email_id}, {"$set": {"processed": True}}), on_flushed=outcomes.append)
+    assert outcomes == []
+
+    await sink.flush()
+
+    assert outcomes == [True]
+    assert (await mongo["emails"].find_one())["processed"] is True
+    assert sink.stats()["written"] == 1
+
+
+async def test_dropped_writes_are_reported_to_their_callbacks(mongo, monkeypatch):
+    break_writes(monkeypatch, mongo)
+    sink, outcomes = ResultSink(), []
+    sink.add(UpdateOne({"subject": "a"}, {"$set": {"processed": True}}), on_flushed=outcomes.append)
+    sink.add(UpdateOne({"subject": "b"}, {"$set": {"processed": True}}))
+
+    await sink.flush()
+
+    assert outcomes == [False]
+    assert sink.stats()["dropped"] == 2
+
+
+async def run_one(feed: ChangeFeedProcessor, email: dict):
+    queue: asyncio.Queue = asyncio.Queue()
+    await queue.put((email, "Newsletter"))
+    await queue.put(None)
+    feed._in_flight.add(email["_id"])
+    await _worker(queue, ProcessingProgress(), on_done=feed._on_done)
+
+
+async def test_feed_counts_an_email_done_only_after_its_result_is_written(mongo, insert_emails, fake_llm):
+    [email] = await insert_emails()
+    feed = ChangeFeedProcessor("feed")
+
+    await run_one(feed, email)
+    # Analysed, but still in flight until the sink writes it, so polling doesn't pick it up
+    assert email["_id"] in feed._in_flight
+    assert email["_id"] not in feed._recent
+
+    await result_sink.flush()
+    assert email["_id"] not in feed._in_flight
+    assert email["_id"] in feed._recent
+
+
+async def test_feed_retries_an_email_whose_result_was_dropped(mongo, insert_emails, fake_llm, monkeypatch):
+    [email] = await insert_emails()
+    feed = ChangeFeedProcessor("feed")
+
+    await run_one(feed, email)
+    break_writes(monkeypatch, mongo)
+    await result_sink.flush()
+
+    assert email["_id"] not in feed._recent
+    assert feed._failures[email["_id"]][0] == 1
+    assert email["_id"] not in feed._in_flight
+
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from app.services.search_index import SearchIndex
+
+PROJECTION = {"subject": 1, "metadata": 1}
+
+
+async def indexed_inbox(insert_emails, count=6):
+    docs = await insert_emails(count, body="The quarterly report is attached.", processed=True, metadata={"category": "Important"})
+    index = SearchIndex()
+    index.active = True
+    index.add_documents(docs)
+    return index, docs
+
+
+async def test_hits_stale_in_the_index_are_dropped_before_the_cut(mongo, insert_emails):
+    index, docs = await indexed_inbox(insert_emails)
+    # Another process deletes one email and recategorizes another
+    await mongo["emails"].delete_one({"_id": docs[0]["_id"]})
+    await mongo["emails"].update_one({"_id": docs[1]["_id"]}, {"$set": {"metadata.category": "Newsletter"}})
+
+    results, total = await index.search_documents("quarterly report", 10, "Important", "keyword", PROJECTION)
+
+    assert total == 4
+    assert {doc["_id"] for doc in results} == {doc["_id"] for doc in docs[2:]}
+    assert all("score" in doc for doc in results)
+    # The index was corrected too
+    assert len(index.text) == 5
+    _, newsletter_total = await index.search("quarterly", category="Newsletter")
+    assert newsletter_total == 1
+
+
+async def test_page_is_filled_after_dropping_stale_hits(mongo, insert_emails):
+    index, docs = await indexed_inbox(insert_emails, count=12)
+    await mongo["emails"].delete_many({"_id": {"$in": [doc["_id"] for doc in docs[:8]]}})
+
+    results, total = await index.search_documents("quarterly", 3, None, "keyword", PROJECTION)
+
+    assert len(results) == 3
+    assert total == 4
+
+
+async def test_polling_applies_category_changes_and_deletes(mongo, insert_emails):
+    index, docs = await indexed_inbox(insert_emails)
+    index._polled_at = datetime.utcnow()
+    await mongo["emails"].update_one(
+        {"_id": docs[2]["_id"]}, {"$set": {"metadata.category": "To-Do", "updated_at": datetime.utcnow()}}
+    )
+    await mongo["emails"].delete_one({"_id": docs[3]["_id"]})
+
+    await index._poll_changes()
+
+    assert len(index.text) == 5
+    hits, total = await index.search("quarterly", category="To-Do")
+    assert [email_id for email_id, _ in hits] == [docs[2]["_id"]]